@@ -0,0 +1,135 @@
+"""
+Admission control for generation requests
+Per-client token buckets cap how fast any one caller can submit work, and a
+per-model estimate of queueing delay lets requests that would wait past their
+deadline be turned away up front instead of timing out after holding a slot
+"""
+
+import math
+import threading
+import time
+
+
+class TokenBuckets:
+    """One token bucket per client key, refilled continuously at rate tokens per second"""
+
+    def __init__(self, rate, burst, prune_interval=60):
+        self.rate = rate
+        self.burst = burst
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        # key -> (tokens, updated_at)
+        self._buckets = {}
+        self._last_prune = time.monotonic()
+
+    def take(self, key, cost=1):
+        """Spend cost tokens; returns 0 if allowed, else seconds until enough have refilled"""
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                allowed = True
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed = False
+            if now - self._last_prune > self.prune_interval:
+                self._prune_locked(now)
+        return 0 if allowed else (cost - tokens) / self.rate
+
+    def _prune_locked(self, now):
+        # A bucket that has refilled completely is the same as no bucket
+        full = [key for key, (tokens, updated_at) in self._buckets.items()
+                if tokens + (now - updated_at) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        self._last_prune = now
+
+
+class SharedTokenBuckets(TokenBuckets):
+    """TokenBuckets kept in a SharedState database, so a client's limit holds across worker processes"""
+
+    def __init__(self, shared, rate, burst, prune_interval=60):
+        super().__init__(rate, burst, prune_interval)
+        self.shared = shared
+        self._last_prune = time.time()
+
+    def take(self, key, cost=1):
+        cost = min(cost, self.burst)
+        # Wall-clock time, since the timestamps are compared across processes
+        now = time.time()
+        with self.shared.transaction() as db:
+            row = db.execute("SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+            allowed = tokens >= cost
+            db.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at) VALUES (?, ?, ?)",
+                (key, tokens - cost if allowed else tokens, now)
+            )
+            if now - self._last_prune > self.prune_interval:
+                db.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - self.burst / self.rate,))
+                self._last_prune = now
+        return 0 if allowed else (cost - tokens) / self.rate
+
+
+class ModelAdmission:
+    """Estimates how long a new request would queue for a model's upstream slots
+
+    Service times are a moving average of recent successful calls; until a model
+    has one, default_service_seconds is assumed.
+    """
+
+    def __init__(self, max_wait, max_queue_per_slot=4, default_service_seconds=60, smoothing=0.2):
+        self.max_wait = max_wait
+        self.max_queue_per_slot = max_queue_per_slot
+        self.default_service_seconds = default_service_seconds
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._service_seconds = {}
+        self.shed = {}
+
+    def record(self, model_id, seconds):
+        """Fold a successful call's duration into the model's service time"""
+        with self._lock:
+            current = self._service_seconds.get(model_id)
+            self._service_seconds[model_id] = (
+                seconds if current is None else current + self.smoothing * (seconds - current)
+            )
+
+    def service_seconds(self, model_id):
+        with self._lock:
+            return self._service_seconds.get(model_id, self.default_service_seconds)
+
+    def expected_wait(self, model_id, in_flight, waiting, limit):
+        """Seconds a request arriving now would wait for a slot"""
+        ahead = in_flight + waiting - limit + 1
+        if ahead <= 0:
+            return 0.0
+        return self.service_seconds(model_id) * ahead / limit
+
+    def check(self, model_id, in_flight, waiting, limit):
+        """Return None to admit, or the Retry-After seconds for a request that should be shed"""
+        if waiting >= limit * self.max_queue_per_slot:
+            retry_after = self.service_seconds(model_id)
+        else:
+            wait = self.expected_wait(model_id, in_flight, waiting, limit)
+            if wait <= self.max_wait:
+                return None
+            retry_after = wait - self.max_wait
+        with self._lock:
+            self.shed[model_id] = self.shed.get(model_id, 0) + 1
+        return max(1, math.ceil(retry_after))
+
+    def stats(self):
+        """Service time estimate and shed count per model"""
+        with self._lock:
+            model_ids = set(self._service_seconds) | set(self.shed)
+            return {
+                model_id: {
+                    'service_seconds': round(self._service_seconds.get(model_id, self.default_service_seconds), 2),
+                    'shed': self.shed.get(model_id, 0),
+                }
+                for model_id in model_ids
+            }
@@ -0,0 +1,582 @@
+"""
+Asyncio serving mode for the enhanced backend
+Serves the same routes as backend_enhanced.py on an ASGI server. Requests that
+are waiting (for a free model slot, or on an identical generation that is
+already running) are coroutines rather than OS threads; only the upstream Space
+calls themselves occupy worker threads, and those are capped per model. Batch
+items run on the shared batch workers, job event streams wait on an asyncio
+event, and SQLite or disk lookups run as short threadpool calls.
+
+Run with: uvicorn backend_async:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import functools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from backend_enhanced import (
+    logger,
+    GenerationError,
+    FLASK_PORT,
+    CLIENT_ACQUIRE_TIMEOUT,
+    MAX_IMAGE_BYTES,
+    IMAGE_JPEG_QUALITY,
+    VIDEO_MAX_AGE_SECONDS,
+    SSE_KEEPALIVE_SECONDS,
+    MAX_BATCH_ITEMS,
+    DEFAULT_BATCH_PRIORITY,
+    describe_error,
+    check_circuit,
+    check_admission,
+    model_concurrency_limit,
+    check_rate_limit,
+    client_key,
+    parse_priority,
+    parse_text_to_video_request,
+    parse_image_to_video_request,
+    request_timeout,
+    with_deadline,
+    deadline_exceeded,
+    run_text_to_video,
+    demo_payload,
+    lookup_cached_result,
+    generated_payload,
+    record_generation_error,
+    call_text_to_video_model,
+    call_image_to_video_model,
+    image_to_video_payload,
+    log_image_info,
+    remove_temp_files,
+    health_payload,
+    job_accepted_payload,
+    job_request_summary,
+    job_payload,
+    job_event,
+    plan_batch,
+    BatchTally,
+    batch_message,
+    queue_payload,
+    tenant_weight,
+    start_job_workers,
+    job_queue,
+    image_workers,
+    batch_workers,
+    in_flight_generations,
+    http_requests,
+    http_request_seconds,
+    metrics,
+    video_store,
+)
+from job_queue import QueueFullError
+from client_pool import PoolSaturatedError
+from single_flight import AsyncSingleFlight
+from scheduler import PRIORITY_RANKS, AsyncFairSlots
+from hedging import CancelToken
+from batch import run_batch_async
+from cancellation import expired, remaining
+from result_cache import make_cache_key
+from image_upload import UploadError, CHUNK_SIZE, save_base64, save_stream
+from image_preprocess import preprocess_image
+from models_config import catalog, get_model_info
+from model_catalog import changed_models
+from video_store import guess_mimetype
+
+# Threads for the blocking Gradio calls; the per-model gates keep usage below this
+ASYNC_UPSTREAM_THREADS = int(os.getenv('ASYNC_UPSTREAM_THREADS', 32))
+
+upstream_executor = ThreadPoolExecutor(max_workers=ASYNC_UPSTREAM_THREADS, thread_name_prefix="upstream")
+
+
+class ModelGates:
+    """Per-model fair-share gates mirroring this process's share of max_concurrent_requests
+
+    Waiting here costs a coroutine instead of a thread, and waiters are admitted
+    by priority, then tenant share, like the client pool. The gate only counts
+    requests served by this module: background jobs, batches and hedged attempts
+    take client pool slots from their own worker threads, so a request let through
+    the gate can still wait for a pool slot on its upstream thread.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._gates = {}
+
+    def _gate(self, model_id):
+        gate = self._gates.get(model_id)
+        if gate is None:
+            gate = AsyncFairSlots(model_concurrency_limit(model_id), tenant_weight)
+            self._gates[model_id] = gate
+        return gate
+
+    def discard(self, model_id):
+        """Rebuild the model's gate on next use; holders of the old one release it as usual"""
+        self._gates.pop(model_id, None)
+
+    def load(self, model_id, priority=None):
+        """(in_flight, waiting, limit) for one model, as check_admission() expects"""
+        return self._gate(model_id).load(priority)
+
+    @asynccontextmanager
+    async def slot(self, model_id, deadline=None, priority='interactive', tenant=None):
+        gate = self._gate(model_id)
+        timeout = self.timeout if deadline is None else min(self.timeout, remaining(deadline))
+        try:
+            await gate.acquire(priority, tenant, timeout)
+        except TimeoutError:
+            raise PoolSaturatedError(f"All slots for {model_id} are busy (waited {timeout:.0f}s)")
+        try:
+            yield
+        finally:
+            gate.release()
+
+
+model_gates = ModelGates(CLIENT_ACQUIRE_TIMEOUT)
+
+
+def forget_changed_gates(old, new):
+    """After a catalog reload, resize the gates of models whose concurrency limit changed"""
+    for model_id in changed_models(old, new, ('max_concurrent_requests',)):
+        model_gates.discard(model_id)
+
+
+catalog.add_listener(forget_changed_gates)
+
+async_generations = AsyncSingleFlight()
+
+
+async def in_thread(executor, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+def request_ip(request):
+    return request.client.host if request.client else None
+
+
+def etag_matches(request, etag):
+    """Whether the request's If-None-Match covers the quoted etag"""
+    if_none_match = [tag.strip().removeprefix('W/') for tag in request.headers.get('if-none-match', '').split(',')]
+    return '*' in if_none_match or etag in if_none_match
+
+
+async def in_thread_cancellable(executor, func, *args, **kwargs):
+    """Run func(*args, cancel_token, **kwargs) in a thread, cancelling the token if this coroutine is cancelled"""
+    token = CancelToken()
+    try:
+        return await in_thread(executor, functools.partial(func, *args, token, **kwargs))
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
+
+
+async def until_disconnected(request, awaitable):
+    """Await awaitable, cancelling it (and any upstream job it started) if the client disconnects"""
+    task = asyncio.ensure_future(awaitable)
+
+    async def disconnected():
+        while (await request.receive())['type'] != 'http.disconnect':
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        logger.info("Client disconnected; cancelled its generation")
+        raise GenerationError('Client disconnected', 499)
+    return task.result()
+
+
+def error_response(e):
+    if isinstance(e, GenerationError):
+        return JSONResponse({'error': e.message}, e.status_code, headers=e.headers())
+    message, status_code = describe_error(e)
+    return JSONResponse({'error': message}, status_code)
+
+
+async def run_text_to_video_async(spec):
+    """Async counterpart of run_text_to_video(); cancelling it cancels the upstream job once nobody else waits"""
+    spec = with_deadline(spec)
+    if spec.get('fallback_models'):
+        # Hedged attempts already race on their own threads
+        return await in_thread_cancellable(upstream_executor, run_text_to_video, spec)
+
+    model_id = spec['model_id']
+    logger.info(f"Generating video with {model_id}")
+    if model_id == 'demo':
+        return demo_payload(spec)
+
+    cache_key = make_cache_key(model_id, spec['enhanced_prompt'], spec['seed'], get_model_info(model_id)['params'])
+    # The result cache reads disk (and SQLite with shared state), so keep it off the event loop
+    cached = await run_in_threadpool(lookup_cached_result, spec, cache_key)
+    if cached is not None:
+        return cached
+
+    async def call_upstream():
+        await run_in_threadpool(check_circuit, model_id)
+        if spec.get('shed_when_busy'):
+            check_admission(model_id, model_gates.load(model_id, spec['priority']))
+        async with model_gates.slot(model_id, spec['deadline'], spec['priority'], spec.get('tenant')):
+            # Going through the threaded single-flight group also coalesces with
+            # background jobs that run the same generation
+            payload, _ = await in_thread_cancellable(
+                upstream_executor, in_flight_generations.do,
+                cache_key, call_text_to_video_model, spec, cache_key,
+                timeout=remaining(spec['deadline'])
+            )
+            return payload
+
+    try:
+        payload, shared = await async_generations.do(cache_key, call_upstream)
+    except asyncio.CancelledError:
+        record_generation_error(model_id, GenerationError('Client disconnected', 499))
+        raise
+    except TimeoutError as e:
+        if expired(spec['deadline']):
+            e = deadline_exceeded(model_id, spec)
+        record_generation_error(model_id, e)
+        raise e
+    except Exception as e:
+        record_generation_error(model_id, e)
+        raise
+    return generated_payload(spec, payload, shared, cache_key)
+
+
+async def health(request):
+    # Job counts and cache stats may come from SQLite
+    payload = await run_in_threadpool(health_payload)
+    payload['serving_mode'] = 'asyncio'
+    payload['async_in_flight_generations'] = async_generations.in_flight()
+    return JSONResponse(payload)
+
+
+async def list_models(request):
+    current = catalog.current
+    headers = {'etag': f'"{current.etag}"', 'cache-control': 'no-cache'}
+    if etag_matches(request, headers['etag']):
+        return Response(status_code=304, headers=headers)
+    return Response(current.body, media_type='application/json', headers=headers)
+
+
+async def generate_video(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or not isinstance(data, dict):
+        return JSONResponse({'error': 'Request must be JSON'}, 400)
+
+    try:
+        tenant = client_key(request.headers.get('x-api-key'), request_ip(request))
+        await run_in_threadpool(check_rate_limit, '/generate-video', tenant)
+        spec = parse_text_to_video_request(data, request.headers.get('x-request-timeout'))
+        spec['tenant'] = tenant
+        if data.get('async'):
+            # A shared job queue counts pending jobs in SQLite
+            job = await run_in_threadpool(
+                functools.partial(job_queue.submit, 'text-to-video', run_text_to_video, spec,
+                                  request_summary=job_request_summary(spec),
+                                  priority_rank=PRIORITY_RANKS[spec['priority']]))
+            logger.info(f"Queued job {job.id} for {spec['model_id']}")
+            return JSONResponse(job_accepted_payload(job), 202)
+        spec['shed_when_busy'] = True
+        return JSONResponse(await until_disconnected(request, run_text_to_video_async(spec)))
+    except QueueFullError as e:
+        logger.warning(str(e))
+        return JSONResponse({'error': 'Too many videos are queued right now. Please try again later.'}, 503)
+    except Exception as e:
+        return error_response(e)
+
+
+async def save_request_stream(request, max_bytes):
+    """Write a raw request body to a temp file as it arrives; returns (path, size)"""
+    fd, path = tempfile.mkstemp(suffix='.upload')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(f'Image must not exceed {max_bytes // (1024 * 1024)} MB', 413)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    if size == 0:
+        os.unlink(path)
+        raise UploadError('Image upload is empty')
+    return path, size
+
+
+async def generate_video_from_image(request):
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    try:
+        tenant = client_key(request.headers.get('x-api-key'), request_ip(request))
+        await run_in_threadpool(check_rate_limit, '/generate-video-from-image', tenant)
+        if mimetype == 'application/json':
+            try:
+                data = json.loads(await request.body() or b'{}')
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                return JSONResponse({'error': 'Invalid JSON body'}, 400)
+        elif mimetype == 'multipart/form-data':
+            data = await request.form()
+        elif mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+            data = request.query_params
+        else:
+            return JSONResponse({'error': 'Request must be JSON, multipart/form-data or a raw image body'}, 400)
+
+        prompt, model_id, resize_mode = parse_image_to_video_request(data)
+        deadline = time.time() + request_timeout(get_model_info(model_id), request.headers.get('x-request-timeout'))
+        await run_in_threadpool(check_circuit, model_id)
+        check_admission(model_id, model_gates.load(model_id, 'interactive'))
+
+        upload_path = temp_image_path = None
+        try:
+            try:
+                if mimetype == 'application/json':
+                    upload_path, _ = await in_thread(image_workers, save_base64, data.get('image', ''), MAX_IMAGE_BYTES)
+                elif mimetype == 'multipart/form-data':
+                    upload = data.get('image')
+                    if upload is None or isinstance(upload, str):
+                        raise UploadError("Multipart uploads must include an 'image' file field")
+                    upload_path, _ = await in_thread(image_workers, save_stream, upload.file, MAX_IMAGE_BYTES)
+                else:
+                    upload_path, _ = await save_request_stream(request, MAX_IMAGE_BYTES)
+                temp_image_path, image_info = await in_thread(
+                    image_workers, preprocess_image, upload_path,
+                    get_model_info(model_id)['resolution'], resize_mode, IMAGE_JPEG_QUALITY
+                )
+            except UploadError as e:
+                return JSONResponse({'error': e.message}, e.status_code)
+
+            log_image_info(model_id, prompt, image_info)
+
+            async def call_upstream():
+                async with model_gates.slot(model_id, deadline, tenant=tenant):
+                    return await in_thread_cancellable(
+                        upstream_executor, call_image_to_video_model, model_id, temp_image_path, prompt, deadline,
+                        tenant=tenant
+                    )
+
+            video_url = await until_disconnected(request, call_upstream())
+        finally:
+            remove_temp_files(upload_path, temp_image_path)
+
+        return JSONResponse(image_to_video_payload(video_url, prompt, model_id, image_info))
+
+    except (GenerationError, TimeoutError) as e:
+        return error_response(e)
+    except Exception as e:
+        logger.error(f"Error in generate_video_from_image: {str(e)}", exc_info=True)
+        return JSONResponse({'error': f'An error occurred: {str(e)}'}, 500)
+
+
+async def get_job(request):
+    # Jobs this process isn't running are read from the store
+    job = await run_in_threadpool(job_queue.get, request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, 404)
+    return JSONResponse(job_payload(job))
+
+
+async def wait_for_job_change(job_id, seen_version, changed, timeout):
+    """Async counterpart of job_queue.wait_for_change(); changed is set by job_queue.watch()
+
+    Jobs running in this process wake the waiter directly; jobs owned by another
+    worker are polled from the store, each read a short threadpool call.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        changed.clear()
+        job = job_queue.peek(job_id)
+        local = job is not None
+        if not local:
+            job = await run_in_threadpool(job_queue.get, job_id)
+        if job is None or job.version != seen_version:
+            return job
+        left = deadline - loop.time()
+        if left <= 0:
+            return job
+        try:
+            await asyncio.wait_for(changed.wait(), left if local else min(left, job_queue.poll_interval))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def job_events(request):
+    """Stream job state changes as Server-Sent Events until the job finishes"""
+    job_id = request.path_params['job_id']
+    if await run_in_threadpool(job_queue.get, job_id) is None:
+        return JSONResponse({'error': 'Job not found'}, 404)
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        # Idle streams wait on this event instead of holding a thread
+        unwatch = job_queue.watch(job_id, lambda: loop.call_soon_threadsafe(changed.set))
+        try:
+            seen_version = None
+            while True:
+                current = await wait_for_job_change(job_id, seen_version, changed, SSE_KEEPALIVE_SECONDS)
+                event = job_event(current, seen_version)
+                if event is None:
+                    return
+                yield event
+                if current.version != seen_version and current.finished:
+                    return
+                seen_version = current.version
+        finally:
+            unwatch()
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'cache-control': 'no-cache', 'x-accel-buffering': 'no'})
+
+
+async def generate_videos(request):
+    """Generate a batch of text-to-video items, streaming each result as it finishes"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        return JSONResponse({'error': 'Request must be JSON with a non-empty "items" list'}, 400)
+
+    items = data['items']
+    if len(items) > MAX_BATCH_ITEMS:
+        return JSONResponse({'error': f'A batch must not exceed {MAX_BATCH_ITEMS} items'}, 400)
+
+    tenant = client_key(request.headers.get('x-api-key'), request_ip(request))
+    try:
+        # Items without their own "priority" get the batch's
+        batch_priority = parse_priority(data.get('priority'), DEFAULT_BATCH_PRIORITY)
+        # A batch spends one token per item, up to the burst size
+        await run_in_threadpool(check_rate_limit, '/generate-videos', tenant, cost=len(items))
+    except GenerationError as e:
+        return error_response(e)
+
+    accept = request.headers.get('accept', '').split(',')[0].split(';')[0].strip()
+    use_sse = data.get('format') == 'sse' or accept == 'text/event-stream'
+    unique, indexes_by_key, rejected = await run_in_threadpool(plan_batch, items, batch_priority, tenant)
+
+    async def stream():
+        # Items run on the shared batch workers; results are awaited on the event loop
+        tally = BatchTally(len(items), unique, indexes_by_key, rejected)
+        for record in rejected:
+            yield batch_message('result', record, use_sse)
+        async for key, result, error in run_batch_async(unique, run_text_to_video, model_concurrency_limit,
+                                                        batch_workers):
+            for record in tally.records(key, result, error):
+                yield batch_message('result', record, use_sse)
+        yield batch_message('summary', tally.summary(), use_sse)
+
+    return StreamingResponse(stream(), media_type='text/event-stream' if use_sse else 'application/x-ndjson',
+                             headers={'cache-control': 'no-cache', 'x-accel-buffering': 'no'})
+
+
+async def queue_status(request):
+    return JSONResponse(queue_payload({model_id: model_gates.load for model_id in catalog.current.ids()}))
+
+
+async def serve_video(request):
+    """Stream a stored video; Range requests are handled by FileResponse"""
+    video_id = request.path_params['video_id']
+    path = video_store.path_for(video_id)
+    if path is None:
+        return JSONResponse({'error': 'Video not found'}, 404)
+    headers = {
+        'etag': f'"{video_id}"',
+        'cache-control': f'public, max-age={VIDEO_MAX_AGE_SECONDS}, immutable',
+        'accept-ranges': 'bytes',
+    }
+    if etag_matches(request, headers['etag']):
+        return Response(status_code=304, headers=headers)
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        return JSONResponse({'error': 'Video not found'}, 404)
+    return FileResponse(path, media_type=guess_mimetype(path), headers=headers, stat_result=stat_result)
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+class RequestMetricsMiddleware:
+    """Records the same per-route HTTP metrics as the Flask app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = asyncio.get_running_loop().time()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                route = scope.get('route')
+                endpoint = route.path if route is not None else 'unmatched'
+                http_requests.inc(endpoint, str(message['status']))
+                http_request_seconds.observe(asyncio.get_running_loop().time() - started, endpoint)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+async def not_found(request, exc):
+    return JSONResponse({'error': 'Endpoint not found'}, 404)
+
+
+async def method_not_allowed(request, exc):
+    return JSONResponse({'error': 'Method not allowed'}, 405)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs in each worker process, so every worker writes and resumes its own jobs
+    start_job_workers()
+    yield
+
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route('/health', health, methods=['GET']),
+        Route('/models', list_models, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/generate-video', generate_video, methods=['POST']),
+        Route('/generate-video-from-image', generate_video_from_image, methods=['POST']),
+        Route('/generate-videos', generate_videos, methods=['POST']),
+        Route('/jobs/{job_id}', get_job, methods=['GET']),
+        Route('/jobs/{job_id}/events', job_events, methods=['GET']),
+        Route('/queue', queue_status, methods=['GET']),
+        Route('/videos/{video_id}', serve_video, methods=['GET', 'HEAD']),
+    ],
+    exception_handlers={404: not_found, 405: method_not_allowed},
+)
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+app.add_middleware(RequestMetricsMiddleware)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    logger.info(f"Starting asyncio server on port {FLASK_PORT}")
+    uvicorn.run(app, host='0.0.0.0', port=FLASK_PORT)
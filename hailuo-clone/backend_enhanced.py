@@ -1,25 +1,37 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 from gradio_client import Client
 import os
 import logging
 from dotenv import load_dotenv
 from datetime import datetime
-import base64
-from io import BytesIO
-from PIL import Image
+import json
+import math
 import tempfile
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from models_config import (
-    VIDEO_MODELS, 
-    CAMERA_MOVEMENTS, 
-    VISUAL_EFFECTS, 
-    VIDEO_STYLES,
-    EXAMPLE_PROMPTS,
-    get_model_info, 
-    get_available_models,
-    build_enhanced_prompt
-)
+from models_config import catalog, get_model_info, build_enhanced_prompt
+from model_catalog import changed_models
+from job_queue import JobQueue, SharedJobQueue, QueueFullError
+from job_store import JobStore
+from result_cache import ResultCache, SharedResultCache, make_cache_key
+from single_flight import SingleFlight
+from client_pool import ClientPool, SharedSlotLeases
+from scheduler import PRIORITIES, PRIORITY_RANKS, parse_weights
+from circuit_breaker import CircuitBreakers, SharedCircuitBreakers
+from hedging import run_hedged
+from cancellation import DisconnectMonitor, expired, remaining, request_socket
+from image_upload import UploadError, adopt_file, save_base64, save_stream
+from image_preprocess import RESIZE_CROP, RESIZE_MODES, preprocess_image
+from batch import run_batch
+from metrics import Registry
+from admission import ModelAdmission, SharedTokenBuckets, TokenBuckets
+from shared_state import SharedState
+from prompt_index import BANDS, FINGERPRINT_BITS, PromptIndex, similarity
+from video_store import VideoStore, guess_mimetype, source_location
 
 # Load environment variables
 load_dotenv()
@@ -35,41 +47,321 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class UploadRequest(Request):
+    """Request that spools multipart files to named temp files, so an upload can be kept without copying it"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spooled = tempfile.NamedTemporaryFile(suffix='.upload', delete=False)
+        self.spooled_paths.append(spooled.name)
+        return spooled
+    
+    @property
+    def spooled_paths(self):
+        """Spooled files not yet claimed by the handler; deleted when the request ends"""
+        return self.environ.setdefault('app.spooled_paths', [])
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
+# Let Apache/lighttpd send stored videos themselves instead of the worker
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
 
 # Configuration
 FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
 FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', 'cogvideox-5b')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', 500))
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', 3600))
+# Background jobs are kept in this SQLite file (the shared state file if there is one); empty disables it
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', os.path.join('cache', 'jobs.db'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 15))
+SSE_KEEPALIVE_SECONDS = 15
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+# Room for the prompt and other fields next to the image in a request body
+MAX_FORM_OVERHEAD_BYTES = int(os.getenv('MAX_FORM_OVERHEAD_BYTES', 64 * 1024))
+# Reject larger bodies before werkzeug reads them; base64 JSON images are 4/3 the size of the file
+app.config['MAX_CONTENT_LENGTH'] = math.ceil(MAX_IMAGE_BYTES * 4 / 3) + MAX_FORM_OVERHEAD_BYTES
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 16))
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', 500))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', os.cpu_count() or 2))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 90))
+DEFAULT_MAX_CONCURRENT_REQUESTS = int(os.getenv('DEFAULT_MAX_CONCURRENT_REQUESTS', 2))
+CLIENT_ACQUIRE_TIMEOUT = float(os.getenv('CLIENT_ACQUIRE_TIMEOUT', 30))
+CLIENT_MAX_FAILURES = int(os.getenv('CLIENT_MAX_FAILURES', 3))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 3))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv('BREAKER_COOLDOWN_SECONDS', 60))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join('cache', 'results'))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv('RESULT_CACHE_TTL_SECONDS', 86400))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 10000))
+VIDEO_STORE_DIR = os.getenv('VIDEO_STORE_DIR', os.path.join('cache', 'videos'))
+VIDEO_STORE_MAX_BYTES = int(os.getenv('VIDEO_STORE_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+VIDEO_DOWNLOAD_TIMEOUT = float(os.getenv('VIDEO_DOWNLOAD_TIMEOUT', 120))
+# Prefix for /videos/<digest> links, e.g. https://api.example.com (default: relative links)
+VIDEO_BASE_URL = os.getenv('VIDEO_BASE_URL', '').rstrip('/')
+VIDEO_MAX_AGE_SECONDS = 365 * 24 * 3600
+# Per-client limit on generation requests (API key or IP); 0 disables it
+RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', 30))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 10))
+# Requests expected to queue longer than this for a model are shed with 429
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', CLIENT_ACQUIRE_TIMEOUT))
+ADMISSION_MAX_QUEUE_PER_SLOT = int(os.getenv('ADMISSION_MAX_QUEUE_PER_SLOT', 4))
+ADMISSION_DEFAULT_SERVICE_SECONDS = float(os.getenv('ADMISSION_DEFAULT_SERVICE_SECONDS', 60))
+# Near-duplicate prompt matching for requests that send "allow_similar": true
+PROMPT_INDEX_MAX_ENTRIES = int(os.getenv('PROMPT_INDEX_MAX_ENTRIES', 1_000_000))
+PROMPT_SIMILARITY_THRESHOLD = float(os.getenv('PROMPT_SIMILARITY_THRESHOLD', 0.95))
+# Multi-process deployments (see gunicorn.conf.py) keep cross-worker state in this SQLite file
+SHARED_STATE_PATH = os.getenv('SHARED_STATE_PATH')
+# Number of worker processes; more than one needs SHARED_STATE_PATH so per-model limits hold across them
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+
+# Seconds a generation may take: the X-Request-Timeout header, else the model's timeout_seconds, else this
+DEFAULT_REQUEST_TIMEOUT_SECONDS = float(os.getenv('DEFAULT_REQUEST_TIMEOUT_SECONDS', 600))
+MAX_REQUEST_TIMEOUT_SECONDS = float(os.getenv('MAX_REQUEST_TIMEOUT_SECONDS', 3600))
+# How often waiting requests' connections are checked for a disconnected client
+DISCONNECT_POLL_SECONDS = float(os.getenv('DISCONNECT_POLL_SECONDS', 1))
+
+# Priority of requests that don't send "priority": synchronous ones are interactive
+DEFAULT_JOB_PRIORITY = os.getenv('DEFAULT_JOB_PRIORITY', 'batch')
+DEFAULT_BATCH_PRIORITY = os.getenv('DEFAULT_BATCH_PRIORITY', 'batch')
+# Fair-share weights per tenant (the rate-limit identity), e.g. "key:partner=4,ip:10.0.0.5=2"; others get 1
+TENANT_WEIGHTS = parse_weights(os.getenv('TENANT_WEIGHTS', ''))
 
 # Constants
 MAX_PROMPT_LENGTH = 1000
 MIN_PROMPT_LENGTH = 3
 
-# Model clients cache
-model_clients = {}
+# State shared by all worker processes, or None for a single process
+if WEB_WORKERS > 1 and not SHARED_STATE_PATH:
+    raise RuntimeError(f"WEB_WORKERS is {WEB_WORKERS} but SHARED_STATE_PATH is not set; "
+                       f"per-model limits can't hold across worker processes without it")
+shared_state = SharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+# Finished generations, keyed by model + enhanced prompt + seed + params
+result_cache_options = dict(
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    max_entries=RESULT_CACHE_MAX_ENTRIES
+)
+if shared_state:
+    result_cache = SharedResultCache(shared_state, RESULT_CACHE_DIR, **result_cache_options)
+else:
+    result_cache = ResultCache(RESULT_CACHE_DIR, **result_cache_options)
+
+# Fingerprints of generated prompts per (model, seed), pointing at result cache keys
+prompt_index = PromptIndex(max_entries=PROMPT_INDEX_MAX_ENTRIES)
+
+def index_cached_prompts():
+    """Fill the prompt index from results cached by earlier runs"""
+    started = time.monotonic()
+    for key, payload in result_cache.iter_payloads():
+        if 'seed' in payload and payload.get('enhanced_prompt') and payload.get('model'):
+            prompt_index.add((payload['model'], payload['seed']), payload['enhanced_prompt'], bytes.fromhex(key))
+    if len(prompt_index):
+        logger.info(f"Indexed {len(prompt_index)} cached prompts in {time.monotonic() - started:.2f}s")
+
+index_cached_prompts()
+
+# Finished videos copied off the Spaces, served from /videos/<digest>
+video_store = VideoStore(
+    VIDEO_STORE_DIR,
+    max_bytes=VIDEO_STORE_MAX_BYTES,
+    download_timeout=VIDEO_DOWNLOAD_TIMEOUT
+)
+
+# Admission control: per-client token buckets and per-model queueing estimates
+if RATE_LIMIT_PER_MINUTE <= 0:
+    rate_limiter = None
+elif shared_state:
+    rate_limiter = SharedTokenBuckets(shared_state, RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+else:
+    rate_limiter = TokenBuckets(RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+model_admission = ModelAdmission(
+    max_wait=ADMISSION_MAX_WAIT_SECONDS,
+    max_queue_per_slot=ADMISSION_MAX_QUEUE_PER_SLOT,
+    default_service_seconds=ADMISSION_DEFAULT_SERVICE_SECONDS
+)
+
+# Image decode/resize work runs here so a burst of uploads can't take every CPU
+image_workers = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-worker")
+
+# Shared by all /generate-videos batches; per-model limits are applied on top
+batch_workers = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch-worker")
+
+# Generations currently running upstream, keyed like the result cache
+in_flight_generations = SingleFlight()
+
+# Cancels the generation of a synchronous request whose client went away
+disconnect_monitor = DisconnectMonitor(poll_interval=DISCONNECT_POLL_SECONDS)
+
+# Metrics exposed on /metrics; gauges are read from the live objects at scrape time
+metrics = Registry()
+http_requests = metrics.counter(
+    'videoai_http_requests_total', 'HTTP responses by route and status', ('endpoint', 'status'))
+http_request_seconds = metrics.histogram(
+    'videoai_http_request_seconds', 'Time to produce an HTTP response (streams: until headers)', ('endpoint',))
+generation_requests = metrics.counter(
+    'videoai_generation_requests_total', 'Generation requests by model and how they were served', ('model', 'result'))
+generation_errors = metrics.counter(
+    'videoai_generation_errors_total', 'Failed generations by model and error type', ('model', 'error_type'))
+predict_seconds = metrics.histogram(
+    'videoai_predict_seconds', 'Upstream Space call latency', ('model', 'outcome'),
+    buckets=(1, 5, 10, 20, 30, 60, 90, 120, 180, 240, 300, 600))
+client_build_seconds = metrics.histogram(
+    'videoai_client_build_seconds', 'Time to construct a Gradio client', ('model', 'outcome'),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+metrics.gauge('videoai_predict_in_flight', 'Upstream calls currently running', ('model',),
+              lambda: {(model_id,): stats['in_flight'] for model_id, stats in client_pool.stats().items()})
+metrics.gauge('videoai_predict_waiting', 'Requests waiting for a free upstream slot', ('model',),
+              lambda: {(model_id,): stats['waiting'] for model_id, stats in client_pool.stats().items()})
+metrics.gauge('videoai_predict_waiting_by_priority', 'Requests waiting for a free upstream slot by priority',
+              ('model', 'priority'),
+              lambda: {(model_id, priority): count for model_id, stats in client_pool.stats().items()
+                       for priority, count in stats['waiting_by_priority'].items()})
+metrics.gauge('videoai_jobs', 'Background jobs by state', ('state',),
+              lambda: {(state,): count for state, count in job_queue.counts().items()})
+metrics.gauge('videoai_circuit_open', 'Circuit state per model (0 closed, 1 half-open, 2 open)', ('model',),
+              lambda: {(model_id,): {'closed': 0, 'half_open': 1, 'open': 2}[stats['state']]
+                       for model_id, stats in circuit_breakers.stats().items()})
+metrics.counter_callback('videoai_result_cache_lookups_total', 'Result cache lookups by outcome', ('result',),
+                         lambda: {('hit',): result_cache.hits, ('miss',): result_cache.misses})
+metrics.gauge('videoai_result_cache_hit_ratio', 'Share of result cache lookups that hit', (),
+              lambda: {(): result_cache.stats()['hit_rate']})
+metrics.gauge('videoai_result_cache_bytes', 'Size of the result cache on disk', (),
+              lambda: {(): result_cache.stats()['bytes']})
+rate_limited_requests = metrics.counter(
+    'videoai_rate_limited_requests_total', 'Requests rejected by the per-client rate limit', ('endpoint',))
+metrics.counter_callback('videoai_shed_requests_total', 'Requests shed because the model queue was too long', ('model',),
+                         lambda: {(model_id,): stats['shed'] for model_id, stats in model_admission.stats().items()})
+metrics.gauge('videoai_service_seconds_estimate', 'Moving average of upstream call time used for admission', ('model',),
+              lambda: {(model_id,): stats['service_seconds'] for model_id, stats in model_admission.stats().items()})
+video_ingests = metrics.counter(
+    'videoai_video_ingests_total', 'Space outputs copied into the local video store', ('model', 'outcome'))
+metrics.gauge('videoai_video_store_bytes', 'Size of the local video store', (),
+              lambda: {(): video_store.stats()['bytes']})
+metrics.counter_callback('videoai_coalesced_requests_total', 'Requests attached to an identical in-flight generation', (),
+                         lambda: {(): in_flight_generations.coalesced})
+
+def error_type(e):
+    """Label an exception with the error branch describe_error() puts it in"""
+    if isinstance(e, GenerationError):
+        return {400: 'ValueError', 429: 'Overloaded', 503: 'ConnectionError', 504: 'TimeoutError'}.get(e.status_code, 'other')
+    for error_class in (ValueError, ConnectionError, TimeoutError):
+        if isinstance(e, error_class):
+            return error_class.__name__
+    return 'other'
+
+def create_client(model_id):
+    """Connect a new Gradio client to the model's Hugging Face Space"""
+    model_info = get_model_info(model_id)
+    space_url = model_info['space_url']
+    logger.info(f"Initializing client for {model_id}: {space_url}")
+    
+    # Try to connect with timeout
+    started = time.monotonic()
+    try:
+        client = Client(space_url, verbose=False)
+    except Exception:
+        client_build_seconds.observe(time.monotonic() - started, model_id, 'error')
+        raise
+    client_build_seconds.observe(time.monotonic() - started, model_id, 'ok')
+    logger.info(f"Successfully connected to {model_id}")
+    return client
+
+def model_concurrency_limit(model_id):
+    """The model's max_concurrent_requests; with shared state, client_pool enforces it across all workers"""
+    return get_model_info(model_id).get('max_concurrent_requests', DEFAULT_MAX_CONCURRENT_REQUESTS)
+
+def tenant_weight(tenant):
+    """A tenant's share of a model's slots relative to others of the same priority"""
+    return TENANT_WEIGHTS.get(tenant, 1)
+
+# Model clients, built once per model and shared with a cap on concurrent predict calls;
+# free slots go to waiting requests by priority, then by tenant share
+client_pool = ClientPool(
+    create_client,
+    model_concurrency_limit,
+    acquire_timeout=CLIENT_ACQUIRE_TIMEOUT,
+    max_failures=CLIENT_MAX_FAILURES,
+    weight_for=tenant_weight,
+    shared_slots=SharedSlotLeases(shared_state) if shared_state else None
+)
+
+def forget_changed_clients(old, new):
+    """After a catalog reload, drop pool slots for models whose Space or concurrency limit changed"""
+    for model_id in changed_models(old, new, ('space_url', 'max_concurrent_requests')):
+        logger.info(f"Model {model_id} changed in the catalog; its client will be rebuilt")
+        client_pool.discard(model_id)
+
+catalog.add_listener(forget_changed_clients)
+
+# Spaces that keep failing (or are asleep) are skipped for a cool-down window
+breaker_options = dict(
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    cooldown_seconds=BREAKER_COOLDOWN_SECONDS
+)
+if shared_state:
+    circuit_breakers = SharedCircuitBreakers(shared_state, **breaker_options)
+else:
+    circuit_breakers = CircuitBreakers(**breaker_options)
+
+def check_circuit(model_id):
+    """Fail fast if the model's Space is known to be down"""
+    if not circuit_breakers.allow(model_id):
+        retry_after = circuit_breakers.retry_after(model_id)
+        logger.warning(f"Circuit open for {model_id}, rejecting request (retry in {retry_after}s)")
+        raise GenerationError(
+            f'Model {model_id} is currently unavailable. Try again in {retry_after} seconds or use a different model.',
+            503,
+            retry_after=retry_after
+        )
+
+def client_key(api_key, remote_addr):
+    """Rate-limit identity of a caller: their API key if they sent one, else their IP"""
+    return f"key:{api_key}" if api_key else f"ip:{remote_addr}"
+
+def check_rate_limit(endpoint, key, cost=1):
+    """Spend the caller's tokens or fail with 429"""
+    if rate_limiter is None:
+        return
+    retry_after = rate_limiter.take(key, cost)
+    if retry_after:
+        rate_limited_requests.inc(endpoint)
+        logger.warning(f"Rate limit exceeded for {key} on {endpoint}")
+        raise GenerationError('Too many requests. Please slow down.', 429, retry_after=max(1, math.ceil(retry_after)))
+
+def check_admission(model_id, load=None, priority='interactive'):
+    """Shed a request up front if it would queue longer than ADMISSION_MAX_WAIT_SECONDS
+
+    load is (in_flight, waiting, limit); it defaults to the client pool's view of the
+    model, counting only the waiting requests a request of this priority queues behind.
+    """
+    in_flight, waiting, limit = load or client_pool.load(model_id, priority)
+    retry_after = model_admission.check(model_id, in_flight, waiting, limit)
+    if retry_after is not None:
+        logger.warning(f"Shedding request for {model_id}: {in_flight} running, {waiting} waiting")
+        raise GenerationError(
+            f'{model_id} is at capacity. Try again in {retry_after} seconds or use a different model.',
+            429,
+            retry_after=retry_after
+        )
 
 def get_or_create_client(model_id):
     """Get or create a Gradio client for the specified model"""
-    if model_id not in model_clients:
-        try:
-            model_info = get_model_info(model_id)
-            space_url = model_info['space_url']
-            logger.info(f"Initializing client for {model_id}: {space_url}")
-            
-            # Try to connect with timeout
-            model_clients[model_id] = Client(space_url, verbose=False)
-            logger.info(f"Successfully connected to {model_id}")
-        except Exception as e:
-            logger.error(f"Failed to initialize client for {model_id}: {str(e)}")
-            logger.error(f"This might be because:")
-            logger.error(f"  1. The Hugging Face Space is not available or sleeping")
-            logger.error(f"  2. The Space URL has changed")
-            logger.error(f"  3. The Space requires authentication")
-            logger.error(f"  4. Network connectivity issues")
-            return None
-    return model_clients.get(model_id)
+    try:
+        return client_pool.get_client(model_id)
+    except Exception as e:
+        # A Space that can't even be reached is not worth retrying on the next request
+        circuit_breakers.record_failure(model_id, e, trip=True)
+        logger.error(f"Failed to initialize client for {model_id}: {str(e)}")
+        logger.error(f"This might be because:")
+        logger.error(f"  1. The Hugging Face Space is not available or sleeping")
+        logger.error(f"  2. The Space URL has changed")
+        logger.error(f"  3. The Space requires authentication")
+        logger.error(f"  4. Network connectivity issues")
+        return None
 
 def validate_prompt(prompt):
     """Validate the input prompt"""
@@ -86,40 +378,84 @@ def validate_prompt(prompt):
     
     return True, prompt
 
-def decode_base64_image(base64_string):
-    """Decode base64 image string to PIL Image"""
-    try:
-        # Remove data URL prefix if present
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        image_data = base64.b64decode(base64_string)
-        image = Image.open(BytesIO(image_data))
-        return image
-    except Exception as e:
-        logger.error(f"Failed to decode image: {str(e)}")
-        return None
+def save_image_upload(data):
+    """Save the request's image to a temp file, however it was sent; returns (path, size)"""
+    if request.is_json:
+        return save_base64(data.get('image', ''), MAX_IMAGE_BYTES)
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            raise UploadError("Multipart uploads must include an 'image' file field")
+        # The form parser already spooled the file to disk (see UploadRequest); keep it rather than copying it
+        upload.stream.close()
+        request.spooled_paths.remove(upload.stream.name)
+        return adopt_file(upload.stream.name, MAX_IMAGE_BYTES)
+    
+    # Raw image body: read straight from the socket without buffering it in memory
+    return save_stream(request.stream, MAX_IMAGE_BYTES)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+@app.teardown_request
+def remove_spooled_uploads(exc):
+    if request.spooled_paths:
+        # Close them first; Windows can't delete open files
+        request.close()
+        remove_temp_files(*request.spooled_paths)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    http_requests.inc(endpoint, str(response.status_code))
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        http_request_seconds.observe(time.monotonic() - started, endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return jsonify(health_payload())
+
+def health_payload():
+    """Body of the /health response"""
+    return {
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'available_models': list(VIDEO_MODELS.keys()),
-        'default_model': DEFAULT_MODEL
-    })
+        'worker_pid': os.getpid(),
+        'shared_state': SHARED_STATE_PATH,
+        'available_models': catalog.current.ids(),
+        'model_catalog': catalog.stats(),
+        'default_model': DEFAULT_MODEL,
+        'jobs': job_queue.counts(),
+        'job_store': job_store.stats() if job_store else None,
+        'result_cache': result_cache.stats(),
+        'prompt_index_entries': len(prompt_index),
+        'in_flight_generations': in_flight_generations.in_flight(),
+        'coalesced_requests': in_flight_generations.coalesced,
+        'clients': client_pool.stats(),
+        'circuits': circuit_breakers.stats(),
+        'admission': model_admission.stats(),
+        'video_store': video_store.stats()
+    }
 
 @app.route('/models', methods=['GET'])
 def list_models():
     """List all available video generation models"""
-    return jsonify({
-        'models': get_available_models(),
-        'camera_movements': CAMERA_MOVEMENTS,
-        'visual_effects': VISUAL_EFFECTS,
-        'video_styles': VIDEO_STYLES,
-        'example_prompts': EXAMPLE_PROMPTS
-    })
+    # The body and its ETag are built once per catalog version
+    current = catalog.current
+    response = Response(current.body, mimetype='application/json')
+    response.set_etag(current.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/test-video', methods=['POST'])
 def test_video():
@@ -140,211 +476,985 @@ def test_video():
         'note': 'This is a demo video. Connect to Hugging Face Spaces for real generation.'
     })
 
-@app.route('/generate-video', methods=['POST'])
-def generate_video():
-    """Generate video from text prompt with advanced options"""
+class GenerationError(Exception):
+    """Error raised while generating a video, carrying the HTTP status to return"""
+
+    def __init__(self, message, status_code=500, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+    
+    def headers(self):
+        """Extra response headers for this error"""
+        return {'Retry-After': str(self.retry_after)} if self.retry_after else {}
+
+def describe_error(e):
+    """Map an exception from the generation path to (error message, HTTP status)"""
+    if isinstance(e, GenerationError):
+        return e.message, e.status_code
+    
+    if isinstance(e, ValueError):
+        logger.error(f"Validation error: {str(e)}")
+        return f'Invalid input: {str(e)}', 400
+    
+    if isinstance(e, ConnectionError):
+        logger.error(f"Connection error: {str(e)}")
+        return 'Failed to connect to video generation service. Please try again later.', 503
+    
+    if isinstance(e, TimeoutError):
+        logger.error(f"Timeout error: {str(e)}")
+        return 'Request timed out. The service may be busy. Please try again.', 504
+    
+    logger.error(f"Unexpected error in generate_video: {str(e)}", exc_info=True)
+    return 'An unexpected error occurred. Please try again later.', 500
+
+job_queue_options = dict(
+    max_workers=JOB_WORKERS,
+    max_pending=MAX_PENDING_JOBS,
+    retention_seconds=JOB_RETENTION_SECONDS,
+    error_handler=describe_error
+)
+# Durable record of every background job, so a restart resumes unfinished ones
+job_store_state = shared_state or (SharedState(JOB_STORE_PATH) if JOB_STORE_PATH else None)
+if job_store_state:
+    job_store = JobStore(job_store_state, retention_seconds=JOB_RETENTION_SECONDS, lease_seconds=JOB_LEASE_SECONDS)
+    job_queue_options.update(store=job_store, max_attempts=JOB_MAX_ATTEMPTS)
+else:
+    job_store = None
+if shared_state:
+    job_queue = SharedJobQueue(**job_queue_options)
+else:
+    job_queue = JobQueue(**job_queue_options)
+
+def request_timeout(model_info, header_value=None):
+    """Seconds a generation may take: the X-Request-Timeout header, else the model's timeout_seconds"""
+    if header_value:
+        try:
+            timeout = float(header_value)
+        except ValueError:
+            raise GenerationError('X-Request-Timeout must be a number of seconds', 400)
+        if not timeout > 0:
+            raise GenerationError('X-Request-Timeout must be positive', 400)
+        return min(timeout, MAX_REQUEST_TIMEOUT_SECONDS)
+    return model_info.get('timeout_seconds', DEFAULT_REQUEST_TIMEOUT_SECONDS)
+
+def with_deadline(spec):
+    """The spec with an absolute deadline, counted from now if it doesn't have one yet"""
+    if spec.get('deadline') is not None:
+        return spec
+    timeout = spec.get('timeout') or request_timeout(get_model_info(spec['model_id']))
+    return dict(spec, timeout=timeout, deadline=time.time() + timeout)
+
+def deadline_exceeded(model_id, spec):
+    logger.warning(f"Deadline passed for {model_id} after {spec.get('timeout')}s")
+    return GenerationError(f'The video was not ready within the {spec.get("timeout")}s deadline. Please try again.', 504)
+
+def parse_priority(value, default):
+    """A request's scheduling class: interactive, batch or background"""
+    priority = value or default
+    if priority not in PRIORITY_RANKS:
+        raise GenerationError(f"priority must be one of: {', '.join(PRIORITIES)}", 400)
+    return priority
+
+def parse_text_to_video_request(data, timeout_header=None, default_priority=None):
+    """Validate a /generate-video request body and build the generation spec
+
+    timeout_header is the X-Request-Timeout value, if any; the deadline itself
+    starts when the generation does (see with_deadline()). Without a "priority",
+    async jobs get DEFAULT_JOB_PRIORITY and other requests default_priority
+    (interactive unless given).
+    """
+    base_prompt = data.get('prompt', '').strip()
+    model_id = data.get('model', DEFAULT_MODEL)
+    
+    current = catalog.current
+    
+    # Advanced options (Hailuo-inspired), given by name or by tag text
+    camera_movement = current.resolve_tag('camera_movements', data.get('camera_movement', ''))
+    visual_effect = current.resolve_tag('visual_effects', data.get('visual_effect', ''))
+    style = current.resolve_tag('video_styles', data.get('style', ''))
+    seed = int(data.get('seed', 0))
+    use_cache = bool(data.get('use_cache', True))
+    
+    # Opt-in: accept a cached video made for a near-identical prompt
+    similarity_threshold = data.get('similarity_threshold')
+    if similarity_threshold is not None:
+        similarity_threshold = float(similarity_threshold)
+        if not 0 < similarity_threshold <= 1:
+            raise GenerationError('similarity_threshold must be between 0 and 1', 400)
+    elif data.get('allow_similar'):
+        similarity_threshold = PROMPT_SIMILARITY_THRESHOLD
+    
+    # Latency options: other models to fall back to, and how long to wait before racing them
+    hedge_after = data.get('hedge_after')
+    if hedge_after is not None:
+        hedge_after = float(hedge_after)
+        if hedge_after < 0:
+            raise GenerationError('hedge_after must not be negative', 400)
+    
+    if default_priority is None:
+        default_priority = DEFAULT_JOB_PRIORITY if data.get('async') else 'interactive'
+    priority = parse_priority(data.get('priority'), default_priority)
+    
+    # Validate prompt
+    is_valid, result = validate_prompt(base_prompt)
+    if not is_valid:
+        logger.warning(f"Invalid prompt: {result}")
+        raise GenerationError(result, 400)
+    
+    base_prompt = result
+    
+    # Validate model
+    model_info = current.get(model_id)
+    if model_info is None:
+        raise GenerationError(f'Invalid model: {model_id}', 400)
+    
+    # Check if model supports text-to-video
+    if model_info['type'] != 'text-to-video':
+        raise GenerationError(f'Model {model_id} does not support text-to-video generation', 400)
+    
+    fallback_models = resolve_fallback_models(model_id, data.get('fallback_models'))
+    
+    # Build enhanced prompt with camera movements and effects
+    enhanced_prompt = build_enhanced_prompt(base_prompt, camera_movement, visual_effect, style)
+    
+    return {
+        'base_prompt': base_prompt,
+        'enhanced_prompt': enhanced_prompt,
+        'model_id': model_id,
+        'seed': seed,
+        'use_cache': use_cache,
+        'similarity_threshold': similarity_threshold,
+        'fallback_models': fallback_models,
+        'hedge_after': hedge_after,
+        'timeout': request_timeout(model_info, timeout_header),
+        'priority': priority,
+    }
+
+def resolve_fallback_models(model_id, requested):
+    """Validate a fallback chain; "auto" means the other text-to-video models in catalog order"""
+    if not requested or model_id == 'demo':
+        return []
+    
+    current = catalog.current
+    if requested == 'auto':
+        model_ids = current.ids()
+        start = model_ids.index(model_id) + 1 if model_id in current else 0
+        demos = set(current.ids(feature='demo'))
+        candidates = set(current.ids(type='text-to-video')) - demos
+        return [
+            candidate for candidate in model_ids[start:] + model_ids[:start]
+            if candidate != model_id and candidate in candidates
+        ]
+    
+    if not isinstance(requested, list):
+        raise GenerationError('fallback_models must be a list of model IDs or "auto"', 400)
+    
+    fallback_models = []
+    for candidate in requested:
+        info = current.get(candidate)
+        if info is None:
+            raise GenerationError(f'Invalid fallback model: {candidate}', 400)
+        if info['type'] != 'text-to-video':
+            raise GenerationError(f'Fallback model {candidate} does not support text-to-video generation', 400)
+        if candidate != model_id and candidate not in fallback_models:
+            fallback_models.append(candidate)
+    return fallback_models
+
+def run_text_to_video(spec, cancel_token=None):
+    """Run a validated text-to-video generation and return the response payload
+
+    Cancelling cancel_token (e.g. on client disconnect) cancels the upstream job
+    unless other requests are waiting on it.
+    """
+    spec = with_deadline(spec)
+    if spec.get('fallback_models'):
+        return run_with_fallbacks(spec, cancel_token)
+    
+    base_prompt = spec['base_prompt']
+    enhanced_prompt = spec['enhanced_prompt']
+    model_id = spec['model_id']
+    model_info = get_model_info(model_id)
+    
+    logger.info(f"Generating video with {model_id}")
+    logger.info(f"Base prompt: {base_prompt[:100]}...")
+    logger.info(f"Enhanced prompt: {enhanced_prompt[:150]}...")
+    
+    # Handle demo mode specially
+    if model_id == 'demo':
+        return demo_payload(spec)
+    
+    # Serve repeated prompt/option combinations without calling the Space
+    cache_key = make_cache_key(model_id, enhanced_prompt, spec['seed'], model_info['params'])
+    cached = lookup_cached_result(spec, cache_key)
+    if cached is not None:
+        return cached
+    
+    # Attach to an identical generation that is already running instead of starting another
     try:
-        # Validate request data
-        if not request.json:
-            return jsonify({'error': 'Request must be JSON'}), 400
-        
-        data = request.json
-        base_prompt = data.get('prompt', '').strip()
-        model_id = data.get('model', DEFAULT_MODEL)
-        
-        # Advanced options (Hailuo-inspired)
-        camera_movement = data.get('camera_movement', '')
-        visual_effect = data.get('visual_effect', '')
-        style = data.get('style', '')
-        
-        # Validate prompt
-        is_valid, result = validate_prompt(base_prompt)
-        if not is_valid:
-            logger.warning(f"Invalid prompt: {result}")
-            return jsonify({'error': result}), 400
-        
-        base_prompt = result
-        
-        # Validate model
-        if model_id not in VIDEO_MODELS:
-            return jsonify({'error': f'Invalid model: {model_id}'}), 400
-        
-        model_info = get_model_info(model_id)
-        
-        # Check if model supports text-to-video
-        if model_info['type'] != 'text-to-video':
-            return jsonify({'error': f'Model {model_id} does not support text-to-video generation'}), 400
-        
-        # Build enhanced prompt with camera movements and effects
-        enhanced_prompt = build_enhanced_prompt(base_prompt, camera_movement, visual_effect, style)
-        
-        logger.info(f"Generating video with {model_id}")
-        logger.info(f"Base prompt: {base_prompt[:100]}...")
-        logger.info(f"Enhanced prompt: {enhanced_prompt[:150]}...")
-        
-        # Handle demo mode specially
-        if model_id == 'demo':
-            logger.info("Demo mode activated - returning sample video")
-            return jsonify({
-                'video_url': 'https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4',
-                'prompt': base_prompt,
-                'enhanced_prompt': enhanced_prompt,
-                'model': model_id,
-                'model_name': model_info['name'],
-                'timestamp': datetime.now().isoformat(),
-                'note': 'Demo mode: This is a sample video. Select a real model for AI generation.'
-            })
-        
+        payload, shared = in_flight_generations.do(cache_key, call_text_to_video_model, spec, cache_key, cancel_token,
+                                                   timeout=remaining(spec['deadline']))
+    except TimeoutError as e:
+        if not expired(spec['deadline']):
+            record_generation_error(model_id, e)
+            raise
+        error = deadline_exceeded(model_id, spec)
+        record_generation_error(model_id, error)
+        raise error
+    except Exception as e:
+        record_generation_error(model_id, e)
+        raise
+    return generated_payload(spec, payload, shared, cache_key)
+
+def demo_payload(spec):
+    """Sample-video response for the demo model"""
+    logger.info("Demo mode activated - returning sample video")
+    generation_requests.inc(spec['model_id'], 'demo')
+    return {
+        'video_url': 'https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4',
+        'prompt': spec['base_prompt'],
+        'enhanced_prompt': spec['enhanced_prompt'],
+        'model': spec['model_id'],
+        'model_name': get_model_info(spec['model_id'])['name'],
+        'timestamp': datetime.now().isoformat(),
+        'note': 'Demo mode: This is a sample video. Select a real model for AI generation.'
+    }
+
+def load_cached_result(cache_key):
+    """(payload, stored_at) for a cached result whose video is still available, or None"""
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return None
+    payload, stored_at = cached
+    if payload.get('video_id') and not video_store.contains(payload['video_id']):
+        # The video was evicted from the local store; generate it again
+        logger.info(f"Cached result {cache_key[:12]} lost its stored video")
+        return None
+    return cached
+
+def lookup_cached_result(spec, cache_key):
+    """Return the cached response for a spec, or None if it has to be generated"""
+    if not spec['use_cache']:
+        return None
+    cached = load_cached_result(cache_key)
+    if cached is None:
+        return lookup_similar_result(spec)
+    payload, stored_at = cached
+    logger.info(f"Cache hit for {spec['model_id']}: {cache_key[:12]}")
+    generation_requests.inc(spec['model_id'], 'cache_hit')
+    payload.update({
+        'prompt': spec['base_prompt'],
+        'cache': 'hit',
+        'cached_at': datetime.fromtimestamp(stored_at).isoformat(),
+        'timestamp': datetime.now().isoformat()
+    })
+    return payload
+
+def lookup_similar_result(spec):
+    """Cached response for a near-identical prompt, if the request opted in and one exists"""
+    threshold = spec.get('similarity_threshold')
+    if threshold is None:
+        return None
+    # Bands only guarantee recall up to BANDS - 1 differing bits
+    max_distance = min(BANDS - 1, int((1 - threshold) * FINGERPRINT_BITS))
+    scope = (spec['model_id'], spec['seed'])
+    for key, distance in prompt_index.find(scope, spec['enhanced_prompt'], max_distance):
+        cached = load_cached_result(key.hex())
+        if cached is None:
+            continue
+        payload, stored_at = cached
+        logger.info(f"Similar-prompt hit for {spec['model_id']}: {key.hex()[:12]} (distance {distance})")
+        generation_requests.inc(spec['model_id'], 'similar_hit')
+        payload.update({
+            'prompt': spec['base_prompt'],
+            'matched_prompt': payload.get('enhanced_prompt'),
+            'enhanced_prompt': spec['enhanced_prompt'],
+            'similarity': round(similarity(distance), 4),
+            'cache': 'similar',
+            'cached_at': datetime.fromtimestamp(stored_at).isoformat(),
+            'timestamp': datetime.now().isoformat()
+        })
+        return payload
+    return None
+
+def record_generation_error(model_id, e):
+    """Count a failed generation for /metrics"""
+    if isinstance(e, GenerationError) and e.status_code in (429, 499):
+        generation_requests.inc(model_id, 'shed' if e.status_code == 429 else 'cancelled')
+        return
+    generation_requests.inc(model_id, 'error')
+    generation_errors.inc(model_id, error_type(e))
+
+def generated_payload(spec, payload, shared, cache_key):
+    """Response for a freshly generated (or coalesced) video"""
+    generation_requests.inc(spec['model_id'], 'coalesced' if shared else 'generated')
+    if shared:
+        logger.info(f"Coalesced request onto in-flight generation for {spec['model_id']}: {cache_key[:12]}")
+    return dict(
+        payload,
+        prompt=spec['base_prompt'],
+        cache='miss' if spec['use_cache'] else 'bypass',
+        coalesced=shared
+    )
+
+def run_with_fallbacks(spec, cancel_token=None):
+    """Race the requested model against its fallback chain and report which one won"""
+    chain = [spec['model_id']] + spec['fallback_models']
+    logger.info(f"Generating with fallback chain {chain} (hedge after {spec['hedge_after']}s)")
+    
+    attempts = [
+        (model_id, lambda token, model_id=model_id: run_text_to_video(
+            dict(spec, model_id=model_id, fallback_models=[]), cancel_token=token))
+        for model_id in chain
+    ]
+    payload, winner, report = run_hedged(attempts, hedge_delay=spec['hedge_after'], cancel_token=cancel_token)
+    
+    logger.info(f"Fallback chain won by {winner}: {report}")
+    return dict(
+        payload,
+        requested_model=spec['model_id'],
+        hedge={'winner': winner, 'hedge_after': spec['hedge_after'], 'attempts': report}
+    )
+
+def publish_video(model_id, result):
+    """Copy a Space output into the video store; returns (video_url, video_id)
+
+    If the copy fails the Space's own path/URL is returned and video_id is None.
+    """
+    source = source_location(result)
+    if source is None:
+        raise GenerationError('Failed to generate video. No output received.', 500)
+    try:
+        video_id = video_store.ingest(source)
+    except (OSError, ValueError, requests.RequestException) as e:
+        logger.warning(f"Could not store video from {model_id} locally, serving it from the Space: {str(e)}")
+        video_ingests.inc(model_id, 'error')
+        return source, None
+    video_ingests.inc(model_id, 'ok')
+    return f"{VIDEO_BASE_URL}/videos/{video_id}", video_id
+
+def cancel_upstream_job(job, model_id, cache_key):
+    """Cancel a Space job once nobody is waiting for its result"""
+    if in_flight_generations.waiters(cache_key) > 0:
+        logger.info(f"Not cancelling {model_id} job: other requests are waiting on it")
+        return
+    logger.info(f"Cancelling upstream job for {model_id}")
+    job.cancel()
+
+def call_text_to_video_model(spec, cache_key, cancel_token=None):
+    """Call the model's Space for a text-to-video spec and cache the result"""
+    enhanced_prompt = spec['enhanced_prompt']
+    model_id = spec['model_id']
+    model_info = get_model_info(model_id)
+    
+    priority = spec.get('priority', 'interactive')
+    check_circuit(model_id)
+    if spec.get('shed_when_busy'):
+        check_admission(model_id, priority=priority)
+    
+    deadline = spec.get('deadline')
+    if expired(deadline):
+        raise deadline_exceeded(model_id, spec)
+    if cancel_token is not None and cancel_token.cancelled:
+        raise GenerationError(f'Generation with {model_id} was cancelled', 499)
+    
+    # Wait for one of the model's predict slots before touching the Space; a background
+    # job records its place in the model's queue so /jobs/<id> can report it
+    acquire_timeout = CLIENT_ACQUIRE_TIMEOUT if deadline is None else min(CLIENT_ACQUIRE_TIMEOUT, remaining(deadline))
+    with client_pool.reserve(model_id, timeout=acquire_timeout, priority=priority, tenant=spec.get('tenant'),
+                             on_wait=lambda ticket: job_queue.annotate(slot_wait=(model_id, ticket))):
+        job_queue.annotate(slot_wait=None)
         # Get or create client
         client = get_or_create_client(model_id)
         if client is None:
-            return jsonify({'error': 'Failed to connect to video generation service. Try using "Demo Mode" model to test the UI.'}), 503
+            raise GenerationError('Failed to connect to video generation service. Try using "Demo Mode" model to test the UI.', 503)
         
         # Generate video based on model type
+        job = None
         try:
             if model_id in ['cogvideox-5b', 'cogvideox-2b']:
                 # CogVideoX models - prompt with seed and other params
                 logger.info(f"Calling CogVideoX {model_id} with prompt: {enhanced_prompt[:100]}")
-                result = client.predict(
+                job = client.submit(
                     prompt=enhanced_prompt,
-                    seed=0,  # Random seed
+                    seed=spec['seed'],  # 0 = random seed
                     api_name=model_info['api_name']
                 )
             elif model_id == 'hunyuan-video':
                 # HunyuanVideo model
                 logger.info(f"Calling HunyuanVideo with prompt: {enhanced_prompt[:100]}")
-                result = client.predict(
+                job = client.submit(
                     enhanced_prompt,
                     api_name=model_info['api_name']
                 )
             else:
                 # Generic approach for other models
                 logger.info(f"Calling {model_id} with generic approach")
-                result = client.predict(
+                job = client.submit(
                     enhanced_prompt,
                     api_name=model_info['api_name']
                 )
+            if cancel_token is not None:
+                cancel_token.on_cancel(lambda: cancel_upstream_job(job, model_id, cache_key))
+            # A re-run after a restart finds the result under cache_key if this call finished
+            job_queue.annotate(upstream={
+                'model': model_id,
+                'space': model_info['space_url'],
+                'api_name': model_info['api_name'],
+                'cache_key': cache_key,
+                'submitted_at': time.time(),
+            })
+            started = time.monotonic()
+            try:
+                result = job.result(timeout=remaining(deadline))
+            except Exception:
+                predict_seconds.observe(time.monotonic() - started, model_id, 'error')
+                raise
+            predict_seconds.observe(time.monotonic() - started, model_id, 'ok')
+            model_admission.record(model_id, time.monotonic() - started)
         except Exception as e:
+            if cancel_token is not None and cancel_token.cancelled:
+                logger.info(f"Generation with {model_id} was cancelled")
+                raise GenerationError(f'Generation with {model_id} was cancelled', 499)
+            if isinstance(e, TimeoutError) and job is not None and expired(deadline):
+                # The caller's deadline, not a fault of the Space: free its GPU and our slot
+                cancel_upstream_job(job, model_id, cache_key)
+                raise deadline_exceeded(model_id, spec)
             logger.error(f"Model API call failed: {str(e)}")
             logger.error(f"This usually means:")
             logger.error(f"  1. The Hugging Face Space is sleeping or unavailable")
             logger.error(f"  2. The API has changed")
             logger.error(f"  3. Try using 'Demo Mode' to test the UI")
-            return jsonify({'error': f'Video generation failed: {str(e)}. Try Demo Mode or a different model.'}), 500
-        
-        # Extract video path/URL from result
-        video_path = result[0] if isinstance(result, list) else result
-        
-        if not video_path:
-            logger.error("No video path returned from API")
-            return jsonify({'error': 'Failed to generate video. No output received.'}), 500
-        
-        logger.info(f"Video generated successfully: {video_path}")
-        return jsonify({
-            'video_url': video_path,
-            'prompt': base_prompt,
-            'enhanced_prompt': enhanced_prompt,
-            'model': model_id,
-            'model_name': model_info['name'],
-            'timestamp': datetime.now().isoformat()
-        })
-        
-    except ValueError as e:
-        logger.error(f"Validation error: {str(e)}")
-        return jsonify({'error': f'Invalid input: {str(e)}'}), 400
+            client_pool.report_failure(model_id, client, e)
+            circuit_breakers.record_failure(model_id, e)
+            raise GenerationError(f'Video generation failed: {str(e)}. Try Demo Mode or a different model.', 500)
+        client_pool.report_success(model_id, client)
+        circuit_breakers.record_success(model_id)
     
-    except ConnectionError as e:
-        logger.error(f"Connection error: {str(e)}")
-        return jsonify({'error': 'Failed to connect to video generation service. Please try again later.'}), 503
+    # Extract video path/URL from result
+    video_path = result[0] if isinstance(result, list) else result
     
-    except TimeoutError as e:
-        logger.error(f"Timeout error: {str(e)}")
-        return jsonify({'error': 'Request timed out. The service may be busy. Please try again.'}), 504
+    if not video_path:
+        logger.error("No video path returned from API")
+        raise GenerationError('Failed to generate video. No output received.', 500)
     
-    except Exception as e:
-        logger.error(f"Unexpected error in generate_video: {str(e)}", exc_info=True)
-        return jsonify({'error': 'An unexpected error occurred. Please try again later.'}), 500
+    logger.info(f"Video generated successfully: {video_path}")
+    video_url, video_id = publish_video(model_id, video_path)
+    payload = {
+        'video_url': video_url,
+        'video_id': video_id,
+        'prompt': spec['base_prompt'],
+        'enhanced_prompt': enhanced_prompt,
+        'model': model_id,
+        'model_name': model_info['name'],
+        'seed': spec['seed'],
+        'timestamp': datetime.now().isoformat()
+    }
+    result_cache.put(cache_key, payload)
+    prompt_index.add((model_id, spec['seed']), enhanced_prompt, bytes.fromhex(cache_key))
+    return payload
 
-@app.route('/generate-video-from-image', methods=['POST'])
-def generate_video_from_image():
-    """Generate video from image with text prompt (Image-to-Video)"""
+@app.route('/generate-video', methods=['POST'])
+def generate_video():
+    """Generate video from text prompt with advanced options
+    
+    Pass "async": true to get a job ID back immediately and poll /jobs/<job_id>
+    """
     try:
         # Validate request data
         if not request.json:
             return jsonify({'error': 'Request must be JSON'}), 400
         
         data = request.json
-        prompt = data.get('prompt', '').strip()
-        image_data = data.get('image', '')
-        model_id = data.get('model', 'stable-video-diffusion')
-        
-        # Validate model supports image-to-video
-        model_info = get_model_info(model_id)
-        if model_info['type'] != 'image-to-video':
-            return jsonify({'error': f'Model {model_id} does not support image-to-video generation'}), 400
+        tenant = client_key(request.headers.get('X-API-Key'), request.remote_addr)
+        check_rate_limit('/generate-video', tenant)
+        spec = parse_text_to_video_request(data, request.headers.get('X-Request-Timeout'))
+        spec['tenant'] = tenant
         
-        # Decode image
-        image = decode_base64_image(image_data)
-        if image is None:
-            return jsonify({'error': 'Invalid image data'}), 400
+        if data.get('async'):
+            job = job_queue.submit('text-to-video', run_text_to_video, spec, request_summary=job_request_summary(spec),
+                                   priority_rank=PRIORITY_RANKS[spec['priority']])
+            logger.info(f"Queued job {job.id} for {spec['model_id']}")
+            return jsonify(job_accepted_payload(job)), 202
         
-        # Save image to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
-            image.save(tmp_file.name)
-            temp_image_path = tmp_file.name
-        
-        logger.info(f"Generating video from image with {model_id}")
-        logger.info(f"Prompt: {prompt[:100]}...")
+        # The client is waiting on this response, so don't queue it past the admission deadline
+        spec['shed_when_busy'] = True
+        with disconnect_monitor.watching(request_socket(request.environ)) as cancel_token:
+            return jsonify(run_text_to_video(spec, cancel_token))
         
+    except QueueFullError as e:
+        logger.warning(str(e))
+        return jsonify({'error': 'Too many videos are queued right now. Please try again later.'}), 503
+    
+    except GenerationError as e:
+        return jsonify({'error': e.message}), e.status_code, e.headers()
+    
+    except RequestEntityTooLarge:
+        raise
+    
+    except Exception as e:
+        message, status_code = describe_error(e)
+        return jsonify({'error': message}), status_code
+
+def job_request_summary(spec):
+    """The request as recorded on a background job"""
+    return {
+        'prompt': spec['base_prompt'],
+        'enhanced_prompt': spec['enhanced_prompt'],
+        'model': spec['model_id'],
+        'priority': spec['priority'],
+    }
+
+# Functions that run each kind of background job, used to resume jobs after a restart
+JOB_RUNNERS = {'text-to-video': run_text_to_video}
+
+def start_job_workers():
+    """Start persisting jobs in this process and resume those a stopped process left unfinished
+
+    Called once per serving process (after the fork under gunicorn).
+    """
+    job_queue.start(JOB_RUNNERS)
+
+def job_accepted_payload(job):
+    """Response body for a newly queued job"""
+    return {
+        'job_id': job.id,
+        'status': job.state,
+        'status_url': f'/jobs/{job.id}',
+        'events_url': f'/jobs/{job.id}/events',
+        'timestamp': datetime.now().isoformat()
+    }
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report the state of a queued generation job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_payload(job))
+
+def job_payload(job):
+    """A job's /jobs representation, with its place in line while it waits"""
+    data = job.to_dict()
+    queue = job_queue_position(job)
+    if queue is not None:
+        data['queue'] = queue
+    return data
+
+def job_queue_position(job):
+    """Where a waiting job is in line and when it should start, or None if it isn't waiting here
+
+    Jobs first wait for a job worker, then for a slot on their model; the
+    estimate assumes the jobs ahead take the model's average call time.
+    """
+    model_id = job.request.get('model')
+    position = job_queue.position(job.id)
+    if position is not None:
+        stage = 'job_queue'
+        wait = model_admission.expected_wait(model_id, JOB_WORKERS, position, JOB_WORKERS)
+    else:
+        slot_wait = getattr(job, 'slot_wait', None)
+        if job.finished or slot_wait is None:
+            return None
+        stage = 'model'
+        model_id, ticket = slot_wait
+        position, in_flight, limit = client_pool.slot_position(model_id, ticket)
+        wait = model_admission.expected_wait(model_id, in_flight, position, limit)
+    return {
+        'stage': stage,
+        'model': model_id,
+        'priority': job.request.get('priority'),
+        'position': position,
+        'estimated_start': datetime.fromtimestamp(time.time() + wait).isoformat(),
+        'estimated_wait_seconds': round(wait, 1),
+    }
+
+@app.route('/queue', methods=['GET'])
+def queue_status():
+    """Per-model upstream slots and how long a new request of each priority would wait"""
+    return jsonify(queue_payload({model_id: client_pool.load for model_id in catalog.current.ids()}))
+
+def queue_payload(loaders):
+    """Body of the /queue response; loaders maps a model id to load(model_id, priority=None)"""
+    models = {}
+    for model_id, load in loaders.items():
+        in_flight, waiting, limit = load(model_id)
+        estimated_wait = {}
+        waiting_ahead = {}
+        for priority in PRIORITIES:
+            _, ahead, _ = load(model_id, priority)
+            waiting_ahead[priority] = ahead
+            estimated_wait[priority] = round(model_admission.expected_wait(model_id, in_flight, ahead, limit), 1)
+        models[model_id] = {
+            'capacity': limit,
+            'in_flight': in_flight,
+            'waiting': waiting,
+            'waiting_ahead': waiting_ahead,
+            'estimated_wait_seconds': estimated_wait,
+        }
+    return {'priorities': list(PRIORITIES), 'models': models, 'timestamp': datetime.now().isoformat()}
+
+def job_event(job, seen_version):
+    """SSE message for a job returned by wait_for_change(); None once the job is gone"""
+    if job is None:
+        return None
+    if job.version == seen_version:
+        # Comment line keeps proxies from closing an idle connection
+        return ": keepalive\n\n"
+    return f"event: {job.state}\ndata: {json.dumps(job_payload(job))}\n\n"
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream job state changes as Server-Sent Events until the job finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def stream():
+        seen_version = None
+        while True:
+            current = job_queue.wait_for_change(job_id, seen_version, timeout=SSE_KEEPALIVE_SECONDS)
+            event = job_event(current, seen_version)
+            if event is None:
+                return
+            yield event
+            if current.version != seen_version and current.finished:
+                return
+            seen_version = current.version
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def plan_batch(items, batch_priority, tenant):
+    """Validate every batch item up front and collapse duplicates onto one generation
+    
+    Returns (unique, indexes_by_key, rejected): specs by cache key, the item indexes
+    each key serves, and result records for the items that failed validation.
+    """
+    unique = {}
+    indexes_by_key = {}
+    rejected = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise GenerationError('Each item must be a JSON object', 400)
+            spec = parse_text_to_video_request(item, default_priority=batch_priority)
+            spec['tenant'] = tenant
+        except Exception as e:
+            message, status_code = describe_error(e)
+            rejected.append({'index': index, 'status': 'failed', 'error': message, 'status_code': status_code})
+            continue
+        key = make_cache_key(spec['model_id'], spec['enhanced_prompt'], spec['seed'],
+                             get_model_info(spec['model_id'])['params'])
+        if key not in unique:
+            unique[key] = (spec['model_id'], spec)
+            indexes_by_key[key] = []
+        indexes_by_key[key].append(index)
+    
+    logger.info(f"Batch of {len(items)} items: {len(unique)} unique, {len(rejected)} rejected")
+    return unique, indexes_by_key, rejected
+
+class BatchTally:
+    """Turns a planned batch's results into per-item records and counts them for the summary"""
+    
+    def __init__(self, total, unique, indexes_by_key, rejected):
+        self.total = total
+        self.unique = unique
+        self.indexes_by_key = indexes_by_key
+        self.rejected = rejected
+        self.started = time.monotonic()
+        self.succeeded = 0
+        self.failed = len(rejected)
+        self.per_model = {}
+    
+    def records(self, key, result, error):
+        """Result records for every item served by one finished generation"""
+        model_id, spec = self.unique[key]
+        stats = self.per_model.setdefault(model_id, {'succeeded': 0, 'failed': 0})
+        indexes = self.indexes_by_key[key]
+        if error is None:
+            stats['succeeded'] += 1
+            self.succeeded += len(indexes)
+            record = {'status': 'done', 'result': result}
+        else:
+            stats['failed'] += 1
+            self.failed += len(indexes)
+            message, status_code = describe_error(error)
+            record = {'status': 'failed', 'error': message, 'status_code': status_code}
+        return [dict(record, index=index, duplicate_of=indexes[0] if index != indexes[0] else None)
+                for index in indexes]
+    
+    def summary(self):
+        return {'summary': {
+            'total': self.total,
+            'unique': len(self.unique),
+            'duplicates': self.total - len(self.rejected) - len(self.unique),
+            'rejected': len(self.rejected),
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'per_model': self.per_model,
+            'seconds': round(time.monotonic() - self.started, 3),
+        }}
+
+def batch_records(total, unique, indexes_by_key, rejected):
+    """Run a planned batch, yielding ('result', record) as items finish and then ('summary', record)"""
+    tally = BatchTally(total, unique, indexes_by_key, rejected)
+    for record in rejected:
+        yield 'result', record
+    for key, result, error in run_batch(unique, run_text_to_video, model_concurrency_limit, batch_workers):
+        for record in tally.records(key, result, error):
+            yield 'result', record
+    yield 'summary', tally.summary()
+
+def batch_message(kind, record, use_sse):
+    """One batch record as an SSE event or an NDJSON line"""
+    if use_sse:
+        return f"event: {kind}\ndata: {json.dumps(record)}\n\n"
+    return json.dumps(record) + "\n"
+
+@app.route('/generate-videos', methods=['POST'])
+def generate_videos():
+    """Generate a batch of text-to-video items, streaming each result as it finishes
+    
+    Body: {"items": [{"prompt": ..., "model": ..., ...}, ...], "format": "ndjson" | "sse", "priority": "batch"}
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({'error': 'Request must be JSON with a non-empty "items" list'}), 400
+    
+    items = data['items']
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'A batch must not exceed {MAX_BATCH_ITEMS} items'}), 400
+    
+    tenant = client_key(request.headers.get('X-API-Key'), request.remote_addr)
+    try:
+        # Items without their own "priority" get the batch's
+        batch_priority = parse_priority(data.get('priority'), DEFAULT_BATCH_PRIORITY)
+        # A batch spends one token per item, up to the burst size
+        check_rate_limit('/generate-videos', tenant, cost=len(items))
+    except GenerationError as e:
+        return jsonify({'error': e.message}), e.status_code, e.headers()
+    
+    use_sse = data.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream'
+    unique, indexes_by_key, rejected = plan_batch(items, batch_priority, tenant)
+    
+    def stream():
+        for kind, record in batch_records(len(items), unique, indexes_by_key, rejected):
+            yield batch_message(kind, record, use_sse)
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def parse_image_to_video_request(data):
+    """Validate the non-image fields of an image-to-video request"""
+    prompt = data.get('prompt', '').strip()
+    model_id = data.get('model', 'stable-video-diffusion')
+    resize_mode = data.get('resize', RESIZE_CROP)
+    if resize_mode not in RESIZE_MODES:
+        raise GenerationError(f"resize must be one of: {', '.join(RESIZE_MODES)}", 400)
+    
+    # Validate model supports image-to-video
+    model_info = catalog.current.get(model_id)
+    if model_info is None:
+        raise GenerationError(f'Invalid model: {model_id}', 400)
+    if model_info['type'] != 'image-to-video':
+        raise GenerationError(f'Model {model_id} does not support image-to-video generation', 400)
+    
+    return prompt, model_id, resize_mode
+
+def call_image_to_video_model(model_id, image_path, prompt, deadline=None, cancel_token=None, tenant=None):
+    """Send a prepared image to the model's Space and return the stored video's URL
+
+    The Space job is cancelled if cancel_token is cancelled or deadline (a time.time() value) passes.
+    The request waits for a slot as an interactive request of tenant.
+    """
+    model_info = get_model_info(model_id)
+    if expired(deadline):
+        raise GenerationError('The video was not ready within the deadline. Please try again.', 504)
+    
+    acquire_timeout = CLIENT_ACQUIRE_TIMEOUT if deadline is None else min(CLIENT_ACQUIRE_TIMEOUT, remaining(deadline))
+    with client_pool.reserve(model_id, timeout=acquire_timeout, tenant=tenant):
         # Get or create client
         client = get_or_create_client(model_id)
         if client is None:
-            os.unlink(temp_image_path)
-            return jsonify({'error': 'Failed to connect to video generation service'}), 503
+            record_generation_error(model_id, ConnectionError())
+            raise GenerationError('Failed to connect to video generation service', 503)
         
-        # Generate video
+        started = time.monotonic()
+        job = None
         try:
             if model_id == 'stable-video-diffusion':
-                result = client.predict(
-                    temp_image_path,
+                job = client.submit(
+                    image_path,
                     api_name=model_info['api_name']
                 )
             elif model_id == 'animatediff':
-                result = client.predict(
-                    temp_image_path,
+                job = client.submit(
+                    image_path,
                     prompt,
                     api_name=model_info['api_name']
                 )
             else:
-                result = client.predict(
-                    temp_image_path,
+                job = client.submit(
+                    image_path,
                     prompt,
                     api_name=model_info['api_name']
                 )
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_image_path):
-                os.unlink(temp_image_path)
+            if cancel_token is not None:
+                cancel_token.on_cancel(job.cancel)
+            result = job.result(timeout=remaining(deadline))
+        except Exception as e:
+            predict_seconds.observe(time.monotonic() - started, model_id, 'error')
+            if cancel_token is not None and cancel_token.cancelled:
+                logger.info(f"Image-to-video generation with {model_id} was cancelled")
+                e = GenerationError(f'Generation with {model_id} was cancelled', 499)
+                record_generation_error(model_id, e)
+                raise e
+            if isinstance(e, TimeoutError) and job is not None and expired(deadline):
+                logger.info(f"Cancelling {model_id} image-to-video job after its deadline")
+                job.cancel()
+                e = GenerationError('The video was not ready within the deadline. Please try again.', 504)
+                record_generation_error(model_id, e)
+                raise e
+            record_generation_error(model_id, e)
+            client_pool.report_failure(model_id, client, e)
+            circuit_breakers.record_failure(model_id, e)
+            raise
+        predict_seconds.observe(time.monotonic() - started, model_id, 'ok')
+        model_admission.record(model_id, time.monotonic() - started)
+        generation_requests.inc(model_id, 'generated')
+        client_pool.report_success(model_id, client)
+        circuit_breakers.record_success(model_id)
+    
+    # Extract video path
+    video_path = result[0] if isinstance(result, list) else result
+    
+    if not video_path:
+        raise GenerationError('Failed to generate video from image', 500)
+    
+    logger.info(f"Video generated from image successfully")
+    video_url, _ = publish_video(model_id, video_path)
+    return video_url
+
+def image_to_video_payload(video_url, prompt, model_id, image_info):
+    """Response for a finished image-to-video generation"""
+    return {
+        'video_url': video_url,
+        'prompt': prompt,
+        'model': model_id,
+        'model_name': get_model_info(model_id)['name'],
+        'image': image_info,
+        'timestamp': datetime.now().isoformat()
+    }
+
+def log_image_info(model_id, prompt, image_info):
+    logger.info(f"Generating video from image with {model_id}")
+    if image_info['resized'] or image_info['cropped']:
+        logger.info(
+            f"{'Resized' if image_info['resized'] else 'Cropped'} image {image_info['original_size']} -> {[image_info['width'], image_info['height']]}, "
+            f"{image_info['original_bytes']} -> {image_info['bytes']} bytes in {image_info['seconds']}s"
+        )
+    logger.info(f"Prompt: {prompt[:100]}...")
+
+def remove_temp_files(*paths):
+    """Delete the temp files that exist among paths (None entries are skipped)"""
+    for path in paths:
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
+
+@app.route('/generate-video-from-image', methods=['POST'])
+def generate_video_from_image():
+    """Generate video from image with text prompt (Image-to-Video)"""
+    try:
+        # Check the caller's rate limit before reading the upload
+        tenant = client_key(request.headers.get('X-API-Key'), request.remote_addr)
+        try:
+            check_rate_limit('/generate-video-from-image', tenant)
+        except GenerationError as e:
+            return jsonify({'error': e.message}), e.status_code, e.headers()
         
-        # Extract video path
-        video_path = result[0] if isinstance(result, list) else result
+        # Fields come from the JSON body, the multipart form, or the query string for raw image bodies
+        if request.is_json:
+            data = request.get_json(silent=True) or {}
+        elif request.mimetype == 'multipart/form-data':
+            data = request.form
+        elif request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+            data = request.args
+        else:
+            return jsonify({'error': 'Request must be JSON, multipart/form-data or a raw image body'}), 400
         
-        if not video_path:
-            return jsonify({'error': 'Failed to generate video from image'}), 500
+        try:
+            prompt, model_id, resize_mode = parse_image_to_video_request(data)
+            deadline = time.time() + request_timeout(get_model_info(model_id), request.headers.get('X-Request-Timeout'))
+            # Fail fast before reading the upload if the Space is known to be down or too busy
+            check_circuit(model_id)
+            check_admission(model_id)
+        except GenerationError as e:
+            return jsonify({'error': e.message}), e.status_code, e.headers()
         
-        logger.info(f"Video generated from image successfully")
-        return jsonify({
-            'video_url': video_path,
-            'prompt': prompt,
-            'model': model_id,
-            'model_name': model_info['name'],
-            'timestamp': datetime.now().isoformat()
-        })
+        upload_path = temp_image_path = None
+        try:
+            # Stream the image to a temp file, then shrink it to the model's resolution
+            try:
+                upload_path, upload_size = save_image_upload(data)
+                temp_image_path, image_info = image_workers.submit(
+                    preprocess_image,
+                    upload_path,
+                    get_model_info(model_id)['resolution'],
+                    resize_mode,
+                    IMAGE_JPEG_QUALITY
+                ).result()
+            except UploadError as e:
+                return jsonify({'error': e.message}), e.status_code
+            
+            log_image_info(model_id, prompt, image_info)
+            
+            # Generate video
+            try:
+                with disconnect_monitor.watching(request_socket(request.environ)) as cancel_token:
+                    video_url = call_image_to_video_model(model_id, temp_image_path, prompt, deadline, cancel_token, tenant)
+            except GenerationError as e:
+                return jsonify({'error': e.message}), e.status_code, e.headers()
+        finally:
+            # Clean up temp files, however far the request got
+            remove_temp_files(upload_path, temp_image_path)
+        
+        return jsonify(image_to_video_payload(video_url, prompt, model_id, image_info))
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         logger.error(f"Error in generate_video_from_image: {str(e)}", exc_info=True)
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
+@app.route('/videos/<video_id>', methods=['GET'])
+def serve_video(video_id):
+    """Stream a stored video with Range, ETag and If-None-Match support"""
+    path = video_store.path_for(video_id)
+    if path is None:
+        return jsonify({'error': 'Video not found'}), 404
+    try:
+        # Content-addressed, so the digest is a strong ETag and the response never changes
+        response = send_file(
+            path,
+            mimetype=guess_mimetype(path),
+            conditional=True,
+            etag=video_id,
+            max_age=VIDEO_MAX_AGE_SECONDS
+        )
+    except FileNotFoundError:
+        return jsonify({'error': 'Video not found'}), 404
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.errorhandler(404)
 def not_found(e):
     """Handle 404 errors"""
@@ -355,6 +1465,11 @@ def method_not_allowed(e):
     """Handle 405 errors"""
     return jsonify({'error': 'Method not allowed'}), 405
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Handle bodies over MAX_CONTENT_LENGTH"""
+    return jsonify({'error': f'Request body is too large (images must not exceed {MAX_IMAGE_BYTES // (1024 * 1024)} MB)'}), 413
+
 @app.errorhandler(500)
 def internal_error(e):
     """Handle 500 errors"""
@@ -363,6 +1478,7 @@ def internal_error(e):
 
 if __name__ == '__main__':
     logger.info(f"Starting Enhanced Flask server on port {FLASK_PORT} (debug={FLASK_DEBUG})")
-    logger.info(f"Available models: {', '.join(VIDEO_MODELS.keys())}")
+    logger.info(f"Available models: {', '.join(catalog.current.ids())}")
     logger.info(f"Default model: {DEFAULT_MODEL}")
+    start_job_workers()
     app.run(host='0.0.0.0', port=FLASK_PORT, debug=FLASK_DEBUG)
@@ -7,10 +7,23 @@ Based on the VideoAI_Free_Colab.ipynb notebook
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 import torch
-from diffusers import CogVideoXPipeline
+import diffusers
 from diffusers.utils import export_to_video
+from cpu_profiles import PROFILES, configure_process, get_profile, prepare_pipeline, profile_context
+from inference_worker import InferenceWorker, QueueFull
+from model_catalog import changed_models
+from models_config import catalog, get_model_info
+from pipeline_registry import GB, PipelineRegistry
+from process_memory import peak_rss_mb
+from streaming_video import decode_chunks, supports_streaming, write_video
+from huggingface_hub import snapshot_download
+import gc
+import itertools
 import os
 import logging
+import threading
+import time
+from contextlib import nullcontext
 from datetime import datetime
 import tempfile
 import uuid
@@ -34,82 +47,311 @@ FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
 OUTPUT_DIR = "generated_videos"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Global pipeline variable
-pipeline = None
+# Catalog model served when a request doesn't name one (models.json entries with a "local" block)
+DEFAULT_LOCAL_MODEL = os.getenv('LOCAL_MODEL', 'cogvideox-2b')
+# Load the default model in a background thread at startup instead of on the first request
+PRELOAD_MODEL = os.getenv('PRELOAD_MODEL', 'true').lower() == 'true'
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
-def initialize_model():
-    """Initialize the CogVideoX model"""
-    global pipeline
+# Memory the loaded pipelines may use, in GB (0 = 90% of GPU memory / 75% of RAM)
+LOCAL_VRAM_BUDGET_GB = float(os.getenv('LOCAL_VRAM_BUDGET_GB', 0))
+LOCAL_RAM_BUDGET_GB = float(os.getenv('LOCAL_RAM_BUDGET_GB', 0))
+# Move least recently used pipelines from the GPU to CPU RAM instead of unloading them
+LOCAL_OFFLOAD_TO_CPU = os.getenv('LOCAL_OFFLOAD_TO_CPU', 'true').lower() == 'true'
+
+# CPU performance profile (see cpu_profiles.py): baseline, balanced, fast or compiled.
+# Requests may pick another one; thread pools, channels-last and torch.compile always follow this one
+CPU_PROFILE = os.getenv('CPU_PROFILE', 'balanced')
+if device == "cpu":
+    configure_process(get_profile(CPU_PROFILE))
+
+# Generation settings a request may override, as (default, minimum, maximum)
+GENERATION_LIMITS = {
+    'num_frames': (49, 1, int(os.getenv('MAX_NUM_FRAMES', 49))),  # 49 frames = ~6 seconds at 8 fps
+    'num_inference_steps': (50, 1, 100),
+    'guidance_scale': (6.0, 0.0, 20.0),
+}
+# Requests with the same settings arriving within this window run as one batched pipeline call
+INFERENCE_BATCH_WINDOW_MS = int(os.getenv('INFERENCE_BATCH_WINDOW_MS', 50))
+# Most prompts per pipeline call (batching multiplies activation memory, so it is off on CPU by default)
+INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', 4 if device == "cuda" else 1))
+# Generations allowed to wait for the worker before new ones get a 503
+INFERENCE_MAX_QUEUE = int(os.getenv('INFERENCE_MAX_QUEUE', 32))
+# Decode latents a few frames at a time straight into the MP4 encoder (models with a CogVideoX VAE)
+STREAMING_DECODE = os.getenv('STREAMING_DECODE', 'true').lower() == 'true'
+VIDEO_FPS = 8
+
+def local_model_ids():
+    """Catalog models this backend can run"""
+    current = catalog.current
+    return [model_id for model_id in current.ids(type='text-to-video') if 'local' in current[model_id]]
+
+def load_pipeline(model_id):
+    """Download and load a catalog model's diffusers pipeline into CPU memory; returns (pipeline, phases)"""
+    info = get_model_info(model_id)
+    local = info['local']
+    pipeline_class = getattr(diffusers, local['pipeline'], None)
+    if pipeline_class is None:
+        raise RuntimeError(f"diffusers {diffusers.__version__} has no {local['pipeline']}; upgrade diffusers")
+    phases = {}
+    logger.info(f"🤖 Loading {info['name']}...")
+    logger.info("⏳ This may take 2-5 minutes on first run...")
     
-    if pipeline is not None:
-        logger.info("Model already loaded")
-        return True
+    # Only the safetensors weights are needed; skip the duplicate .bin/.pt checkpoints
+    started = time.perf_counter()
+    model_path = snapshot_download(local['repo_id'], ignore_patterns=["*.bin", "*.pt", "*.ckpt", "*.msgpack", "*.h5"])
+    phases['download_seconds'] = round(time.perf_counter() - started, 2)
     
+    # Safetensors are memory-mapped and copied straight into the (empty-initialized)
+    # modules, so the weights are never held twice in RAM
+    started = time.perf_counter()
+    loaded = pipeline_class.from_pretrained(
+        model_path,
+        torch_dtype=getattr(torch, local.get('dtype', 'float16')) if device == "cuda" else torch.float32,
+        use_safetensors=True,
+        low_cpu_mem_usage=True
+    )
+    phases['weight_load_seconds'] = round(time.perf_counter() - started, 2)
+    if device == "cpu":
+        prepare_pipeline(loaded, get_profile(CPU_PROFILE))
+    phases['peak_rss_mb'] = peak_rss_mb()
+    return loaded, phases
+
+def move_pipeline(loaded, tier):
+    loaded.to(tier)
+    if tier == "cuda":
+        torch.cuda.synchronize()
+
+def pipeline_bytes(loaded):
+    """Memory taken by a pipeline's weights"""
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for component in loaded.components.values() if isinstance(component, torch.nn.Module)
+        for tensor in itertools.chain(component.parameters(), component.buffers())
+    )
+
+def estimate_pipeline_bytes(model_id):
+    """Size from the catalog's memory_gb (given for the 16-bit weights used on GPU)"""
+    memory_gb = (catalog.current.get(model_id) or {}).get('local', {}).get('memory_gb')
+    if memory_gb is None:
+        return None
+    return int(memory_gb * GB * (2 if device == "cpu" else 1))
+
+def free_memory():
+    gc.collect()
+    if device == "cuda":
+        torch.cuda.empty_cache()
+
+def memory_tiers():
+    """(tier, budget in bytes) from the tier pipelines run on to the one they are offloaded to"""
     try:
-        logger.info("🤖 Loading CogVideoX-2B model...")
-        logger.info("⏳ This may take 2-5 minutes on first run...")
-        
-        # Use CogVideoX-2B (smaller, faster)
-        pipeline = CogVideoXPipeline.from_pretrained(
-            "THUDM/CogVideoX-2b",
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-            use_safetensors=True
-        )
-        
-        if device == "cuda":
-            pipeline.to("cuda")
-            logger.info("✅ Model loaded on GPU!")
-        else:
-            logger.info("⚠️ Running on CPU (will be slower)")
-            logger.info("💡 For faster generation, use a computer with NVIDIA GPU")
-        
-        logger.info("🎬 Model ready to generate videos!")
-        return True
-        
+        total_ram = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):  # Windows
+        total_ram = 16 * GB
+    ram = (LOCAL_RAM_BUDGET_GB * GB) or total_ram * 0.75
+    if device != "cuda":
+        return [("cpu", ram)]
+    vram = (LOCAL_VRAM_BUDGET_GB * GB) or torch.cuda.get_device_properties(0).total_memory * 0.9
+    return [("cuda", vram), ("cpu", ram)] if LOCAL_OFFLOAD_TO_CPU else [("cuda", vram)]
+
+# Loaded pipelines, kept resident within the memory budget (least recently used go first)
+pipelines = PipelineRegistry(
+    load_pipeline,
+    memory_tiers(),
+    move=move_pipeline,
+    size_of=pipeline_bytes,
+    estimate=estimate_pipeline_bytes,
+    unload=free_memory
+)
+
+def drop_changed_pipelines(old, new):
+    # A loaded pipeline whose repo or class changed in models.json is stale
+    for model_id in changed_models(old, new, ('local',)):
+        pipelines.discard(model_id)
+
+catalog.add_listener(drop_changed_pipelines)
+
+def initialize_model(model_id=None):
+    """Load a model (the default one unless given); returns False if loading failed"""
+    model_id = model_id or DEFAULT_LOCAL_MODEL
+    try:
+        pipelines.ensure(model_id)
     except Exception as e:
-        logger.error(f"Failed to load model: {str(e)}")
+        logger.error(f"Failed to load model {model_id}: {str(e)}")
         return False
+    if device == "cuda":
+        logger.info("✅ Model loaded on GPU!")
+    else:
+        logger.info("⚠️ Running on CPU (will be slower)")
+        logger.info("💡 For faster generation, use a computer with NVIDIA GPU")
+    logger.info("🎬 Model ready to generate videos!")
+    return True
+
+def save_video(pipeline, output, streaming):
+    """Write one prompt's pipeline output (latents if streaming, else frames) to OUTPUT_DIR; returns its ID"""
+    video_id = str(uuid.uuid4())
+    output_path = os.path.join(OUTPUT_DIR, f"{video_id}.mp4")
+    try:
+        if streaming:
+            write_video(decode_chunks(pipeline, output), output_path, fps=VIDEO_FPS)
+        else:
+            export_to_video(output, output_path, fps=VIDEO_FPS)
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return video_id
+
+def remove_videos(video_ids):
+    """Delete videos written by save_video()"""
+    for video_id in video_ids:
+        output_path = os.path.join(OUTPUT_DIR, f"{video_id}.mp4")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+def run_pipeline_batch(prompts, model, profile, num_frames, num_inference_steps, guidance_scale):
+    """One pipeline call for several prompts; saves each prompt's video and returns the video IDs"""
+    video_ids = []
+    try:
+        with pipelines.use(model) as pipeline:
+            # CPU profiles only apply on CPU (profile is None on GPU)
+            with profile_context(pipeline, get_profile(profile)) if profile else nullcontext():
+                # Streaming stops the pipeline at the latents and decodes them chunk by chunk while encoding,
+                # instead of holding every decoded frame and the encoder's buffer at once
+                streaming = STREAMING_DECODE and supports_streaming(pipeline)
+                outputs = pipeline(
+                    prompt=prompts,
+                    num_frames=num_frames,
+                    guidance_scale=guidance_scale,
+                    num_inference_steps=num_inference_steps,
+                    output_type='latent' if streaming else 'pil'
+                ).frames
+                for output in outputs:
+                    video_ids.append(save_video(pipeline, output, streaming))
+                return video_ids
+    except torch.cuda.OutOfMemoryError:
+        # The batch fails or is retried as a whole, so videos it already saved would be orphaned
+        remove_videos(video_ids)
+        if len(prompts) == 1:
+            raise
+        # The batch didn't fit: free what it allocated and run the prompts one at a time
+        logger.warning(f"Out of memory on a batch of {len(prompts)}, retrying one prompt at a time")
+        torch.cuda.empty_cache()
+        retried = []
+        try:
+            for prompt in prompts:
+                retried += run_pipeline_batch([prompt], model, profile, num_frames, num_inference_steps, guidance_scale)
+        except BaseException:
+            remove_videos(retried)
+            raise
+        return retried
+    except BaseException:
+        remove_videos(video_ids)
+        raise
+
+# The only thread that calls the pipeline; request threads queue work for it
+inference_worker = InferenceWorker(
+    run_pipeline_batch,
+    max_batch_size=INFERENCE_MAX_BATCH,
+    batch_window=INFERENCE_BATCH_WINDOW_MS / 1000,
+    max_queue=INFERENCE_MAX_QUEUE
+)
+
+def parse_generation_settings(data):
+    """Model and generation settings from the request body; raises ValueError if one is invalid"""
+    model_id = data.get('model') or DEFAULT_LOCAL_MODEL
+    if model_id not in local_model_ids():
+        raise ValueError(f"Unknown local model: {model_id}. Available: {', '.join(local_model_ids())}")
+    settings = {'model': model_id, 'profile': None}
+    if device == "cpu":
+        profile = data.get('profile') or CPU_PROFILE
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown CPU profile: {profile}. Available: {', '.join(PROFILES)}")
+        settings['profile'] = profile
+    for name, (default, low, high) in GENERATION_LIMITS.items():
+        if name == 'num_frames':
+            high = min(high, get_model_info(model_id).get('max_frames') or high)
+        kind = type(default)
+        try:
+            value = kind(data.get(name, default))
+        except (TypeError, ValueError):
+            value = None
+        if value is None or not low <= value <= high:
+            raise ValueError(f"{name} must be {'an integer' if kind is int else 'a number'} between {low} and {high}")
+        settings[name] = value
+    return settings
+
+def start_preload():
+    """Load the default model in a background thread so the server can accept requests meanwhile"""
+    thread = threading.Thread(target=initialize_model, name='model-preload', daemon=True)
+    thread.start()
+    return thread
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    model_loaded = pipeline is not None
+    model_state = pipelines.state(DEFAULT_LOCAL_MODEL)
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model_loaded,
+        'model_loaded': model_state in ('ready', 'offloaded'),
+        'model_state': model_state,
+        'inference': inference_worker.stats(),
         'device': device,
         'gpu_available': torch.cuda.is_available(),
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the server is up, whether or not the model has loaded"""
+    return jsonify({'status': 'alive', 'timestamp': datetime.now().isoformat()})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 503 until the default model has loaded and can serve generations"""
+    model = pipelines.model_stats(DEFAULT_LOCAL_MODEL)
+    # Once warmed up, stay ready even if the model is later offloaded or evicted to make room
+    ready = model['loads'] > 0
+    return jsonify({
+        'status': 'ready' if ready else model['state'],
+        'model': DEFAULT_LOCAL_MODEL,
+        'device': device,
+        'error': model['error'],
+        'load_started_at': model['load_started_at'],
+        'load_finished_at': model['load_finished_at'],
+        'load_phases': model['last_load_phases'],
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
 @app.route('/models', methods=['GET'])
 def list_models():
     """List available models"""
+    current = catalog.current
     return jsonify({
         'models': {
-            'cogvideox-2b-local': {
-                'name': 'CogVideoX-2B (Local)',
-                'description': 'Running locally on your computer',
-                'type': 'text-to-video'
+            model_id: {
+                'name': current[model_id]['name'],
+                'description': current[model_id]['description'],
+                'type': current[model_id]['type'],
+                'state': pipelines.state(model_id)
             }
+            for model_id in local_model_ids()
         },
+        'default_model': DEFAULT_LOCAL_MODEL,
         'device': device,
         'gpu_available': torch.cuda.is_available()
     })
 
+@app.route('/models/stats', methods=['GET'])
+def model_stats():
+    """Memory use of each tier and per-model load, offload and eviction counts"""
+    return jsonify(pipelines.stats())
+
 @app.route('/generate-video', methods=['POST'])
 def generate_video():
     """Generate video from text prompt"""
     try:
-        # Initialize model if not already loaded
-        if pipeline is None:
-            logger.info("Model not loaded, initializing...")
-            if not initialize_model():
-                return jsonify({
-                    'error': 'Failed to load model. Check logs for details.'
-                }), 500
-        
         # Get request data
         data = request.json
         prompt = data.get('prompt', '').strip()
@@ -120,23 +362,29 @@ def generate_video():
         if len(prompt) < 3:
             return jsonify({'error': 'Prompt must be at least 3 characters'}), 400
         
+        try:
+            settings = parse_generation_settings(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        model_id = settings['model']
+        num_frames = settings['num_frames']
+        model_state = pipelines.state(model_id)
+        if model_state == 'loading':
+            logger.info(f"Model {model_id} is still loading, waiting for it...")
+        elif model_state not in ('ready', 'offloaded'):
+            logger.info(f"Model {model_id} not loaded, it will be loaded first...")
+        
         logger.info(f"🎨 Generating video for: {prompt[:100]}")
         logger.info(f"⏳ This will take 30-120 seconds depending on your hardware...")
         
-        # Generate video
-        num_frames = 49  # ~6 seconds at 8 fps
-        
-        video_frames = pipeline(
-            prompt=prompt,
-            num_frames=num_frames,
-            guidance_scale=6.0,
-            num_inference_steps=50
-        ).frames[0]
-        
-        # Save video
-        video_id = str(uuid.uuid4())
+        # Generate video on the inference worker, possibly batched with other requests
+        try:
+            video_id = inference_worker.submit(prompt, **settings).result()
+        except QueueFull:
+            return jsonify({
+                'error': 'Too many videos are being generated. Please try again in a few minutes.'
+            }), 503
         output_path = os.path.join(OUTPUT_DIR, f"{video_id}.mp4")
-        export_to_video(video_frames, output_path, fps=8)
         
         logger.info(f"✅ Video generated successfully: {output_path}")
         
@@ -146,10 +394,13 @@ def generate_video():
         return jsonify({
             'video_url': video_url,
             'prompt': prompt,
-            'model': 'cogvideox-2b-local',
-            'model_name': 'CogVideoX-2B (Local)',
+            'model': model_id,
+            'model_name': get_model_info(model_id)['name'],
             'device': device,
             'num_frames': num_frames,
+            'num_inference_steps': settings['num_inference_steps'],
+            'guidance_scale': settings['guidance_scale'],
+            'profile': settings['profile'],
             'timestamp': datetime.now().isoformat()
         })
         
@@ -187,11 +438,18 @@ def download_video(filename):
 
 @app.route('/initialize', methods=['POST'])
 def initialize():
-    """Manually initialize the model"""
-    if initialize_model():
+    """Manually initialize a model (the default one unless the body names another)"""
+    model_id = (request.get_json(silent=True) or {}).get('model') or DEFAULT_LOCAL_MODEL
+    if model_id not in local_model_ids():
+        return jsonify({
+            'status': 'error',
+            'message': f"Unknown local model: {model_id}"
+        }), 400
+    if initialize_model(model_id):
         return jsonify({
             'status': 'success',
             'message': 'Model loaded successfully',
+            'model': model_id,
             'device': device
         })
     else:
@@ -224,14 +482,17 @@ if __name__ == '__main__':
         logger.info("💡 For faster generation, use a computer with NVIDIA GPU")
     
     logger.info("=" * 60)
-    logger.info("📝 Model will be downloaded on first request (~5GB)")
-    logger.info("📝 First generation will take longer (model loading)")
+    if PRELOAD_MODEL:
+        logger.info("📝 Pre-loading model in the background (~5GB download on first run)")
+        logger.info("📝 GET /health/ready returns 200 once it is loaded")
+    else:
+        logger.info("📝 Model will be downloaded on first request (~5GB)")
+        logger.info("📝 First generation will take longer (model loading)")
     logger.info("📝 Subsequent generations will be faster")
     logger.info("=" * 60)
     
-    # Optionally pre-load model (uncomment to load on startup)
-    # logger.info("Pre-loading model...")
-    # initialize_model()
+    if PRELOAD_MODEL:
+        start_preload()
     
     logger.info(f"🌐 Starting server on http://localhost:{FLASK_PORT}")
     logger.info("=" * 60)
@@ -0,0 +1,82 @@
+"""
+Bounded fan-out for batch generation requests
+Runs unique batch items on a shared executor, never more than a model's
+concurrency limit at a time, and yields each result as soon as it finishes
+(run_batch_async does the same for an asyncio server)
+"""
+
+import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+def run_batch(items, run, limit_for, executor):
+    """Run items and yield (key, result, error) in completion order
+
+    items maps a key to (model_id, payload); run(payload) does the work and
+    limit_for(model_id) caps how many of a model's items run at once. If the
+    consumer stops iterating, items that have not started yet are cancelled.
+    """
+    waiting = defaultdict(deque)
+    for key, (model_id, payload) in items.items():
+        waiting[model_id].append((key, payload))
+
+    running = defaultdict(int)
+    futures = {}
+
+    def fill(model_id):
+        limit = max(1, int(limit_for(model_id)))
+        while waiting[model_id] and running[model_id] < limit:
+            key, payload = waiting[model_id].popleft()
+            futures[executor.submit(run, payload)] = (key, model_id)
+            running[model_id] += 1
+
+    try:
+        for model_id in list(waiting):
+            fill(model_id)
+
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                key, model_id = futures.pop(future)
+                running[model_id] -= 1
+                error = future.exception()
+                yield key, (None if error else future.result()), error
+                fill(model_id)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def run_batch_async(items, run, limit_for, executor):
+    """Async counterpart of run_batch(): waits for results on the event loop instead of a thread"""
+    loop = asyncio.get_running_loop()
+    waiting = defaultdict(deque)
+    for key, (model_id, payload) in items.items():
+        waiting[model_id].append((key, payload))
+
+    running = defaultdict(int)
+    futures = {}
+
+    def fill(model_id):
+        limit = max(1, int(limit_for(model_id)))
+        while waiting[model_id] and running[model_id] < limit:
+            key, payload = waiting[model_id].popleft()
+            futures[loop.run_in_executor(executor, run, payload)] = (key, model_id)
+            running[model_id] += 1
+
+    try:
+        for model_id in list(waiting):
+            fill(model_id)
+
+        while futures:
+            done, _ = await asyncio.wait(list(futures), return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                key, model_id = futures.pop(future)
+                running[model_id] -= 1
+                error = future.exception()
+                yield key, (None if error else future.result()), error
+                fill(model_id)
+    finally:
+        for future in futures:
+            future.cancel()
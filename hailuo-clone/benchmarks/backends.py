@@ -0,0 +1,321 @@
+"""
+Benchmark: each Flask backend against the local fake upstream (fake_upstream.py)
+For every backend and concurrency level, the backend runs in a subprocess that
+talks to a fake Space/Replicate server through the real client libraries, and
+that many clients send /generate-video requests back to back for a fixed time.
+We record requests/sec, p50/p95/p99 latency, errors, and the server's thread
+count and memory, and write everything as a JSON baseline that later runs can be
+compared against.
+
+Usage (from the hailuo-clone directory):
+    python benchmarks/backends.py --concurrency 1,8,32 --output benchmarks/baselines/local.json
+    python benchmarks/backends.py --latency lognormal:2:0.5 --error-rate 0.05 --compare benchmarks/baselines/local.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+from serving_modes import free_port, post_json, raise_fd_limit, read_proc_status, wait_until_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BACKENDS = ('backend', 'backend_enhanced', 'backend_replicate', 'backend_simple')
+# Compared between runs: a drop in rps or a rise in p95 beyond the tolerance is a regression
+COMPARED = (('rps', -1), ('p95_seconds', 1))
+
+
+# ---------------------------------------------------------------------------
+# Server side (runs in the subprocess)
+# ---------------------------------------------------------------------------
+
+def configure_backend(name, upstream_url, workdir, model_limit):
+    """Point a backend at the fake upstream through its own configuration"""
+    os.environ['HF_HUB_DISABLE_TELEMETRY'] = '1'
+    if name == 'backend':
+        os.environ['HF_SPACE_URL'] = upstream_url + '/'
+    elif name == 'backend_enhanced':
+        with open(os.path.join(ROOT, 'models.json')) as f:
+            config = json.load(f)
+        for info in config['models'].values():
+            info['space_url'] = upstream_url + '/'
+            info['max_concurrent_requests'] = model_limit
+        catalog_path = os.path.join(workdir, 'models.json')
+        with open(catalog_path, 'w') as f:
+            json.dump(config, f)
+        os.environ.update({
+            'MODELS_CONFIG_PATH': catalog_path,
+            'RESULT_CACHE_DIR': os.path.join(workdir, 'results'),
+            'VIDEO_STORE_DIR': os.path.join(workdir, 'videos'),
+            'JOB_STORE_PATH': '',
+            # Every benchmark client shares one IP
+            'RATE_LIMIT_PER_MINUTE': '0',
+        })
+    elif name == 'backend_replicate':
+        os.environ['REPLICATE_API_TOKEN'] = 'benchmark'
+        os.environ['REPLICATE_BASE_URL'] = upstream_url
+
+
+def serve(name, port, upstream_url, model_limit):
+    raise_fd_limit()
+    sys.path.insert(0, ROOT)
+    # Run from a scratch directory so the backend's .env, app.log and caches stay out of the repo
+    workdir = os.getcwd()
+    configure_backend(name, upstream_url, workdir, model_limit)
+    backend = __import__(name)
+    logging.disable(logging.INFO)
+
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', port, backend.app, threaded=True)
+    server.socket.listen(4096)
+    server.serve_forever()
+
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+def request_body(name, index, args):
+    body = {'prompt': f'benchmark clip {index}'}
+    if name == 'backend_enhanced':
+        body.update(model=args.enhanced_model, use_cache=False)
+    elif name == 'backend_replicate':
+        body['model'] = 'hailuo'
+    return body
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, min(len(values) - 1, round(fraction * len(values)) - 1))]
+
+
+async def run_level(name, port, pid, concurrency, args):
+    """Closed loop: concurrency clients each send their next request as soon as the last one returns"""
+    latencies = []
+    statuses = {}
+    samples = []
+    counter = iter(range(10 ** 9))
+    stop_at = time.monotonic() + args.duration
+
+    async def client():
+        while time.monotonic() < stop_at:
+            try:
+                status, latency = await post_json(port, '/generate-video',
+                                                  request_body(name, next(counter), args), args.timeout)
+            except (OSError, asyncio.TimeoutError):
+                status, latency = 0, None
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(latency)
+
+    async def sampler():
+        while time.monotonic() < stop_at:
+            samples.append(read_proc_status(pid))
+            await asyncio.sleep(0.1)
+
+    started = time.monotonic()
+    await asyncio.gather(sampler(), *(client() for _ in range(concurrency)))
+    # Requests still in flight at the stop time finish before the clock stops
+    wall = time.monotonic() - started
+
+    latencies.sort()
+    requests = sum(statuses.values())
+    threads = [t for t, _ in samples if t is not None]
+    rss = [r for _, r in samples if r is not None]
+    return {
+        'requests': requests,
+        'succeeded': len(latencies),
+        'failed': requests - len(latencies),
+        'statuses': statuses,
+        'wall_seconds': round(wall, 2),
+        'rps': round(len(latencies) / wall, 2),
+        'p50_seconds': _round(percentile(latencies, 0.50)),
+        'p95_seconds': _round(percentile(latencies, 0.95)),
+        'p99_seconds': _round(percentile(latencies, 0.99)),
+        'peak_threads': max(threads) if threads else None,
+        'peak_rss_mb': round(max(rss), 1) if rss else None,
+    }
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def start_backend(name, port, upstream_url, args, workdir):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', name, '--port', str(port),
+         '--upstream', upstream_url, '--model-limit', str(args.model_limit)],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+
+
+def wait_for_backend(server, port, timeout=60):
+    """Wait for the backend to listen; returns an error message if it exited instead"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            lines = server.stderr.read().strip().splitlines()
+            return lines[-1] if lines else f'exited with status {server.returncode}'
+        try:
+            wait_until_up(port, timeout=0.5)
+            return None
+        except RuntimeError:
+            pass
+    return f'did not start within {timeout}s'
+
+
+def bench_backend(name, upstream_url, args):
+    """Results for one backend at every concurrency level, each against a fresh server process"""
+    results = []
+    for concurrency in args.concurrency:
+        port = free_port()
+        with tempfile.TemporaryDirectory(prefix='bench-backend-') as workdir:
+            server = start_backend(name, port, upstream_url, args, workdir)
+            try:
+                error = wait_for_backend(server, port)
+                if error:
+                    print(f"  {name}: skipped ({error})", flush=True)
+                    return [{'backend': name, 'skipped': error}]
+                # One request first, so client construction isn't counted as load
+                asyncio.run(post_json(port, '/generate-video', request_body(name, 'warmup', args), args.timeout))
+                idle_threads, idle_rss = read_proc_status(server.pid)
+                result = asyncio.run(run_level(name, port, server.pid, concurrency, args))
+            finally:
+                server.terminate()
+                server.wait()
+                server.stderr.close()
+        result.update({
+            'backend': name,
+            'concurrency': concurrency,
+            'idle_threads': idle_threads,
+            'idle_rss_mb': round(idle_rss, 1) if idle_rss else None,
+        })
+        if idle_rss and result['peak_rss_mb']:
+            result['rss_kb_per_request'] = round((result['peak_rss_mb'] - idle_rss) * 1024 / concurrency, 1)
+        results.append(result)
+        print(f"  {name} c={concurrency}: {result['rps']} rps, p95 {result['p95_seconds']}s, "
+              f"{result['failed']} failed", flush=True)
+    return results
+
+
+def upstream_stats(url):
+    with urllib.request.urlopen(f'{url}/stats', timeout=5) as response:
+        return json.load(response)
+
+
+def compare(baseline, current, tolerance):
+    """Print rps/p95 changes against a baseline; returns the number of regressions"""
+    if baseline.get('settings') != current['settings']:
+        print("Warning: baseline was recorded with different settings:", baseline.get('settings'))
+    previous = {(r['backend'], r.get('concurrency')): r for r in baseline.get('results', [])}
+    regressions = 0
+    print(f"{'backend':>18} {'conc':>5} {'metric':>12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for result in current['results']:
+        before = previous.get((result['backend'], result.get('concurrency')))
+        if before is None or 'skipped' in result or 'skipped' in before:
+            continue
+        for metric, worse in COMPARED:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change * worse > tolerance
+            regressions += regressed
+            print(f"{result['backend']:>18} {result['concurrency']:>5} {metric:>12} {old:>10} {new:>10} "
+                  f"{change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--concurrency', default='1,4,16,64', help='Comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of load per level')
+    parser.add_argument('--latency', default='lognormal:1:0.25',
+                        help='Fake upstream latency: fixed:S, uniform:LOW:HIGH, exponential:MEAN or lognormal:MEDIAN:SIGMA')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of upstream calls that fail')
+    parser.add_argument('--output-bytes', type=int, default=1024 * 1024, help='Size of each fake video')
+    parser.add_argument('--model-limit', type=int, default=8, help='max_concurrent_requests for backend_enhanced models')
+    parser.add_argument('--enhanced-model', default='hunyuan-video', help='Model requested from backend_enhanced')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+    parser.add_argument('--output', help='Write the results (a baseline) to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON to compare against; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative change before a regression')
+    parser.add_argument('--serve', choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--upstream', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.upstream, args.model_limit)
+        return
+
+    raise_fd_limit()
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    upstream_port = free_port()
+    upstream_url = f'http://127.0.0.1:{upstream_port}'
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'fake_upstream.py'), '--port', str(upstream_port),
+         '--latency', args.latency, '--error-rate', str(args.error_rate), '--output-bytes', str(args.output_bytes)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(upstream_port)
+        results = []
+        for name in args.backends.split(','):
+            print(f"Benchmarking {name}", flush=True)
+            results.extend(bench_backend(name, upstream_url, args))
+        upstream_calls = upstream_stats(upstream_url)
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'settings': {
+            'duration': args.duration, 'latency': args.latency, 'error_rate': args.error_rate,
+            'output_bytes': args.output_bytes, 'model_limit': args.model_limit, 'enhanced_model': args.enhanced_model,
+        },
+        'upstream': upstream_calls,
+        'results': results,
+    }
+
+    columns = ('backend', 'concurrency', 'requests', 'failed', 'rps', 'p50_seconds', 'p95_seconds', 'p99_seconds',
+               'idle_threads', 'peak_threads', 'peak_rss_mb', 'rss_kb_per_request')
+    print(f"latency={args.latency} error_rate={args.error_rate} output_bytes={args.output_bytes}")
+    print('  '.join(f'{c:>18}' for c in columns))
+    for result in results:
+        if 'skipped' in result:
+            print(f"{result['backend']:>18}  skipped: {result['skipped']}")
+            continue
+        print('  '.join(f'{str(result.get(c)):>18}' for c in columns))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"{regressions} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Benchmark: CPU performance profiles on a tiny, randomly initialized CogVideoX
+Builds a small CogVideoX pipeline (random weights, nothing downloaded, random
+prompt embeddings in place of the T5 text encoder) and times whole generations,
+VAE decode included, under each profile from cpu_profiles.py. Every profile runs
+in its own process, since torch's thread pools can only be sized once.
+
+Usage (from the hailuo-clone directory):
+    python benchmarks/bench_cpu_profiles.py
+    python benchmarks/bench_cpu_profiles.py --profiles baseline,balanced,fast --layers 8 --size 128 --json cpu.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_memory import peak_rss_mb  # noqa: E402
+
+TEXT_TOKENS = 16
+TEXT_EMBED_DIM = 64
+
+
+def build_pipeline(args):
+    import torch
+    from diffusers import AutoencoderKLCogVideoX, CogVideoXDDIMScheduler, CogVideoXPipeline, CogVideoXTransformer3DModel
+
+    torch.manual_seed(0)
+    transformer = CogVideoXTransformer3DModel(
+        num_attention_heads=args.heads,
+        attention_head_dim=args.head_dim,
+        in_channels=4,
+        out_channels=4,
+        time_embed_dim=64,
+        text_embed_dim=TEXT_EMBED_DIM,
+        num_layers=args.layers,
+        sample_width=args.size // 8,
+        sample_height=args.size // 8,
+        sample_frames=args.frames,
+        patch_size=2,
+        temporal_compression_ratio=4,
+        max_text_seq_length=TEXT_TOKENS,
+    )
+    vae = AutoencoderKLCogVideoX(
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("CogVideoXDownBlock3D",) * 4,
+        up_block_types=("CogVideoXUpBlock3D",) * 4,
+        block_out_channels=(32, 32, 64, 64),
+        latent_channels=4,
+        layers_per_block=1,
+        norm_num_groups=8,
+        temporal_compression_ratio=4,
+    )
+    # The text encoder is replaced by prompt embeddings, so no tokenizer or T5 weights are needed
+    return CogVideoXPipeline(tokenizer=None, text_encoder=None, vae=vae, transformer=transformer,
+                             scheduler=CogVideoXDDIMScheduler())
+
+
+def run_profile(name, args):
+    """Time generations under one profile (in this process); returns the result dict"""
+    import torch
+    from cpu_profiles import bf16_supported, configure_process, get_profile, prepare_pipeline, profile_context
+
+    profile = get_profile(name)
+    configure_process(profile)
+    pipeline = build_pipeline(args)
+    prepare_pipeline(pipeline, profile)
+    embeds = torch.randn(1, TEXT_TOKENS, TEXT_EMBED_DIM, generator=torch.Generator().manual_seed(0))
+
+    def generate():
+        with torch.inference_mode(), profile_context(pipeline, profile):
+            return pipeline(
+                prompt_embeds=embeds,
+                negative_prompt_embeds=torch.zeros_like(embeds),
+                height=args.size,
+                width=args.size,
+                num_frames=args.frames,
+                num_inference_steps=args.steps,
+                guidance_scale=6.0,
+                generator=torch.Generator().manual_seed(0),
+                output_type='np',
+            ).frames
+
+    # The first call pays for torch.compile and one-off allocations
+    started = time.perf_counter()
+    generate()
+    first = time.perf_counter() - started
+    times = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        generate()
+        times.append(time.perf_counter() - started)
+    return {
+        'profile': name,
+        'intra_op_threads': torch.get_num_threads(),
+        'inter_op_threads': torch.get_num_interop_threads(),
+        'bf16_native': bf16_supported(),
+        'first_seconds': round(first, 3),
+        'mean_seconds': round(sum(times) / len(times), 3),
+        'min_seconds': round(min(times), 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--profiles', default='baseline,balanced,fast,compiled')
+    parser.add_argument('--runs', type=int, default=3, help='Timed generations per profile (after one warm-up)')
+    parser.add_argument('--steps', type=int, default=4, help='Denoising steps per generation')
+    parser.add_argument('--frames', type=int, default=17, help='Frames per video (4k + 1)')
+    parser.add_argument('--size', type=int, default=96, help='Video height and width (a multiple of 16)')
+    parser.add_argument('--layers', type=int, default=2, help='Transformer layers')
+    parser.add_argument('--heads', type=int, default=8)
+    parser.add_argument('--head-dim', type=int, default=32)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.size % 16 or (args.frames - 1) % 4:
+        parser.error('--size must be a multiple of 16 and --frames one more than a multiple of 4')
+
+    if args.run:
+        print(json.dumps(run_profile(args.run, args)))
+        return
+
+    child_args = [f'--{key.replace("_", "-")}={value}' for key, value in vars(args).items()
+                  if key not in ('profiles', 'json', 'run')]
+    results = []
+    for name in args.profiles.split(','):
+        print(f"Running {name}...", flush=True)
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', name, *child_args],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            lines = child.stderr.strip().splitlines()
+            results.append({'profile': name, 'error': lines[-1] if lines else f'exit status {child.returncode}'})
+            continue
+        results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    baseline = next((r for r in results if r['profile'] == 'baseline' and 'error' not in r), None)
+    print(f"\n{args.size}x{args.size}, {args.frames} frames, {args.steps} steps, {args.layers} layers")
+    print(f"{'profile':>10} {'threads':>8} {'bf16':>5} {'first s':>8} {'mean s':>8} {'min s':>8} "
+          f"{'speedup':>8} {'peak MB':>8}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['profile']:>10}  failed: {result['error']}")
+            continue
+        if baseline:
+            result['speedup'] = round(baseline['mean_seconds'] / result['mean_seconds'], 2)
+        threads = f"{result['intra_op_threads']}/{result['inter_op_threads']}"
+        print(f"{result['profile']:>10} {threads:>8} {str(result['bf16_native']):>5} {result['first_seconds']:>8} "
+              f"{result['mean_seconds']:>8} {result['min_seconds']:>8} {str(result.get('speedup', '-')):>8} "
+              f"{result['peak_rss_mb']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': {k: v for k, v in vars(args).items() if k not in ('json', 'run')},
+                       'cpus': os.cpu_count(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
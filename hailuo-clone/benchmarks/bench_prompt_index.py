@@ -0,0 +1,93 @@
+"""
+Benchmark: near-duplicate prompt index lookup latency and memory at scale
+Fills a PromptIndex with N random fingerprints plus a handful of real prompts,
+then times find() for prompt variants (the time includes fingerprinting).
+Exits with status 1 if prompts that mean different things fingerprint as
+near-duplicates.
+
+Usage (from the hailuo-clone directory):
+    python benchmarks/bench_prompt_index.py --entries 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_memory import peak_rss_mb  # noqa: E402
+from prompt_index import PromptIndex, fingerprint_prompt, similarity  # noqa: E402
+
+SCOPE = ('cogvideox-5b', 0)
+STORED = "cinematic, A majestic waterfall cascading down mossy rocks in a lush rainforest, slow motion, fog"
+QUERIES = {
+    'reordered tags, punctuation': "fog, slow motion!  a majestic waterfall cascading down mossy rocks in a lush rainforest, Cinematic",
+    'article changes': "cinematic, majestic waterfall cascading down the mossy rocks in lush rainforest, slow motion, fog",
+    'unrelated prompt': "A dragon flying over a medieval castle at dawn",
+}
+# Same words, different videos: these must stay below the default PROMPT_SIMILARITY_THRESHOLD
+DEFAULT_THRESHOLD = 0.95
+DISTINCT_PAIRS = [
+    ("A cat under the boat!", "a cat on a boat"),
+    ("man bites dog", "dog bites man"),
+    ("jumps over the fence", "jumps under the fence"),
+]
+
+
+def check_distinct_pairs():
+    """Similarity of each DISTINCT_PAIRS pair; returns the pairs that would be served each other's video"""
+    failures = []
+    for first, second in DISTINCT_PAIRS:
+        score = similarity(bin(fingerprint_prompt(first) ^ fingerprint_prompt(second)).count('1'))
+        print(f"  {first!r} vs {second!r}: similarity {score:.3f}")
+        if score >= DEFAULT_THRESHOLD:
+            failures.append((first, second, score))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    print("Prompts with different meanings:")
+    failures = check_distinct_pairs()
+
+    rss_before = peak_rss_mb()
+    index = PromptIndex(max_entries=args.entries + 1)
+    rng = random.Random(0)
+    started = time.perf_counter()
+    for _ in range(args.entries):
+        index.add_fingerprint(SCOPE, rng.getrandbits(64), rng.randbytes(32))
+    build_seconds = time.perf_counter() - started
+    index.add(SCOPE, STORED, b'stored')
+    rss_mb = peak_rss_mb() - rss_before
+
+    results = {'entries': len(index), 'build_seconds': round(build_seconds, 1), 'index_rss_mb': round(rss_mb, 1),
+               'lookups': {}}
+    print(f"{len(index)} entries built in {build_seconds:.1f}s, ~{rss_mb:.0f} MB")
+    for name, query in QUERIES.items():
+        started = time.perf_counter()
+        for _ in range(args.lookups):
+            matches = index.find(SCOPE, query)
+        micros = (time.perf_counter() - started) / args.lookups * 1e6
+        found = any(key == b'stored' for key, _ in matches)
+        results['lookups'][name] = {'microseconds': round(micros, 1), 'found_stored_prompt': found}
+        print(f"  {name:<30} {micros:8.1f} us/lookup  found={found}")
+
+    results['distinct_pair_failures'] = [list(failure) for failure in failures]
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if failures:
+        print(f"{len(failures)} pair(s) with different meanings reach the {DEFAULT_THRESHOLD} threshold")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
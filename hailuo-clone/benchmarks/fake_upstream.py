@@ -0,0 +1,307 @@
+"""
+Local stand-in for the Hugging Face Spaces and Replicate APIs the backends call
+Speaks the Gradio 3.x HTTP API that gradio-client 0.7.1 uses (/config, /info,
+/api/predict/ and /file=...) and Replicate's predictions API (/v1/...), so the
+real client libraries can be benchmarked without leaving the machine. Every call
+takes a latency drawn from a configurable distribution, fails at a configurable
+rate, and produces a video of a configurable size that the client downloads.
+
+Usage (from the hailuo-clone directory):
+    python benchmarks/fake_upstream.py --port 7860 --latency lognormal:2:0.5 --error-rate 0.02
+Point a backend at it with HF_SPACE_URL=http://127.0.0.1:7860/ (backend.py),
+space_url in models.json (backend_enhanced.py) or REPLICATE_BASE_URL (backend_replicate.py).
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Gradio component types of each fake endpoint's inputs, named after the Spaces the backends call
+GRADIO_ENDPOINTS = {
+    'predict': ('textbox', 'number', 'number', 'number'),
+    'infer': ('textbox', 'number'),
+    'generate': ('textbox',),
+    'generate_video': ('image',),
+    'test': ('textbox',),
+}
+OUTPUT_ID = 100
+VIDEO_CHUNK = 64 * 1024
+
+
+def parse_distribution(text):
+    """A latency sampler from "fixed:S", "uniform:LOW:HIGH", "exponential:MEAN" or "lognormal:MEDIAN:SIGMA" """
+    kind, _, params = text.partition(':')
+    try:
+        values = [float(value) for value in params.split(':')] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid latency distribution {text!r}")
+    samplers = {
+        ('fixed', 1): lambda: values[0],
+        ('uniform', 2): lambda: random.uniform(values[0], values[1]),
+        ('exponential', 1): lambda: random.expovariate(1 / values[0]) if values[0] > 0 else 0.0,
+        ('lognormal', 2): lambda: values[0] * random.lognormvariate(0, values[1]),
+    }
+    sampler = samplers.get((kind, len(values)))
+    if sampler is None:
+        raise ValueError(f"Invalid latency distribution {text!r}; "
+                         f"use fixed:S, uniform:LOW:HIGH, exponential:MEAN or lognormal:MEDIAN:SIGMA")
+    return sampler
+
+
+def gradio_config():
+    """Config of a Gradio 3.x app exposing GRADIO_ENDPOINTS over plain HTTP (no queue)"""
+    components = [{'id': OUTPUT_ID, 'type': 'video', 'serializer': 'VideoSerializable', 'props': {}}]
+    dependencies = []
+    next_id = 1
+    for api_name, input_types in GRADIO_ENDPOINTS.items():
+        inputs = []
+        for input_type in input_types:
+            components.append({'id': next_id, 'type': input_type, 'props': {}})
+            inputs.append(next_id)
+            next_id += 1
+        dependencies.append({
+            'targets': [], 'trigger': 'click', 'inputs': inputs, 'outputs': [OUTPUT_ID],
+            'backend_fn': True, 'api_name': api_name, 'queue': False,
+        })
+    return {'version': '3.50.2', 'mode': 'blocks', 'enable_queue': False,
+            'components': components, 'dependencies': dependencies}
+
+
+class FakeUpstream:
+    """Latency, failure and output-size model shared by the fake APIs"""
+
+    def __init__(self, latency, error_rate=0.0, output_bytes=1024 * 1024):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.output_bytes = output_bytes
+        self.config = json.dumps(gradio_config()).encode()
+        self._lock = threading.Lock()
+        # Replicate prediction id -> model, input, created, ready_at, fails, cancelled
+        self._predictions = {}
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def start_call(self):
+        """(seconds the call takes, whether it fails)"""
+        with self._lock:
+            self.calls += 1
+            fails = random.random() < self.error_rate
+            if fails:
+                self.errors += 1
+        return max(0.0, self.latency()), fails
+
+    def run_call(self):
+        """Block like a synchronous Space call; returns whether it failed"""
+        seconds, fails = self.start_call()
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            time.sleep(seconds)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        return fails
+
+    def create_prediction(self, model, body):
+        seconds, fails = self.start_call()
+        prediction_id = uuid.uuid4().hex[:16]
+        now = time.time()
+        with self._lock:
+            self._predictions[prediction_id] = {
+                'model': model, 'input': body.get('input', {}), 'created': now,
+                'ready_at': now + seconds, 'fails': fails, 'cancelled': False,
+            }
+        return prediction_id
+
+    def prediction(self, prediction_id, base_url):
+        """Replicate's JSON for a prediction, or None if unknown"""
+        with self._lock:
+            record = self._predictions.get(prediction_id)
+            if record is None:
+                return None
+            record = dict(record)
+        now = time.time()
+        if record['cancelled']:
+            status = 'canceled'
+        elif now < record['ready_at']:
+            status = 'processing'
+        else:
+            status = 'failed' if record['fails'] else 'succeeded'
+        done = status in ('succeeded', 'failed', 'canceled')
+        return {
+            'id': prediction_id,
+            'model': record['model'],
+            'version': 'fake',
+            'status': status,
+            'input': record['input'],
+            'output': f'{base_url}/files/{prediction_id}.mp4' if status == 'succeeded' else None,
+            'error': 'Fake upstream failure' if status == 'failed' else None,
+            'logs': '',
+            'metrics': {'predict_time': round(record['ready_at'] - record['created'], 3)} if done else {},
+            'created_at': _iso(record['created']),
+            'started_at': _iso(record['created']),
+            'completed_at': _iso(min(now, record['ready_at'])) if done else None,
+            'urls': {'get': f'{base_url}/v1/predictions/{prediction_id}',
+                     'cancel': f'{base_url}/v1/predictions/{prediction_id}/cancel'},
+        }
+
+    def wait_for_prediction(self, prediction_id, timeout):
+        with self._lock:
+            record = self._predictions.get(prediction_id)
+        if record is not None:
+            time.sleep(max(0.0, min(timeout, record['ready_at'] - time.time())))
+
+    def cancel_prediction(self, prediction_id):
+        with self._lock:
+            record = self._predictions.get(prediction_id)
+            if record is not None:
+                record['cancelled'] = True
+            return record is not None
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors, 'in_flight': self.in_flight,
+                    'peak_in_flight': self.peak_in_flight, 'predictions': len(self._predictions)}
+
+
+def _iso(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + f'.{int(timestamp % 1 * 1e6):06d}Z'
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'FakeUpstream/1.0'
+    upstream = None
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def base_url(self):
+        return f'http://{self.headers.get("Host", "127.0.0.1")}'
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/config':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(self.upstream.config)))
+            self.end_headers()
+            self.wfile.write(self.upstream.config)
+        elif path == '/info':
+            self.send_json({'named_endpoints': {}, 'unnamed_endpoints': {}})
+        elif path == '/stats':
+            self.send_json(self.upstream.stats())
+        elif path.startswith('/file=') or path.startswith('/files/'):
+            self.send_video()
+        elif match := re.fullmatch(r'/v1/predictions/(\w+)', path):
+            prediction = self.upstream.prediction(match.group(1), self.base_url)
+            if prediction is None:
+                self.send_json({'detail': 'Not found.'}, 404)
+            else:
+                self.send_json(prediction)
+        else:
+            self.send_json({'detail': 'Not found.'}, 404)
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        if path.rstrip('/') == '/api/predict':
+            self.gradio_predict()
+        elif match := re.fullmatch(r'/v1/models/([\w.-]+)/([\w.-]+)/predictions', path):
+            self.replicate_create(f'{match.group(1)}/{match.group(2)}')
+        elif path == '/v1/predictions':
+            self.replicate_create(None)
+        elif match := re.fullmatch(r'/v1/predictions/(\w+)/cancel', path):
+            if not self.upstream.cancel_prediction(match.group(1)):
+                self.send_json({'detail': 'Not found.'}, 404)
+            else:
+                self.send_json(self.upstream.prediction(match.group(1), self.base_url))
+        else:
+            self.send_json({'detail': 'Not found.'}, 404)
+
+    def gradio_predict(self):
+        body = self.read_json()
+        if self.upstream.run_call():
+            # Gradio 3.x reports a failed prediction as a JSON error
+            self.send_json({'error': 'Fake upstream failure'}, 500)
+            return
+        name = f'/tmp/fake-upstream/{uuid.uuid4().hex}.mp4'
+        video = {'name': name, 'data': None, 'is_file': True, 'orig_name': 'output.mp4'}
+        self.send_json({'data': [[video, None]], 'is_generating': False,
+                        'duration': 0, 'average_duration': 0, 'fn_index': body.get('fn_index')})
+
+    def replicate_create(self, model):
+        body = self.read_json()
+        prediction_id = self.upstream.create_prediction(model or body.get('version'), body)
+        # Newer clients ask the server to hold the response until the prediction finishes
+        prefer = self.headers.get('Prefer', '')
+        if prefer.startswith('wait'):
+            _, _, seconds = prefer.partition('=')
+            self.upstream.wait_for_prediction(prediction_id, float(seconds or 60))
+        self.send_json(self.upstream.prediction(prediction_id, self.base_url), 201)
+
+    def send_video(self):
+        size = self.upstream.output_bytes
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = b'\0' * VIDEO_CHUNK
+        sent = 0
+        while sent < size:
+            n = min(VIDEO_CHUNK, size - sent)
+            self.wfile.write(chunk[:n])
+            sent += n
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 4096
+
+
+def make_server(port, latency, error_rate=0.0, output_bytes=1024 * 1024, host='127.0.0.1'):
+    """A threaded HTTP server for the fake APIs; call serve_forever() on it"""
+    handler = type('FakeUpstreamHandler', (Handler,), {'upstream': FakeUpstream(latency, error_rate, output_bytes)})
+    return Server((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7860)
+    parser.add_argument('--latency', default='fixed:2',
+                        help='fixed:S, uniform:LOW:HIGH, exponential:MEAN or lognormal:MEDIAN:SIGMA (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls that fail')
+    parser.add_argument('--output-bytes', type=int, default=1024 * 1024, help='Size of each generated video')
+    args = parser.parse_args()
+
+    server = make_server(args.port, parse_distribution(args.latency), args.error_rate, args.output_bytes, args.host)
+    print(f"Fake upstream on http://{args.host}:{args.port}/ (latency {args.latency}, "
+          f"error rate {args.error_rate}, {args.output_bytes} byte videos)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
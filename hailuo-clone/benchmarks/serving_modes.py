@@ -0,0 +1,263 @@
+"""
+Benchmark: threaded Flask server vs asyncio (ASGI) server for the enhanced backend
+Each mode runs in a subprocess with the Gradio client replaced by an in-process
+fake Space of fixed latency. N concurrent /generate-video requests are fired at
+it and we record completions, latency, and the server's peak thread count and RSS.
+
+Usage (from the hailuo-clone directory):
+    python benchmarks/serving_modes.py --connections 1000 --latency 5
+    python benchmarks/serving_modes.py --scenario unique --model-limit 8 --connections 200
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# ---------------------------------------------------------------------------
+# Server side (runs in the subprocess)
+# ---------------------------------------------------------------------------
+
+class _Timer:
+    """Resolves fake jobs from one background thread, so the fake adds no threads per call"""
+
+    def __init__(self):
+        self._heap = []
+        self._cond = threading.Condition()
+        self._counter = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def schedule(self, delay, callback):
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, callback))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, callback = heapq.heappop(self._heap)
+            callback()
+
+
+def install_fake_space(latency):
+    import backend_enhanced
+    timer = _Timer()
+
+    class FakeClient:
+        def __init__(self, src, **kwargs):
+            self.src = src
+
+        def submit(self, *args, **kwargs):
+            job = Future()
+            job.set_running_or_notify_cancel()
+            delay = latency * random.uniform(0.9, 1.1)
+            timer.schedule(delay, lambda: job.done() or job.set_result(['/tmp/fake-video.mp4']))
+            return job
+
+        def predict(self, *args, **kwargs):
+            return self.submit(*args, **kwargs).result()
+
+    backend_enhanced.Client = FakeClient
+
+
+def serve(mode, port, latency, model_limit):
+    raise_fd_limit()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('RESULT_CACHE_DIR', os.path.join(ROOT, 'cache', 'bench-results'))
+    os.environ['CLIENT_ACQUIRE_TIMEOUT'] = '3600'
+    os.environ['ASYNC_UPSTREAM_THREADS'] = str(max(32, model_limit))
+    # Every benchmark client shares one IP
+    os.environ['RATE_LIMIT_PER_MINUTE'] = '0'
+    import json
+    import logging
+    with open(os.path.join(ROOT, 'models.json')) as f:
+        config = json.load(f)
+    for info in config['models'].values():
+        info['max_concurrent_requests'] = model_limit
+    catalog_path = os.path.join(ROOT, 'cache', f'bench-models-{os.getpid()}.json')
+    os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+    with open(catalog_path, 'w') as f:
+        json.dump(config, f)
+    os.environ['MODELS_CONFIG_PATH'] = catalog_path
+    install_fake_space(latency)
+    logging.disable(logging.INFO)
+
+    if mode == 'threaded':
+        from werkzeug.serving import make_server
+        import backend_enhanced
+        server = make_server('127.0.0.1', port, backend_enhanced.app, threaded=True)
+        server.socket.listen(4096)
+        server.serve_forever()
+    else:
+        import uvicorn
+        import backend_async
+        uvicorn.run(backend_async.app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+def read_proc_status(pid):
+    """(threads, rss_mb) of a process from /proc, or (None, None) where unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['Threads']), int(fields['VmRSS'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+async def post_json(port, path, body, timeout):
+    data = json.dumps(body).encode()
+    started = time.monotonic()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write(
+            f'POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data
+        )
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    status = int(response.split(b' ', 2)[1]) if response else 0
+    return status, time.monotonic() - started
+
+
+async def run_load(port, pid, connections, scenario, timeout):
+    samples = []
+    done = asyncio.Event()
+
+    async def sampler():
+        while not done.is_set():
+            samples.append(read_proc_status(pid))
+            await asyncio.sleep(0.1)
+
+    async def one(index):
+        prompt = 'benchmark clip' if scenario == 'identical' else f'benchmark clip {index}'
+        try:
+            return await post_json(port, '/generate-video',
+                                   {'prompt': prompt, 'model': 'cogvideox-2b', 'use_cache': False}, timeout)
+        except (OSError, asyncio.TimeoutError):
+            return 0, None
+
+    sampling = asyncio.ensure_future(sampler())
+    started = time.monotonic()
+    results = await asyncio.gather(*(one(i) for i in range(connections)))
+    wall = time.monotonic() - started
+    done.set()
+    await sampling
+
+    latencies = sorted(latency for status, latency in results if status == 200)
+    threads = [t for t, _ in samples if t is not None]
+    rss = [r for _, r in samples if r is not None]
+    return {
+        'connections': connections,
+        'succeeded': len(latencies),
+        'failed': connections - len(latencies),
+        'wall_seconds': round(wall, 2),
+        'p50_seconds': round(statistics.median(latencies), 2) if latencies else None,
+        'p95_seconds': round(latencies[int(len(latencies) * 0.95) - 1], 2) if latencies else None,
+        'peak_threads': max(threads) if threads else None,
+        'peak_rss_mb': round(max(rss), 1) if rss else None,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def bench_mode(mode, args):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port),
+         '--latency', str(args.latency), '--model-limit', str(args.model_limit)],
+        cwd=ROOT,
+    )
+    try:
+        wait_until_up(port)
+        time.sleep(0.5)
+        idle_threads, idle_rss = read_proc_status(server.pid)
+        result = asyncio.run(run_load(port, server.pid, args.connections, args.scenario, args.timeout))
+        result.update({'mode': mode, 'idle_threads': idle_threads,
+                       'idle_rss_mb': round(idle_rss, 1) if idle_rss else None})
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=5.0, help='Fake Space latency in seconds')
+    parser.add_argument('--scenario', choices=('identical', 'unique'), default='identical',
+                        help='identical: every request coalesces onto one generation; '
+                             'unique: every request needs its own upstream slot')
+    parser.add_argument('--model-limit', type=int, default=8, help='max_concurrent_requests for every model')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--modes', default='threaded,async')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--serve', choices=('threaded', 'async'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.latency, args.model_limit)
+        return
+
+    raise_fd_limit()
+    results = [bench_mode(mode, args) for mode in args.modes.split(',')]
+
+    columns = ('mode', 'connections', 'succeeded', 'failed', 'wall_seconds', 'p50_seconds', 'p95_seconds',
+               'idle_threads', 'peak_threads', 'idle_rss_mb', 'peak_rss_mb')
+    print(f"scenario={args.scenario} latency={args.latency}s model_limit={args.model_limit}")
+    print('  '.join(f'{c:>13}' for c in columns))
+    for result in results:
+        print('  '.join(f'{str(result[c]):>13}' for c in columns))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'scenario': args.scenario, 'latency': args.latency,
+                       'model_limit': args.model_limit, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Request deadlines and client-disconnect detection
+A WSGI worker thread blocked on a Space can't notice that its client went
+away, so one monitor thread polls the sockets of waiting requests and cancels
+their CancelToken when the peer closes the connection. Deadlines are absolute
+wall-clock times, so they survive being stored with a job.
+"""
+
+import logging
+import selectors
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from hedging import CancelToken
+
+logger = logging.getLogger(__name__)
+
+
+def remaining(deadline):
+    """Seconds left before deadline (never negative), or None without a deadline"""
+    return None if deadline is None else max(0.0, deadline - time.time())
+
+
+def expired(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def request_socket(environ):
+    """The client connection of a WSGI request, where the server exposes it"""
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+
+
+class DisconnectMonitor:
+    """Cancels tokens of requests whose client closed its connection"""
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # id(token) -> (socket, token)
+        self._watched = {}
+        self._thread = None
+        self.disconnects = 0
+
+    @contextmanager
+    def watching(self, sock):
+        """Yield a CancelToken that is cancelled if sock's peer disconnects during the block"""
+        token = CancelToken()
+        if sock is None:
+            yield token
+            return
+        with self._lock:
+            self._watched[id(token)] = (sock, token)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="disconnect-monitor", daemon=True)
+                self._thread.start()
+        try:
+            yield token
+        finally:
+            with self._lock:
+                self._watched.pop(id(token), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            if watched:
+                self._poll(watched)
+
+    def _poll(self, watched):
+        with selectors.DefaultSelector() as selector:
+            for key, (sock, _) in watched:
+                try:
+                    selector.register(sock, selectors.EVENT_READ, key)
+                except (ValueError, OSError):
+                    # Already closed on our side
+                    continue
+            ready = selector.select(timeout=0)
+        watched = dict(watched)
+        for selector_key, _ in ready:
+            sock, token = watched[selector_key.data]
+            try:
+                # Readable with nothing to read means the peer sent FIN
+                closed = sock.recv(1, socket.MSG_PEEK) == b''
+            except BlockingIOError:
+                continue
+            except OSError:
+                closed = True
+            if closed:
+                with self._lock:
+                    self._watched.pop(selector_key.data, None)
+                self.disconnects += 1
+                logger.info("Client disconnected; cancelling its generation")
+                token.cancel()
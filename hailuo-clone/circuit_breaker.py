@@ -0,0 +1,151 @@
+"""
+Per-model circuit breakers for Hugging Face Spaces
+After repeated failures (or one failed connection) a model's circuit opens and
+requests fail fast for a cool-down window; then a single probe request is let
+through to decide whether to close the circuit again
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Breaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self.last_error = None
+        self.times_opened = 0
+
+
+class CircuitBreakers:
+    """Tracks a closed/open/half-open circuit for each model"""
+
+    def __init__(self, failure_threshold=3, cooldown_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    @contextmanager
+    def _breaker(self, model_id):
+        """Hold the model's breaker for a read-modify-write"""
+        with self._lock:
+            breaker = self._breakers.get(model_id)
+            if breaker is None:
+                breaker = _Breaker()
+                self._breakers[model_id] = breaker
+            yield breaker
+
+    def _all(self):
+        with self._lock:
+            return dict(self._breakers)
+
+    def allow(self, model_id):
+        """Return True if a request to the model may go ahead"""
+        with self._breaker(model_id) as breaker:
+            now = time.time()
+            if breaker.state == CLOSED:
+                return True
+            if breaker.state == OPEN:
+                if now - breaker.opened_at < self.cooldown_seconds:
+                    return False
+                breaker.state = HALF_OPEN
+                breaker.probe_started_at = now
+                return True
+            # Half-open: one probe at a time, unless the last probe never reported back
+            if now - breaker.probe_started_at >= self.cooldown_seconds:
+                breaker.probe_started_at = now
+                return True
+            return False
+
+    def record_success(self, model_id):
+        """Close the circuit after a successful call"""
+        with self._breaker(model_id) as breaker:
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.opened_at = None
+            breaker.probe_started_at = None
+
+    def record_failure(self, model_id, error=None, trip=False):
+        """Count a failed call; open the circuit at the threshold, on a failed probe, or if trip is set"""
+        with self._breaker(model_id) as breaker:
+            breaker.failures += 1
+            breaker.last_error = str(error) if error is not None else None
+            if trip or breaker.state == HALF_OPEN or breaker.failures >= self.failure_threshold:
+                if breaker.state != OPEN:
+                    breaker.times_opened += 1
+                breaker.state = OPEN
+                breaker.opened_at = time.time()
+                breaker.probe_started_at = None
+
+    def retry_after(self, model_id):
+        """Seconds until the model's circuit will allow a probe"""
+        with self._breaker(model_id) as breaker:
+            if breaker.state == OPEN:
+                return max(1, int(breaker.opened_at + self.cooldown_seconds - time.time()) + 1)
+            if breaker.state == HALF_OPEN:
+                return max(1, int(breaker.probe_started_at + self.cooldown_seconds - time.time()) + 1)
+            return 0
+
+    def state(self, model_id):
+        with self._breaker(model_id) as breaker:
+            return breaker.state
+
+    def stats(self):
+        """Circuit state per model"""
+        return {
+            model_id: {
+                'state': breaker.state,
+                'failures': breaker.failures,
+                'times_opened': breaker.times_opened,
+                'last_error': breaker.last_error,
+            }
+            for model_id, breaker in self._all().items()
+        }
+
+
+class SharedCircuitBreakers(CircuitBreakers):
+    """Circuit breakers kept in a SharedState database so every worker process sees them
+
+    One worker finding a Space asleep opens the circuit for all of them.
+    """
+
+    COLUMNS = ('state', 'failures', 'opened_at', 'probe_started_at', 'last_error', 'times_opened')
+
+    def __init__(self, shared, failure_threshold=3, cooldown_seconds=60):
+        super().__init__(failure_threshold, cooldown_seconds)
+        self.shared = shared
+
+    def _from_row(self, row):
+        breaker = _Breaker()
+        for name, value in zip(self.COLUMNS, row):
+            setattr(breaker, name, value)
+        return breaker
+
+    @contextmanager
+    def _breaker(self, model_id):
+        with self.shared.transaction() as db:
+            row = db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM circuits WHERE model_id = ?", (model_id,)
+            ).fetchone()
+            breaker = self._from_row(row) if row else _Breaker()
+            before = [getattr(breaker, name) for name in self.COLUMNS]
+            yield breaker
+            after = [getattr(breaker, name) for name in self.COLUMNS]
+            if row is None or after != before:
+                db.execute(
+                    f"INSERT OR REPLACE INTO circuits (model_id, {', '.join(self.COLUMNS)}) "
+                    f"VALUES (?, {', '.join('?' * len(self.COLUMNS))})",
+                    (model_id, *after)
+                )
+
+    def _all(self):
+        rows = self.shared.execute(f"SELECT model_id, {', '.join(self.COLUMNS)} FROM circuits").fetchall()
+        return {row[0]: self._from_row(row[1:]) for row in rows}
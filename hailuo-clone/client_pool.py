@@ -0,0 +1,236 @@
+"""
+Thread-safe pool of Gradio clients, one per model
+Builds each client once behind a per-model lock, bounds how many predict calls
+may run against a model at the same time (handing free slots out by priority and
+tenant share, see scheduler.py), and replaces clients that keep failing.
+With SharedSlotLeases, the per-model bound holds across worker processes too.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from scheduler import FairSlots
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(TimeoutError):
+    """Raised when no predict slot for a model frees up within the wait timeout"""
+
+
+class _ModelSlot:
+    """Client and concurrency state for a single model"""
+
+    def __init__(self, max_in_flight, weight_for=None):
+        self.max_in_flight = max_in_flight
+        self.slots = FairSlots(max_in_flight, weight_for)
+        self.build_lock = threading.Lock()
+        self.client = None
+        self.created_at = None
+        self.build_seconds = None
+        self.consecutive_failures = 0
+        self.replacements = 0
+
+
+class SharedSlotLeases:
+    """Caps a model's predict calls across worker processes with leased rows in a SharedState database
+
+    Each held slot is a row whose lease this process renews while the call runs;
+    the slots of a process that died free up once their leases run out.
+    """
+
+    def __init__(self, shared, lease_seconds=30, poll_interval=0.25):
+        self.shared = shared
+        self.lease_seconds = lease_seconds
+        # How often a waiting caller retries while every slot is held
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._held = set()
+        self._pid = None
+
+    def acquire(self, model_id, limit, timeout):
+        """Take one of limit slots for model_id; returns a holder ID, or None after timeout seconds"""
+        holder = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while True:
+            # Wall-clock time, since leases are compared across processes
+            now = time.time()
+            with self.shared.transaction() as db:
+                db.execute("DELETE FROM model_slots WHERE lease_until < ?", (now,))
+                held = db.execute("SELECT COUNT(*) FROM model_slots WHERE model_id = ?", (model_id,)).fetchone()[0]
+                if held < limit:
+                    db.execute("INSERT INTO model_slots (holder, model_id, lease_until) VALUES (?, ?, ?)",
+                               (holder, model_id, now + self.lease_seconds))
+                    break
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            time.sleep(min(self.poll_interval, left))
+        with self._lock:
+            self._start_locked()
+            self._held.add(holder)
+        return holder
+
+    def release(self, holder):
+        with self._lock:
+            self._held.discard(holder)
+        self.shared.execute("DELETE FROM model_slots WHERE holder = ?", (holder,))
+
+    def _start_locked(self):
+        # Threads don't survive fork, so each worker process renews its own leases
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._held = set()
+        threading.Thread(target=self._renew, name="slot-lease-renewer", daemon=True).start()
+
+    def _renew(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                self.shared.execute(
+                    f"UPDATE model_slots SET lease_until = ? WHERE holder IN ({', '.join('?' * len(held))})",
+                    (time.time() + self.lease_seconds, *held)
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew {len(held)} model slot lease(s): {str(e)}")
+
+
+class ClientPool:
+    """Per-model clients with locked lazy construction and bounded concurrency"""
+
+    def __init__(self, factory, limit_for, acquire_timeout=30, max_failures=3, weight_for=None, shared_slots=None):
+        # factory(model_id) builds a client and raises on failure;
+        # limit_for(model_id) returns the max concurrent predict calls for that model;
+        # weight_for(tenant) returns a tenant's fair share within its priority class;
+        # shared_slots (a SharedSlotLeases) applies limit_for across worker processes
+        self.factory = factory
+        self.shared_slots = shared_slots
+        self.limit_for = limit_for
+        self.weight_for = weight_for
+        self.acquire_timeout = acquire_timeout
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def _slot(self, model_id):
+        with self._lock:
+            slot = self._slots.get(model_id)
+            if slot is None:
+                slot = _ModelSlot(max(1, int(self.limit_for(model_id))), self.weight_for)
+                self._slots[model_id] = slot
+            return slot
+
+    def get_client(self, model_id):
+        """Return the model's client, building it if needed (raises if that fails)"""
+        slot = self._slot(model_id)
+        client = slot.client
+        if client is not None:
+            return client
+        with slot.build_lock:
+            # Another thread may have finished building while we waited for the lock
+            if slot.client is None:
+                started = time.monotonic()
+                slot.client = self.factory(model_id)
+                slot.build_seconds = time.monotonic() - started
+                slot.created_at = time.time()
+                slot.consecutive_failures = 0
+            return slot.client
+
+    @contextmanager
+    def reserve(self, model_id, timeout=None, priority='interactive', tenant=None, on_wait=None):
+        """Hold one of the model's predict slots for the duration of the block
+
+        Waiters are served by priority, then by tenant share; on_wait(ticket)
+        is called if the request has to queue (see slot_position()).
+        """
+        slot = self._slot(model_id)
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        if not slot.slots.acquire(priority, tenant, timeout=timeout, on_wait=on_wait):
+            raise PoolSaturatedError(
+                f"All {slot.max_in_flight} slots for {model_id} are busy (waited {timeout}s)"
+            )
+        holder = None
+        try:
+            if self.shared_slots is not None:
+                # This process has a slot free; now take one of the model's slots across all processes
+                holder = self.shared_slots.acquire(
+                    model_id, slot.max_in_flight, max(0.0, timeout - (time.monotonic() - started)))
+                if holder is None:
+                    raise PoolSaturatedError(
+                        f"All {slot.max_in_flight} slots for {model_id} are busy in other workers (waited {timeout}s)"
+                    )
+            yield
+        finally:
+            if holder is not None:
+                self.shared_slots.release(holder)
+            slot.slots.release()
+
+    def load(self, model_id, priority=None):
+        """(in_flight, waiting, max_in_flight) for one model
+
+        With a priority, waiting counts only the requests a new request of
+        that priority would queue behind.
+        """
+        return self._slot(model_id).slots.load(priority)
+
+    def slot_position(self, model_id, ticket):
+        """(ahead, in_flight, max_in_flight) for a queued reservation's ticket"""
+        slot = self._slot(model_id)
+        in_flight, _, limit = slot.slots.load()
+        return slot.slots.ahead(ticket), in_flight, limit
+
+    def discard(self, model_id):
+        """Forget a model's client and limit; calls already holding the old slot finish on it"""
+        with self._lock:
+            self._slots.pop(model_id, None)
+
+    def report_success(self, model_id, client):
+        """Reset the failure count after a successful call"""
+        slot = self._slot(model_id)
+        if slot.client is client:
+            slot.consecutive_failures = 0
+
+    def report_failure(self, model_id, client, error):
+        """Record a failed call; drop the client if it looks broken"""
+        slot = self._slot(model_id)
+        with slot.build_lock:
+            if slot.client is not client:
+                return
+            slot.consecutive_failures += 1
+            broken = isinstance(error, (ConnectionError, OSError))
+            if broken or slot.consecutive_failures >= self.max_failures:
+                logger.warning(
+                    f"Replacing client for {model_id} after {slot.consecutive_failures} "
+                    f"consecutive failure(s): {str(error)}"
+                )
+                slot.client = None
+                slot.replacements += 1
+
+    def stats(self):
+        """Per-model client and concurrency counters"""
+        with self._lock:
+            slots = dict(self._slots)
+        stats = {}
+        for model_id, slot in slots.items():
+            queue = slot.slots.stats()
+            stats[model_id] = {
+                'connected': slot.client is not None,
+                'max_in_flight': slot.max_in_flight,
+                'in_flight': queue['in_flight'],
+                'waiting': sum(queue['waiting'].values()),
+                'waiting_by_priority': queue['waiting'],
+                'build_seconds': round(slot.build_seconds, 3) if slot.build_seconds is not None else None,
+                'consecutive_failures': slot.consecutive_failures,
+                'replacements': slot.replacements,
+            }
+        return stats
@@ -0,0 +1,159 @@
+"""
+CPU performance profiles for local generation
+A profile picks torch's thread counts, bfloat16 autocast, attention slicing,
+VAE tiling/slicing, the channels-last memory layout and torch.compile. Thread
+pools are sized once per process (configure_process) and the memory layout and
+compilation once per loaded pipeline (prepare_pipeline); the rest can change
+from one pipeline call to the next (profile_context).
+"""
+
+import logging
+import os
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Threads used inside one op ('physical' = one per physical core, None = torch's default)
+    'intra_op_threads': None,
+    # Threads running independent ops in parallel (None = torch's default)
+    'inter_op_threads': None,
+    'bf16_autocast': False,
+    'attention_slicing': False,
+    'vae_tiling': False,
+    'vae_slicing': False,
+    'channels_last': False,
+    'compile': False,
+}
+
+PROFILES = {
+    # float32 with torch's default threads: how local generation ran before profiles
+    'baseline': {},
+    # One thread per physical core (hyper-threads slow down GEMMs), lower peak memory, channels-last convolutions
+    'balanced': {
+        'intra_op_threads': 'physical', 'inter_op_threads': 1,
+        'attention_slicing': True, 'vae_tiling': True, 'vae_slicing': True, 'channels_last': True,
+    },
+    # balanced plus bfloat16 autocast, on CPUs with native bfloat16 (AVX512-BF16 or AMX)
+    'fast': {
+        'intra_op_threads': 'physical', 'inter_op_threads': 1,
+        'attention_slicing': True, 'vae_tiling': True, 'vae_slicing': True, 'channels_last': True,
+        'bf16_autocast': True,
+    },
+    # fast plus torch.compile of the transformer; the first generation after a load is much slower
+    'compiled': {
+        'intra_op_threads': 'physical', 'inter_op_threads': 1,
+        'attention_slicing': True, 'vae_tiling': True, 'vae_slicing': True, 'channels_last': True,
+        'bf16_autocast': True, 'compile': True,
+    },
+}
+
+# torch's own intra-op thread count, restored for profiles that don't set one
+DEFAULT_THREADS = torch.get_num_threads()
+
+
+def get_profile(name):
+    """A profile's full settings; raises ValueError for unknown names"""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown CPU profile: {name}. Available: {', '.join(PROFILES)}")
+    return {**DEFAULTS, **PROFILES[name], 'name': name}
+
+
+def physical_cores():
+    """Physical cores available to this process (logical CPUs if that can't be told)"""
+    logical = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        with open('/proc/cpuinfo') as f:
+            cores = set()
+            physical_id = None
+            for line in f:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'physical id':
+                    physical_id = value.strip()
+                elif key == 'core id':
+                    cores.add((physical_id, value.strip()))
+    except OSError:
+        return logical
+    # cpuinfo lists every core in the machine; a container may be limited to fewer CPUs
+    return max(1, min(len(cores) or logical, logical))
+
+
+def bf16_supported():
+    """Whether the CPU computes in bfloat16 natively rather than emulating it"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        pass
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def thread_count(value):
+    if value == 'physical':
+        return physical_cores()
+    return value
+
+
+def configure_process(profile):
+    """Size torch's thread pools; call once at startup, before any inference"""
+    inter_op = thread_count(profile['inter_op_threads'])
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # The inter-op pool can only be sized before it is first used
+            logger.warning("Inter-op threads already started; keeping torch's setting")
+    intra_op = thread_count(profile['intra_op_threads'])
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    logger.info(f"CPU profile {profile['name']}: {torch.get_num_threads()} intra-op, "
+                f"{torch.get_num_interop_threads()} inter-op threads, bfloat16 "
+                f"{'native' if bf16_supported() else 'not supported'}")
+
+
+def prepare_pipeline(pipeline, profile):
+    """Apply a profile's load-time settings (memory layout, compilation) to a pipeline"""
+    if profile['channels_last']:
+        for component in pipeline.components.values():
+            if not isinstance(component, torch.nn.Module):
+                continue
+            for module in component.modules():
+                if isinstance(module, torch.nn.Conv3d):
+                    module.to(memory_format=torch.channels_last_3d)
+                elif isinstance(module, torch.nn.Conv2d):
+                    module.to(memory_format=torch.channels_last)
+    if profile['compile']:
+        denoiser = 'transformer' if getattr(pipeline, 'transformer', None) is not None else 'unet'
+        if getattr(pipeline, denoiser, None) is not None:
+            setattr(pipeline, denoiser, torch.compile(getattr(pipeline, denoiser)))
+
+
+def _toggle(target, feature, enabled):
+    """Call target.enable_<feature>() or disable_<feature>() if the target supports it"""
+    method = getattr(target, f"{'enable' if enabled else 'disable'}_{feature}", None)
+    if method is not None:
+        method()
+
+
+@contextmanager
+def profile_context(pipeline, profile):
+    """Run pipeline calls in the block with a profile's per-call settings"""
+    torch.set_num_threads(thread_count(profile['intra_op_threads']) or DEFAULT_THREADS)
+    _toggle(pipeline, 'attention_slicing', profile['attention_slicing'])
+    vae = getattr(pipeline, 'vae', None)
+    if vae is not None:
+        _toggle(vae, 'tiling', profile['vae_tiling'])
+        _toggle(vae, 'slicing', profile['vae_slicing'])
+    if profile['bf16_autocast'] and bf16_supported():
+        autocast = torch.autocast(device_type='cpu', dtype=torch.bfloat16)
+    else:
+        autocast = nullcontext()
+    with autocast:
+        yield
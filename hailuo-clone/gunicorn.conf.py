@@ -0,0 +1,39 @@
+"""
+Gunicorn settings for running the enhanced backend with several worker processes
+
+    gunicorn -c gunicorn.conf.py backend_enhanced:app
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker backend_async:app
+
+The app is imported once in the master and forked, so workers share its memory
+pages copy-on-write. Circuit breakers, the result cache index, rate limits and
+the job table go to a shared SQLite file, which also holds the model slots that
+keep each model's max_concurrent_requests across all workers.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count()))
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+# Requests mostly wait on the Spaces, so each worker needs plenty of threads
+threads = int(os.getenv('WEB_THREADS', 32))
+timeout = int(os.getenv('WEB_TIMEOUT', 600))
+preload_app = True
+
+# Read by backend_enhanced at import time, which happens after this file is loaded
+os.environ['WEB_WORKERS'] = str(workers)
+os.environ.setdefault('SHARED_STATE_PATH', os.path.join('cache', 'state.db'))
+
+
+def pre_fork(server, worker):
+    # SQLite connections must not be inherited across fork; workers open their own
+    import backend_enhanced
+    if backend_enhanced.shared_state is not None:
+        backend_enhanced.shared_state.close()
+
+
+def post_fork(server, worker):
+    # Each worker persists its own jobs and helps resume those of workers that died
+    import backend_enhanced
+    backend_enhanced.start_job_workers()
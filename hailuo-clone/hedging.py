@@ -0,0 +1,115 @@
+"""
+Hedged and fallback execution across several models
+Starts the first attempt, launches the next one when the current attempts fail
+or make no progress within the hedge delay, returns whichever succeeds first
+and cancels the rest
+"""
+
+import queue
+import threading
+import time
+
+
+class CancelToken:
+    """Lets a caller cancel work that is running on another thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled = False
+
+    def on_cancel(self, callback):
+        """Run callback when the token is cancelled (immediately if it already is)"""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+
+def run_hedged(attempts, hedge_delay=None, cancel_token=None):
+    """Run attempts in order with hedging; return (result, winner_label, report)
+
+    attempts is a list of (label, func) where func(cancel_token) returns a result
+    or raises. With hedge_delay=None the next attempt only starts when all running
+    ones have failed (plain fallback). report maps each label to its outcome
+    ('won', 'failed', 'cancelled' or 'not_started') and the seconds it ran.
+    If every attempt fails, the first attempt's error is raised. Cancelling
+    cancel_token cancels the running attempts and starts no new ones.
+    """
+    results = queue.Queue()
+    pending = list(attempts)
+    running = {}
+    report = {label: {'outcome': 'not_started', 'seconds': None} for label, _ in attempts}
+    errors = []
+    lock = threading.Lock()
+
+    def cancelled():
+        return cancel_token is not None and cancel_token.cancelled
+
+    def cancel_all():
+        with lock:
+            tokens = [token for token, _ in running.values()]
+        for token in tokens:
+            token.cancel()
+
+    def launch():
+        label, func = pending.pop(0)
+        token = CancelToken()
+        started = time.monotonic()
+        with lock:
+            running[label] = (token, started)
+
+        def target():
+            try:
+                results.put((label, True, func(token)))
+            except Exception as e:
+                results.put((label, False, e))
+
+        threading.Thread(target=target, name=f"hedge-{label}", daemon=True).start()
+
+    if cancel_token is not None:
+        cancel_token.on_cancel(cancel_all)
+    launch()
+    while running:
+        if cancelled():
+            pending.clear()
+        wait = hedge_delay if pending and hedge_delay is not None else None
+        try:
+            label, ok, value = results.get(timeout=wait)
+        except queue.Empty:
+            # No attempt finished within the hedge delay; race the next one
+            if not cancelled():
+                launch()
+            continue
+
+        with lock:
+            token, started = running.pop(label)
+        report[label]['seconds'] = round(time.monotonic() - started, 3)
+        if ok:
+            report[label]['outcome'] = 'won'
+            for other_label, (other_token, other_started) in running.items():
+                other_token.cancel()
+                report[other_label]['outcome'] = 'cancelled'
+                report[other_label]['seconds'] = round(time.monotonic() - other_started, 3)
+            return value, label, report
+
+        report[label]['outcome'] = 'failed'
+        report[label]['error'] = str(value)
+        errors.append(value)
+        if pending and not cancelled():
+            launch()
+
+    raise errors[0]
@@ -0,0 +1,130 @@
+"""
+Preprocessing of image-to-video inputs
+Downscales (and optionally center-crops) uploads to the target model's declared
+resolution before they are sent to the Space, so multi-megapixel photos are not
+uploaded and decoded at full size. Crop mode also crops images that are small
+enough but have the wrong aspect ratio
+"""
+
+import math
+import os
+import time
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from image_upload import UploadError, prepare_image_file
+
+RESIZE_CROP = "crop"  # cover the target size, then center-crop to it
+RESIZE_FIT = "fit"    # fit inside the target size, keeping the aspect ratio
+RESIZE_NONE = "none"  # send the image at its original size
+
+RESIZE_MODES = (RESIZE_CROP, RESIZE_FIT, RESIZE_NONE)
+
+EXIF_ORIENTATION = 0x0112
+
+
+def plan_scale(width, height, target_width, target_height, mode):
+    """Scale factor that brings (width, height) to the target for the given mode"""
+    if mode == RESIZE_CROP:
+        return max(target_width / width, target_height / height)
+    if mode == RESIZE_FIT:
+        return min(target_width / width, target_height / height)
+    return 1.0
+
+
+def plan_crop(width, height, target_width, target_height):
+    """Largest centered (width, height) with the target's aspect ratio, or None if the image already has it"""
+    if width * target_height > height * target_width:
+        crop = (max(1, round(height * target_width / target_height)), height)
+    else:
+        crop = (width, max(1, round(width * target_height / target_width)))
+    # A pixel of rounding isn't worth re-encoding the image for
+    if abs(crop[0] - width) <= 1 and abs(crop[1] - height) <= 1:
+        return None
+    return crop
+
+
+def preprocess_image(path, resolution, mode=RESIZE_CROP, quality=90):
+    """Resize a saved upload for a model with the given (width, height); return (path, info)
+
+    Images already at or below the target size are handed to prepare_image_file
+    unchanged. Larger ones are decoded once at reduced scale where the format allows
+    (JPEG draft mode), resized, and saved as JPEG (or PNG if they have transparency).
+    """
+    started = time.monotonic()
+    original_bytes = os.path.getsize(path)
+    target_width, target_height = resolution
+
+    try:
+        with Image.open(path) as image:
+            original_size = image.size
+            # EXIF rotations by 90/270 degrees swap width and height once applied
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+            if orientation in (5, 6, 7, 8):
+                width, height = original_size[1], original_size[0]
+            else:
+                width, height = original_size
+
+            scale = plan_scale(width, height, target_width, target_height, mode)
+            # Crop mode matches the target's aspect ratio even when the image needs no downscaling
+            crop = plan_crop(width, height, target_width, target_height) if mode == RESIZE_CROP else None
+            if scale >= 1.0 and crop is None:
+                output = None
+            else:
+                scale = min(scale, 1.0)
+                if scale < 1.0:
+                    # Let the JPEG decoder skip detail we are about to throw away
+                    image.draft('RGB', (math.ceil(original_size[0] * scale), math.ceil(original_size[1] * scale)))
+                output = ImageOps.exif_transpose(image)
+                resized = (max(1, round(width * scale)), max(1, round(height * scale)))
+                if scale < 1.0:
+                    output = output.resize(resized, Image.LANCZOS, reducing_gap=3.0)
+                if mode == RESIZE_CROP:
+                    crop_width, crop_height = crop or (width, height)
+                    crop_width = min(target_width, resized[0], max(1, round(crop_width * scale)))
+                    crop_height = min(target_height, resized[1], max(1, round(crop_height * scale)))
+                    left = (resized[0] - crop_width) // 2
+                    top = (resized[1] - crop_height) // 2
+                    output = output.crop((left, top, left + crop_width, top + crop_height))
+    except (UnidentifiedImageError, OSError):
+        os.unlink(path)
+        raise UploadError('Invalid image data')
+
+    if output is None:
+        final_path, info = prepare_image_file(path)
+        info.update({
+            'resized': False,
+            'cropped': False,
+            'mode': mode,
+            'original_size': list(original_size),
+            'original_bytes': original_bytes,
+            'seconds': round(time.monotonic() - started, 4),
+        })
+        return final_path, info
+
+    has_alpha = output.mode in ('RGBA', 'LA') or (output.mode == 'P' and 'transparency' in output.info)
+    base_path = os.path.splitext(path)[0]
+    if has_alpha:
+        final_path = base_path + '.png'
+        output.save(final_path, format='PNG')
+        output_format = 'PNG'
+    else:
+        final_path = base_path + '.jpg'
+        output.convert('RGB').save(final_path, format='JPEG', quality=quality)
+        output_format = 'JPEG'
+    if final_path != path:
+        os.unlink(path)
+
+    return final_path, {
+        'format': output_format,
+        'width': output.size[0],
+        'height': output.size[1],
+        'bytes': os.path.getsize(final_path),
+        're_encoded': True,
+        'resized': scale < 1.0,
+        'cropped': crop is not None,
+        'mode': mode,
+        'original_size': list(original_size),
+        'original_bytes': original_bytes,
+        'seconds': round(time.monotonic() - started, 4),
+    }
@@ -0,0 +1,127 @@
+"""
+Helpers for receiving image uploads for image-to-video generation
+Uploads are streamed to a temp file in chunks and forwarded as-is when the
+format is one the Spaces accept; only other formats are re-encoded to PNG
+"""
+
+import base64
+import binascii
+import logging
+import os
+import shutil
+import tempfile
+
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Formats forwarded to the Spaces without re-encoding, with the suffix to use
+PASSTHROUGH_FORMATS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Raised for an upload that is missing, too large or not an image"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def save_stream(stream, max_bytes):
+    """Copy a file-like stream to a temp file in chunks; return (path, size)"""
+    fd, path = tempfile.mkstemp(suffix='.upload')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(f'Image must not exceed {max_bytes // (1024 * 1024)} MB', 413)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    if size == 0:
+        os.unlink(path)
+        raise UploadError('Image upload is empty')
+    return path, size
+
+
+def adopt_file(path, max_bytes):
+    """Take over an upload already saved at path (e.g. by the form parser); return (path, size)"""
+    size = os.path.getsize(path)
+    if size > max_bytes:
+        os.unlink(path)
+        raise UploadError(f'Image must not exceed {max_bytes // (1024 * 1024)} MB', 413)
+    if size == 0:
+        os.unlink(path)
+        raise UploadError('Image upload is empty')
+    return path, size
+
+
+def save_base64(base64_string, max_bytes):
+    """Decode a (data URL or plain) base64 image string to a temp file; return (path, size)"""
+    if not base64_string or not isinstance(base64_string, str):
+        raise UploadError('Invalid image data')
+    # Remove data URL prefix if present
+    if ',' in base64_string:
+        base64_string = base64_string.split(',', 1)[1]
+    try:
+        image_data = base64.b64decode(base64_string)
+    except (binascii.Error, ValueError) as e:
+        logger.error(f"Failed to decode image: {str(e)}")
+        raise UploadError('Invalid image data')
+    if len(image_data) > max_bytes:
+        raise UploadError(f'Image must not exceed {max_bytes // (1024 * 1024)} MB', 413)
+    fd, path = tempfile.mkstemp(suffix='.upload')
+    with os.fdopen(fd, 'wb') as out:
+        out.write(image_data)
+    return path, len(image_data)
+
+
+def prepare_image_file(path):
+    """Turn a saved upload into a file the Space can read; return (path, info)
+
+    The original bytes are kept when the format is in PASSTHROUGH_FORMATS (the file is
+    only renamed to get the right suffix); anything else is decoded and saved as PNG.
+    """
+    try:
+        with Image.open(path) as image:
+            # Image.open only parses the header; the pixel data is not decoded here
+            image_format = image.format
+            width, height = image.size
+            if image_format in PASSTHROUGH_FORMATS:
+                re_encoded = False
+            else:
+                png_path = os.path.splitext(path)[0] + '.png'
+                image.save(png_path, format='PNG')
+                re_encoded = True
+    except (UnidentifiedImageError, OSError) as e:
+        logger.error(f"Failed to decode image: {str(e)}")
+        os.unlink(path)
+        raise UploadError('Invalid image data')
+
+    if re_encoded:
+        os.unlink(path)
+        final_path = png_path
+    else:
+        final_path = os.path.splitext(path)[0] + PASSTHROUGH_FORMATS[image_format]
+        shutil.move(path, final_path)
+
+    return final_path, {
+        'format': image_format,
+        'width': width,
+        'height': height,
+        'bytes': os.path.getsize(final_path),
+        're_encoded': re_encoded,
+    }
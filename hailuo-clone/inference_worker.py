@@ -0,0 +1,122 @@
+"""
+Serialized inference with dynamic batching for the local pipeline
+One worker thread owns the pipeline and takes requests from a queue. Requests
+that arrive within a short window of each other and use the same generation
+settings are run as a single batched pipeline call, and each caller gets back
+only its own output.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the queue is at its limit"""
+
+
+class _Request:
+    __slots__ = ('prompt', 'key', 'future', 'enqueued')
+
+    def __init__(self, prompt, key):
+        self.prompt = prompt
+        # Requests can share a batch only if these settings match
+        self.key = key
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class InferenceWorker:
+    """Runs run_batch(prompts, **settings) -> one output per prompt, on a single thread"""
+
+    def __init__(self, run_batch, max_batch_size=4, batch_window=0.05, max_queue=32, name='inference-worker'):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        # Seconds the oldest queued request waits for others to batch with
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        self.name = name
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._thread = None
+        self.busy = False
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.queue_wait_total = 0.0
+
+    def submit(self, prompt, **settings):
+        """Queue one generation; returns a Future for its output"""
+        request = _Request(prompt, tuple(sorted(settings.items())))
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                raise QueueFull(f"Inference queue is full ({self.max_queue} waiting)")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+            self._pending.append(request)
+            self._cond.notify()
+        return request.future
+
+    def _next_batch(self):
+        """Block until a batch is due: full, or the oldest request's window has passed"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            first = self._pending[0]
+            deadline = first.enqueued + self.batch_window
+            while True:
+                batch = [r for r in self._pending if r.key == first.key][:self.max_batch_size]
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            for request in batch:
+                self._pending.remove(request)
+            self.busy = True
+        return [r for r in batch if r.future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                if batch:
+                    self._run(batch)
+            finally:
+                with self._cond:
+                    self.busy = False
+
+    def _run(self, batch):
+        started = time.monotonic()
+        with self._cond:
+            self.requests += len(batch)
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.queue_wait_total += sum(started - r.enqueued for r in batch)
+        try:
+            outputs = self.run_batch([r.prompt for r in batch], **dict(batch[0].key))
+            if len(outputs) != len(batch):
+                raise RuntimeError(f"Pipeline returned {len(outputs)} outputs for {len(batch)} prompts")
+        except BaseException as e:
+            for request in batch:
+                request.future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for request, output in zip(batch, outputs):
+            request.future.set_result(output)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._pending),
+                'busy': self.busy,
+                'requests': self.requests,
+                'batches': self.batches,
+                'average_batch_size': round(self.requests / self.batches, 2) if self.batches else None,
+                'largest_batch': self.largest_batch,
+                'average_queue_wait_seconds': round(self.queue_wait_total / self.requests, 3) if self.requests else None,
+                'max_batch_size': self.max_batch_size,
+                'batch_window_seconds': self.batch_window,
+            }
@@ -0,0 +1,332 @@
+"""
+Background job queue for long-running video generations
+Lets the Flask server hand back a job ID immediately while a bounded
+pool of worker threads waits on the Hugging Face Spaces
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already waiting for a worker"""
+
+
+class Job:
+    """A single generation job and its current state"""
+
+    def __init__(self, kind, request_summary=None, args=(), kwargs=None, priority_rank=0):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.request = request_summary or {}
+        # What to call the job's function with, so a persisted job can be run again after a restart
+        self.args = list(args)
+        self.kwargs = kwargs or {}
+        self.state = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Where the work was sent upstream, recorded by the job's function via JobQueue.annotate()
+        self.upstream = None
+        # Number of times a worker has started the job (more than 1 after a restart)
+        self.attempts = 0
+        # Queued jobs with a lower rank are started first
+        self.priority_rank = priority_rank
+        # Bumped on every state change so waiters can detect updates
+        self.version = 0
+
+    COLUMNS = ('id', 'kind', 'request', 'state', 'result', 'error', 'status_code',
+               'created_at', 'started_at', 'finished_at', 'version',
+               'args', 'kwargs', 'upstream', 'attempts', 'priority_rank')
+    JSON_COLUMNS = ('request', 'result', 'args', 'kwargs', 'upstream')
+
+    def to_row(self):
+        """Column values for the jobs table"""
+        return tuple(json.dumps(getattr(self, name)) if name in self.JSON_COLUMNS else getattr(self, name)
+                     for name in self.COLUMNS)
+
+    @classmethod
+    def from_row(cls, row):
+        job = cls.__new__(cls)
+        for name, value in zip(cls.COLUMNS, row):
+            setattr(job, name, json.loads(value) if name in cls.JSON_COLUMNS and value is not None else value)
+        return job
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def to_dict(self):
+        """Serialize the job for the /jobs endpoints"""
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.state,
+            'request': self.request,
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat(),
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            'finished_at': datetime.fromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+            'attempts': self.attempts,
+        }
+        if self.state == JOB_DONE:
+            data['result'] = self.result
+            data['video_url'] = (self.result or {}).get('video_url')
+        elif self.state == JOB_FAILED:
+            data['error'] = self.error
+            data['status_code'] = self.status_code
+        return data
+
+
+class JobQueue:
+    """Runs generation callables on a bounded thread pool and tracks their state
+
+    With a JobStore, every state change is also persisted (without blocking the
+    caller), finished jobs stay queryable after a restart, and start() re-queues
+    jobs that a stopped process left unfinished. Their arguments must then be
+    JSON-serializable, and their kind must be in the runners passed to start().
+    """
+
+    def __init__(self, max_workers=4, max_pending=500, retention_seconds=3600, error_handler=None,
+                 store=None, max_attempts=3, poll_interval=0.5):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        # Maps an exception to (message, status_code) for failed jobs
+        self.error_handler = error_handler or (lambda e: (str(e), 500))
+        self.store = store
+        # Jobs interrupted this many times are failed instead of being run again
+        self.max_attempts = max_attempts
+        # How often to re-read a stored job that this process isn't running
+        self.poll_interval = poll_interval
+        self.runners = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        # Jobs waiting for a worker: heap of ((priority_rank, seq), job, func, args, kwargs)
+        self._ready = []
+        self._ready_seq = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # job_id -> callbacks run after each change to that job (see watch())
+        self._watchers = {}
+        self._local = threading.local()
+
+    def start(self, runners=None):
+        """Start persistence in this process and resume orphaned jobs of the given kinds
+
+        runners maps a job kind to the function that runs it.
+        """
+        self.runners.update(runners or {})
+        if self.store is not None:
+            self.store.start(on_orphans=self._resume)
+
+    def submit(self, kind, func, *args, request_summary=None, priority_rank=0, **kwargs):
+        """Queue func(*args, **kwargs) and return the Job tracking it
+
+        Workers take queued jobs lowest priority_rank first, oldest first within a rank.
+        """
+        with self._lock:
+            self._prune_locked()
+            pending = self._pending_count_locked()
+            if pending >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({pending} jobs waiting)")
+            job = Job(kind, request_summary, args, kwargs, priority_rank)
+            self._jobs[job.id] = job
+        self._save(job)
+        self._dispatch(job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Return the job with the given ID, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            # Finished before a restart, or owned by another process
+            job = self.store.load(job_id)
+        return job
+
+    def peek(self, job_id):
+        """Return the job if this process is tracking it, without reading the store"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def watch(self, job_id, callback):
+        """Call callback() after every change to a job this process runs; returns a function that stops it
+
+        The callback runs on the thread that changed the job, so it must not block.
+        """
+        with self._lock:
+            self._watchers.setdefault(job_id, []).append(callback)
+
+        def unwatch():
+            with self._lock:
+                callbacks = self._watchers.get(job_id, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks:
+                    self._watchers.pop(job_id, None)
+        return unwatch
+
+    def annotate(self, **fields):
+        """Record extra fields (e.g. upstream=...) on the job running in this thread, if any"""
+        job = getattr(self._local, 'job', None)
+        if job is None:
+            return
+        with self._lock:
+            for name, value in fields.items():
+                setattr(job, name, value)
+        self._save(job)
+
+    def position(self, job_id):
+        """Number of queued jobs in this process that will start before job_id, or None if it isn't waiting here"""
+        with self._lock:
+            keys = {entry[1].id: entry[0] for entry in self._ready}
+            key = keys.get(job_id)
+            if key is None:
+                return None
+            return sum(1 for other in keys.values() if other < key)
+
+    def _dispatch(self, job, func, args, kwargs):
+        with self._lock:
+            heapq.heappush(self._ready, ((job.priority_rank, next(self._ready_seq)), job, func, args, kwargs))
+        # Each submission wakes one worker, which takes whichever queued job ranks first
+        self._executor.submit(self._run_next)
+
+    def _run_next(self):
+        with self._lock:
+            _, job, func, args, kwargs = heapq.heappop(self._ready)
+        self._run(job, func, args, kwargs)
+
+    def _pending_count_locked(self):
+        return sum(1 for job in self._jobs.values() if job.state == JOB_QUEUED)
+
+    def _save(self, job):
+        if self.store is not None:
+            with self._lock:
+                row = job.to_row()
+            self.store.save(job, row)
+
+    def _resume(self, jobs):
+        """Run jobs claimed from a stopped process again, or fail those that keep getting interrupted"""
+        for job in jobs:
+            func = self.runners.get(job.kind)
+            if func is None or job.attempts >= self.max_attempts:
+                logger.warning(f"Not resuming job {job.id} ({job.kind}) after {job.attempts} attempt(s)")
+                job.state = JOB_FAILED
+                job.error = 'The job was interrupted by a server restart. Please try again.'
+                job.status_code = 503
+                job.finished_at = time.time()
+            else:
+                logger.info(f"Resuming job {job.id} ({job.kind}) interrupted after {job.attempts} attempt(s)")
+                job.state = JOB_QUEUED
+                job.started_at = None
+            job.version += 1
+            with self._lock:
+                self._jobs[job.id] = job
+            self._save(job)
+            if not job.finished:
+                self._dispatch(job, func, job.args, job.kwargs)
+
+    def wait_for_change(self, job_id, seen_version, timeout=None):
+        """Block until the job's version moves past seen_version or timeout expires"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._changed.wait_for(lambda: job.version != seen_version, timeout=timeout)
+                return job
+        if self.store is None:
+            return None
+        # Not running here (finished before a restart, or in another worker): poll the store
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.store.load(job_id)
+            if job is None or job.version != seen_version:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(self.poll_interval if deadline is None
+                       else min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def counts(self):
+        """Number of jobs in each state"""
+        with self._lock:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            return counts
+
+    def _run(self, job, func, args, kwargs):
+        self._update(job, state=JOB_RUNNING, started_at=time.time(), attempts=job.attempts + 1)
+        self._local.job = job
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            message, status_code = self.error_handler(e)
+            self._update(job, state=JOB_FAILED, error=message, status_code=status_code,
+                         finished_at=time.time())
+        else:
+            self._update(job, state=JOB_DONE, result=result, status_code=200,
+                         finished_at=time.time())
+        finally:
+            self._local.job = None
+
+    def _update(self, job, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.version += 1
+            self._changed.notify_all()
+            callbacks = list(self._watchers.get(job.id, ()))
+        for callback in callbacks:
+            callback()
+        self._save(job)
+
+    def _prune_locked(self):
+        """Drop finished jobs older than the retention window"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class SharedJobQueue(JobQueue):
+    """JobQueue whose JobStore lives in a SharedState database used by every worker process
+
+    Jobs still run in the worker process that accepted them, but any worker can
+    report their status, and the pending limit counts jobs across all workers.
+    """
+
+    def __init__(self, store, **kwargs):
+        super().__init__(store=store, **kwargs)
+
+    def counts(self):
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        counts.update(self.store.counts())
+        return counts
+
+    def submit(self, kind, func, *args, **kwargs):
+        # Checked before taking the queue lock, since it reads the database;
+        # JobQueue.submit() then applies the local count under the lock
+        pending = self.store.pending_count()
+        if pending >= self.max_pending:
+            raise QueueFullError(f"Job queue is full ({pending} jobs waiting)")
+        return super().submit(kind, func, *args, **kwargs)
@@ -0,0 +1,190 @@
+"""
+Durable job table for the background job queue
+Job rows are handed to a writer thread and committed in batches, so saving a
+job never waits on disk. Each process leases the unfinished jobs it owns and
+renews the lease while it is alive; unfinished jobs whose lease ran out were
+left behind by a process that died or restarted, and are claimed by a live one.
+"""
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from job_queue import JOB_QUEUED, JOB_RUNNING, Job
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATES = (JOB_QUEUED, JOB_RUNNING)
+STATE_INDEX = Job.COLUMNS.index('state')
+
+
+class JobStore:
+    """Jobs table in a SharedState database, written by a background thread"""
+
+    def __init__(self, shared, retention_seconds=3600, lease_seconds=15):
+        self.shared = shared
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # Batches are written one at a time so an older row never lands after a newer one
+        self._flush_lock = threading.Lock()
+        # job id -> latest row not yet committed
+        self._pending = {}
+        self._on_orphans = None
+        self._pid = None
+        self.owner = None
+        self.batches = 0
+        self.rows_written = 0
+        self.write_errors = 0
+
+    def start(self, on_orphans=None):
+        """Start this process's writer thread; on_orphans(jobs) receives jobs claimed from dead processes"""
+        with self._lock:
+            if on_orphans is not None:
+                self._on_orphans = on_orphans
+            self._start_locked()
+
+    def _start_locked(self):
+        # Threads don't survive fork, so a forked worker starts its own writer and takes a new identity
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._pending = {}
+        threading.Thread(target=self._run, name="job-store-writer", daemon=True).start()
+        atexit.register(self.close)
+
+    def save(self, job, row):
+        """Queue a job row (from Job.to_row) for the next batch; never blocks on the database"""
+        with self._lock:
+            self._start_locked()
+            self._pending[job.id] = row
+            self._wake.notify()
+
+    def load(self, job_id):
+        with self._lock:
+            row = self._pending.get(job_id)
+        if row is None:
+            row = self.shared.execute(
+                f"SELECT {', '.join(Job.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return Job.from_row(row) if row else None
+
+    def counts(self):
+        counts = {}
+        for state, count in self.shared.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+            counts[state] = count
+        return counts
+
+    def pending_count(self):
+        """Queued jobs in every process, including this process's rows that aren't written yet"""
+        with self._lock:
+            unwritten = {job_id: row[STATE_INDEX] == JOB_QUEUED for job_id, row in self._pending.items()}
+        stored = self.shared.execute("SELECT id FROM jobs WHERE state = ?", (JOB_QUEUED,)).fetchall()
+        # An unwritten row is newer than the stored one, so it decides that job's state
+        return sum(unwritten.values()) + sum(1 for (job_id,) in stored if job_id not in unwritten)
+
+    def flush(self):
+        """Commit every queued row in one transaction"""
+        with self._flush_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        lease_until = time.time() + self.lease_seconds
+        rows = [row + (self.owner, lease_until if row[STATE_INDEX] in UNFINISHED_STATES else None)
+                for row in batch.values()]
+        columns = Job.COLUMNS + ('owner', 'lease_until')
+        try:
+            with self.shared.transaction() as db:
+                db.executemany(
+                    f"INSERT OR REPLACE INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    rows
+                )
+        except sqlite3.Error:
+            # Keep the rows for the next attempt unless a newer version was queued meanwhile
+            with self._lock:
+                for job_id, row in batch.items():
+                    self._pending.setdefault(job_id, row)
+            raise
+        self.batches += 1
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Write out queued rows, e.g. at interpreter exit"""
+        if self._pid != os.getpid():
+            return
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logger.error(f"Could not write {len(self._pending)} job update(s) at shutdown: {str(e)}")
+
+    def claim_orphans(self):
+        """Take over unfinished jobs whose owner stopped renewing their lease"""
+        now = time.time()
+        with self.shared.transaction() as db:
+            rows = db.execute(
+                f"SELECT {', '.join(Job.COLUMNS)} FROM jobs WHERE state IN (?, ?) "
+                f"AND (lease_until IS NULL OR lease_until < ?) AND (owner IS NULL OR owner != ?)",
+                UNFINISHED_STATES + (now, self.owner)
+            ).fetchall()
+            db.executemany(
+                "UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ?",
+                [(self.owner, now + self.lease_seconds, row[0]) for row in rows]
+            )
+        return [Job.from_row(row) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            queued = len(self._pending)
+        return {
+            'owner': self.owner,
+            'unwritten': queued,
+            'batches': self.batches,
+            'rows_written': self.rows_written,
+            'write_errors': self.write_errors,
+        }
+
+    def _maintain(self):
+        """Renew this process's leases, drop expired finished jobs and hand over orphans"""
+        now = time.time()
+        with self.shared.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND state IN (?, ?)",
+                (now + self.lease_seconds, self.owner) + UNFINISHED_STATES
+            )
+            db.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (now - self.retention_seconds,)
+            )
+        if self._on_orphans is not None:
+            orphans = self.claim_orphans()
+            if orphans:
+                logger.info(f"Claimed {len(orphans)} unfinished job(s) from stopped processes")
+                self._on_orphans(orphans)
+
+    def _run(self):
+        pid = os.getpid()
+        next_maintenance = time.monotonic()
+        while self._pid == pid:
+            with self._wake:
+                self._wake.wait_for(lambda: self._pending,
+                                    timeout=max(0.0, next_maintenance - time.monotonic()))
+            try:
+                # Rows queued while the previous batch was being written go out together
+                self.flush()
+                if time.monotonic() >= next_maintenance:
+                    next_maintenance = time.monotonic() + self.lease_seconds / 3
+                    self._maintain()
+            except Exception as e:
+                self.write_errors += 1
+                logger.error(f"Job store write failed: {str(e)}", exc_info=True)
+                time.sleep(1)
@@ -0,0 +1,151 @@
+"""
+Minimal Prometheus-style metrics
+Counters and histograms are plain dicts updated under a lock, so recording a
+value on the request path costs a dictionary lookup; gauges are computed from
+callbacks only when /metrics is scraped
+"""
+
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """Bucketed distribution of observed values per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[labels] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {labels: ([*counts], total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labelnames, labels, ('le', _format_value(float(bound)))),
+                       cumulative)
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), total
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), count
+
+
+class CallbackGauge:
+    """Gauge whose values are read from a callback at scrape time
+
+    The callback returns a dict mapping label tuples to values.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        for labels, value in sorted(self.callback().items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class CallbackCounter(CallbackGauge):
+    """Counter whose values are read from a callback at scrape time"""
+
+    kind = 'counter'
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames, callback):
+        return self.register(CallbackGauge(name, documentation, labelnames, callback))
+
+    def counter_callback(self, name, documentation, labelnames, callback):
+        return self.register(CallbackCounter(name, documentation, labelnames, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,248 @@
+"""
+Model catalog loaded from a JSON config file
+Each load builds an immutable snapshot indexed by model id, type and feature,
+with the Hailuo-style tags keyed by name and the /models response body and its
+ETag computed once. The file is re-checked every few seconds; a changed file
+that validates replaces the snapshot in a single assignment, so a request sees
+either the old catalog or the new one, never a mix of both.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODEL_TYPES = ('text-to-video', 'image-to-video')
+REQUIRED_MODEL_FIELDS = ('name', 'space_url', 'description', 'type', 'api_name')
+TAG_KINDS = ('camera_movements', 'visual_effects', 'video_styles')
+
+
+class CatalogError(ValueError):
+    """Raised when a catalog file is missing fields or has invalid values"""
+
+
+class UnknownModelError(ValueError):
+    """Raised when a model id is not in the current catalog"""
+
+
+def _model_entry(model_id, info):
+    if not isinstance(info, dict):
+        raise CatalogError(f'Model {model_id} must be an object')
+    missing = [field for field in REQUIRED_MODEL_FIELDS if not info.get(field)]
+    if missing:
+        raise CatalogError(f"Model {model_id} is missing: {', '.join(missing)}")
+    if info['type'] not in MODEL_TYPES:
+        raise CatalogError(f"Model {model_id} has unknown type {info['type']!r}")
+    entry = dict(info)
+    entry['features'] = list(info.get('features', []))
+    entry['params'] = dict(info.get('params', {}))
+    if 'resolution' in info:
+        resolution = info['resolution']
+        if len(resolution) != 2 or not all(isinstance(side, int) and side > 0 for side in resolution):
+            raise CatalogError(f'Model {model_id} resolution must be [width, height]')
+        entry['resolution'] = tuple(resolution)
+    limit = info.get('max_concurrent_requests')
+    if limit is not None and (not isinstance(limit, int) or limit < 1):
+        raise CatalogError(f'Model {model_id} max_concurrent_requests must be a positive integer')
+    timeout = info.get('timeout_seconds')
+    if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise CatalogError(f'Model {model_id} timeout_seconds must be a positive number')
+    # How backend_local.py runs the model with diffusers, if it can
+    local = info.get('local')
+    if local is not None:
+        if not isinstance(local, dict) or not local.get('repo_id') or not local.get('pipeline'):
+            raise CatalogError(f'Model {model_id} local must have a repo_id and a pipeline class')
+        memory = local.get('memory_gb')
+        if memory is not None and (not isinstance(memory, (int, float)) or memory <= 0):
+            raise CatalogError(f'Model {model_id} local memory_gb must be a positive number')
+        entry['local'] = dict(local)
+    return entry
+
+
+def _tag_entries(kind, entries):
+    seen = set()
+    for entry in entries:
+        # An empty tag is allowed; it is the "none" choice (e.g. a static camera)
+        if not isinstance(entry, dict) or not entry.get('name') or not isinstance(entry.get('tag'), str):
+            raise CatalogError(f'Every entry in {kind} needs a name and a tag')
+        name = entry['name'].lower()
+        if name in seen:
+            raise CatalogError(f"Duplicate name {entry['name']!r} in {kind}")
+        seen.add(name)
+    return [dict(entry) for entry in entries]
+
+
+class Catalog:
+    """One validated version of the catalog file, indexed for lookups
+
+    Treat snapshots as read-only: they are shared by every request that
+    started while they were current.
+    """
+
+    def __init__(self, config):
+        models = config.get('models')
+        if not isinstance(models, dict) or not models:
+            raise CatalogError('Catalog has no models')
+        self.models = {model_id: _model_entry(model_id, info) for model_id, info in models.items()}
+        self._by_type = {}
+        self._by_feature = {}
+        for model_id, info in self.models.items():
+            self._by_type.setdefault(info['type'], []).append(model_id)
+            for feature in info['features']:
+                self._by_feature.setdefault(feature, []).append(model_id)
+
+        self.tags = {kind: _tag_entries(kind, config.get(kind, [])) for kind in TAG_KINDS}
+        # Request values may be a tag's name or, as the bundled frontend sends, its tag text
+        self._tag_lookup = {}
+        for kind, entries in self.tags.items():
+            lookup = {entry['tag'].lower(): entry['tag'] for entry in entries}
+            lookup.update((entry['name'].lower(), entry['tag']) for entry in entries)
+            self._tag_lookup[kind] = lookup
+        self.example_prompts = config.get('example_prompts', {})
+
+        self.summaries = {
+            model_id: {'name': info['name'], 'description': info['description'], 'type': info['type']}
+            for model_id, info in self.models.items()
+        }
+        payload = {'models': self.summaries, **self.tags, 'example_prompts': self.example_prompts}
+        self.body = json.dumps(payload).encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.loaded_at = time.time()
+
+    def __contains__(self, model_id):
+        return model_id in self.models
+
+    def __getitem__(self, model_id):
+        info = self.models.get(model_id)
+        if info is None:
+            raise UnknownModelError(f'Unknown model: {model_id}')
+        return info
+
+    def get(self, model_id):
+        return self.models.get(model_id)
+
+    def ids(self, type=None, feature=None):
+        """Model ids in catalog order, optionally only those of a type and/or with a feature"""
+        if type is None and feature is None:
+            return list(self.models)
+        candidates = self._by_type.get(type, []) if type is not None else list(self.models)
+        if feature is not None:
+            with_feature = set(self._by_feature.get(feature, ()))
+            candidates = [model_id for model_id in candidates if model_id in with_feature]
+        return list(candidates)
+
+    def resolve_tag(self, kind, value):
+        """Tag text for a camera movement, effect or style given by name; other text is kept as is"""
+        if not value:
+            return ''
+        return self._tag_lookup[kind].get(value.strip().lower(), value)
+
+
+def changed_models(old, new, fields):
+    """Ids of models in old that were removed from new or had any of fields changed"""
+    changed = []
+    for model_id, info in old.models.items():
+        current = new.get(model_id)
+        if current is None or any(current.get(field) != info.get(field) for field in fields):
+            changed.append(model_id)
+    return changed
+
+
+class ModelCatalog:
+    """The current Catalog for a config file, swapped atomically when the file changes"""
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        # Seconds between checks of the file's mtime; 0 or None turns hot reload off
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._listeners = []
+        self._signature = self._stat()
+        self._current = self._load()
+        self._next_check = time.monotonic() + (check_interval or 0)
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error = None
+        logger.info(f"Loaded {len(self._current.models)} models from {path}")
+
+    @property
+    def current(self):
+        """The latest valid snapshot; checks the file first if the interval has passed"""
+        if self.check_interval and time.monotonic() >= self._next_check:
+            self.check()
+        return self._current
+
+    def add_listener(self, listener):
+        """Call listener(old, new) after each successful reload"""
+        self._listeners.append(listener)
+
+    def check(self):
+        """Reload if the file changed since it was last read; returns True if the snapshot changed"""
+        # Another thread is already checking; keep serving the current snapshot
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = time.monotonic() + (self.check_interval or 0)
+            signature = self._stat()
+            if signature == self._signature:
+                return False
+            # Remember the signature even if the load fails, so a broken file is reported once
+            self._signature = signature
+            return self._reload_locked()
+        finally:
+            self._reload_lock.release()
+
+    def reload(self):
+        """Re-read the file now; on error the previous snapshot stays current"""
+        with self._reload_lock:
+            self._signature = self._stat()
+            return self._reload_locked()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'models': len(self._current.models),
+            'etag': self._current.etag,
+            'loaded_at': self._current.loaded_at,
+            'reloads': self.reloads,
+            'reload_errors': self.reload_errors,
+            'last_error': self.last_error,
+        }
+
+    def _reload_locked(self):
+        try:
+            snapshot = self._load()
+        except (OSError, ValueError) as e:
+            self.reload_errors += 1
+            self.last_error = str(e)
+            logger.error(f"Keeping the current model catalog; {self.path} is invalid: {str(e)}")
+            return False
+        old, self._current = self._current, snapshot
+        self.reloads += 1
+        self.last_error = None
+        logger.info(f"Reloaded model catalog from {self.path} ({len(snapshot.models)} models)")
+        for listener in self._listeners:
+            try:
+                listener(old, snapshot)
+            except Exception as e:
+                logger.error(f"Model catalog reload listener failed: {str(e)}", exc_info=True)
+        return True
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise CatalogError('Catalog file must contain a JSON object')
+        return Catalog(config)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        # The inode changes when the file is replaced by a rename, even within one mtime tick
+        return st.st_mtime_ns, st.st_size, st.st_ino
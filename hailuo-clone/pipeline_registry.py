@@ -0,0 +1,283 @@
+"""
+Memory-budgeted registry of loaded local pipelines
+Pipelines are loaded on demand and stay resident while they fit in each
+memory tier's budget (GPU memory, then CPU RAM). When a pipeline needs room,
+the least recently used ones are moved down a tier (offloaded from the GPU to
+CPU RAM) or, from the last tier, unloaded. A pipeline that is in use is never
+moved or unloaded.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+
+class _Entry:
+    """A loaded pipeline and where it lives"""
+
+    __slots__ = ('model_id', 'pipeline', 'tier', 'size', 'in_use', 'moving', 'stale')
+
+    def __init__(self, model_id, pipeline, tier, size):
+        self.model_id = model_id
+        self.pipeline = pipeline
+        self.tier = tier
+        self.size = size
+        self.in_use = 0
+        # Set while the pipeline is being moved off its tier, so no request picks it up meanwhile
+        self.moving = False
+        # Set by discard(); the next load or promotion drops it once nothing uses it
+        self.stale = False
+
+
+class PipelineRegistry:
+    """Loads pipelines on demand and keeps the most recently used ones resident
+
+    load(model_id) -> (pipeline, phases) loads a pipeline into CPU memory, with
+    phases a dict of load timings. tiers lists (name, budget in bytes) from the
+    tier pipelines run on to the one they are offloaded to. move(pipeline, tier)
+    puts a pipeline on a tier's device, size_of(pipeline) measures it in bytes,
+    estimate(model_id) guesses the size of a pipeline that isn't loaded yet (or
+    None), and unload() frees memory after a pipeline is dropped.
+    """
+
+    def __init__(self, load, tiers, move, size_of, estimate=None, unload=None):
+        self.load = load
+        self.budgets = OrderedDict(tiers)
+        self.tiers = list(self.budgets)
+        self.move = move
+        self.size_of = size_of
+        self.estimate = estimate or (lambda model_id: None)
+        self.unload = unload or (lambda: None)
+        # Guards the bookkeeping only; loads, moves and unloads run outside it so stats never wait on them
+        self._lock = threading.Lock()
+        # One load, promotion or eviction at a time, so two requests never load the same model twice
+        self._load_lock = threading.Lock()
+        # model_id -> entry, least recently used first
+        self._entries = OrderedDict()
+        # Models discarded while they were loading, so the load's result starts out stale
+        self._discarded = set()
+        self._metrics = {}
+
+    @contextmanager
+    def use(self, model_id):
+        """Load model_id if needed and hold it on the first tier while the block runs"""
+        entry = self._acquire(model_id)
+        try:
+            yield entry.pipeline
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                self._metric(model_id)['last_used'] = datetime.now().isoformat()
+                # A stale pipeline already replaced in the registry is freed by its last user
+                released = entry.stale and not entry.in_use and self._entries.get(model_id) is not entry
+            if released:
+                entry.pipeline = None
+                self.unload()
+
+    def ensure(self, model_id):
+        """Load model_id onto the first tier (e.g. to warm it up)"""
+        with self.use(model_id):
+            pass
+
+    def discard(self, model_id):
+        """Mark model_id's pipeline stale, so its next use loads it afresh; never waits for a load
+
+        The stale pipeline is unloaded by the next load or promotion (or by its
+        last user, if it is in use then).
+        """
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is None:
+                self._discarded.add(model_id)
+                return
+            entry.stale = True
+        logger.info(f"Marked {model_id} stale; it will be reloaded on next use")
+
+    def state(self, model_id):
+        """not_loaded, loading, ready, offloaded, evicted or failed"""
+        with self._lock:
+            return self._metrics.get(model_id, {}).get('state', 'not_loaded')
+
+    def _acquire(self, model_id):
+        top = self.tiers[0]
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is not None and entry.tier == top and not entry.moving and not entry.stale:
+                return self._hit(entry)
+        with self._load_lock:
+            self._drop_stale()
+            with self._lock:
+                entry = self._entries.get(model_id)
+                if entry is not None and entry.tier == top:
+                    return self._hit(entry)
+                if entry is not None:
+                    # Pinned, so making room for it never moves it
+                    entry.in_use += 1
+            if entry is not None:
+                return self._promote(entry)
+            return self._load(model_id)
+
+    def _drop_stale(self):
+        """Remove stale entries (called with _load_lock held); ones in use are freed by their last user"""
+        with self._lock:
+            stale = [entry for entry in self._entries.values() if entry.stale]
+            freed = [entry for entry in stale if not entry.in_use]
+            for entry in stale:
+                del self._entries[entry.model_id]
+                self._metric(entry.model_id).update(state='not_loaded', tier=None)
+            for entry in freed:
+                entry.pipeline = None
+        if freed:
+            self.unload()
+        for entry in stale:
+            logger.info(f"Dropped stale {entry.model_id}")
+
+    def _hit(self, entry):
+        entry.in_use += 1
+        self._entries.move_to_end(entry.model_id)
+        self._metric(entry.model_id)['hits'] += 1
+        return entry
+
+    def _promote(self, entry):
+        """Move an offloaded (and already pinned) pipeline back to the first tier"""
+        top = self.tiers[0]
+        try:
+            self._make_room(top, entry.size)
+            started = time.perf_counter()
+            self.move(entry.pipeline, top)
+        except BaseException:
+            with self._lock:
+                entry.in_use -= 1
+            raise
+        seconds = round(time.perf_counter() - started, 2)
+        with self._lock:
+            entry.tier = top
+            self._entries.move_to_end(entry.model_id)
+            metric = self._metric(entry.model_id)
+            metric.update(state='ready', tier=top, last_promote_seconds=seconds)
+            metric['promotions'] += 1
+        logger.info(f"Moved {entry.model_id} back to {top} in {seconds}s")
+        return entry
+
+    def _load(self, model_id):
+        top = self.tiers[0]
+        with self._lock:
+            metric = self._metric(model_id)
+            metric.update(state='loading', error=None, load_started_at=datetime.now().isoformat(), load_finished_at=None)
+            needed = self.estimate(model_id) or metric['size_bytes'] or 0
+            self._discarded.discard(model_id)
+        started = time.perf_counter()
+        try:
+            # Make room up front so the new pipeline doesn't push memory over the limit while it loads
+            self._make_room(top, needed)
+            pipeline, phases = self.load(model_id)
+            moved = time.perf_counter()
+            self.move(pipeline, top)
+            phases['device_move_seconds'] = round(time.perf_counter() - moved, 2)
+        except Exception as e:
+            with self._lock:
+                metric.update(state='failed', error=str(e), load_finished_at=datetime.now().isoformat())
+            self.unload()
+            raise
+        seconds = time.perf_counter() - started
+        entry = _Entry(model_id, pipeline, top, self.size_of(pipeline))
+        entry.in_use = 1
+        with self._lock:
+            self._entries[model_id] = entry
+            # Discarded while loading: serve this request, then reload on next use
+            entry.stale = model_id in self._discarded
+            self._discarded.discard(model_id)
+        # The estimate may have been low (or missing): settle the budget with the real size
+        self._make_room(top, 0)
+        with self._lock:
+            metric.update(state='ready', tier=top, size_bytes=entry.size, last_load_seconds=round(seconds, 2),
+                          last_load_phases=phases, load_finished_at=datetime.now().isoformat())
+            metric['loads'] += 1
+            metric['load_seconds_total'] = round(metric['load_seconds_total'] + seconds, 2)
+        logger.info(f"Loaded {model_id} ({entry.size / GB:.1f} GB) on {top} in {seconds:.1f}s: {phases}")
+        return entry
+
+    def _make_room(self, tier, needed):
+        """Move least recently used pipelines off tier until needed more bytes fit in its budget
+
+        Called with _load_lock held and _lock released: each victim is picked and
+        marked under _lock, then moved without it.
+        """
+        budget = self.budgets[tier]
+        while True:
+            with self._lock:
+                used = self._used(tier)
+                if used + needed <= budget:
+                    return
+                victim = next((entry for entry in self._entries.values()
+                               if entry.tier == tier and not entry.in_use and not entry.moving), None)
+                if victim is None:
+                    logger.warning(f"{tier} is over its {budget / GB:.1f} GB budget: "
+                                   f"{(used + needed) / GB:.1f} GB needed by pipelines in use")
+                    return
+                victim.moving = True
+            try:
+                self._demote(victim)
+            finally:
+                with self._lock:
+                    victim.moving = False
+
+    def _demote(self, entry):
+        index = self.tiers.index(entry.tier)
+        if index + 1 < len(self.tiers):
+            lower = self.tiers[index + 1]
+            self._make_room(lower, entry.size)
+            with self._lock:
+                fits = self._used(lower) + entry.size <= self.budgets[lower]
+            if fits:
+                self.move(entry.pipeline, lower)
+                with self._lock:
+                    entry.tier = lower
+                    metric = self._metric(entry.model_id)
+                    metric.update(state='offloaded', tier=lower)
+                    metric['offloads'] += 1
+                logger.info(f"Offloaded {entry.model_id} from {self.tiers[index]} to {lower}")
+                return
+        with self._lock:
+            del self._entries[entry.model_id]
+            entry.pipeline = None
+            metric = self._metric(entry.model_id)
+            metric.update(state='evicted', tier=None)
+            metric['evictions'] += 1
+        self.unload()
+        logger.info(f"Unloaded {entry.model_id} to make room")
+
+    def _used(self, tier):
+        return sum(entry.size for entry in self._entries.values() if entry.tier == tier)
+
+    def _metric(self, model_id):
+        metric = self._metrics.get(model_id)
+        if metric is None:
+            metric = self._metrics[model_id] = {
+                'state': 'not_loaded', 'tier': None, 'size_bytes': None, 'error': None,
+                'loads': 0, 'load_seconds_total': 0.0, 'last_load_seconds': None, 'last_load_phases': {},
+                'load_started_at': None, 'load_finished_at': None, 'last_used': None,
+                'hits': 0, 'offloads': 0, 'promotions': 0, 'last_promote_seconds': None, 'evictions': 0,
+            }
+        return metric
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tiers': {
+                    tier: {'budget_gb': round(budget / GB, 2), 'used_gb': round(self._used(tier) / GB, 2)}
+                    for tier, budget in self.budgets.items()
+                },
+                'models': {model_id: dict(metric) for model_id, metric in self._metrics.items()},
+            }
+
+    def model_stats(self, model_id):
+        with self._lock:
+            return dict(self._metric(model_id))
@@ -0,0 +1,16 @@
+"""
+Peak memory of the current process, for load timings and benchmarks
+"""
+
+import sys
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far in MB (None where the OS doesn't report it)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
@@ -0,0 +1,169 @@
+"""
+Near-duplicate index over previously generated prompts
+Prompts are canonicalized (case, punctuation, whitespace and the order of the
+comma-separated style/effect tags no longer matter) and fingerprinted with a
+64-bit SimHash of their word unigrams and bigrams. Fingerprints are split into bands, so any stored prompt within
+BANDS - 1 bits of a query shares at least one band with it exactly and is found
+with a few dictionary lookups.
+"""
+
+import hashlib
+import re
+import threading
+import unicodedata
+from array import array
+
+FINGERPRINT_BITS = 64
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Articles carry no visual content; dropped so "a cat on the boat" matches "cat on boat".
+# Prepositions stay: "a cat under the boat" is a different video
+ARTICLES = frozenset(('a', 'an', 'the'))
+
+_NON_WORD = re.compile(r'[^\w\s]+')
+
+
+def canonicalize_prompt(prompt):
+    """Lower-case, strip punctuation and sort the prompt's comma-separated segments"""
+    text = unicodedata.normalize('NFKC', prompt).lower()
+    segments = set()
+    for segment in text.split(','):
+        words = _NON_WORD.sub(' ', segment).split()
+        if words:
+            segments.add(' '.join(words))
+    return ', '.join(sorted(segments))
+
+
+def prompt_features(canonical):
+    """Word unigrams and bigrams of each segment of a canonical prompt, without articles
+
+    Bigrams keep the word order within a segment, so "man bites dog" and "dog
+    bites man" get different fingerprints; only whole segments are reorderable.
+    """
+    features = set()
+    for segment in canonical.split(', '):
+        words = [word for word in segment.split() if word not in ARTICLES] or segment.split()
+        features.update(words)
+        features.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+    return features
+
+
+def simhash(features):
+    """64-bit SimHash of a set of string features"""
+    counts = [0] * FINGERPRINT_BITS
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            if value >> bit & 1:
+                counts[bit] += 1
+            else:
+                counts[bit] -= 1
+    fingerprint = 0
+    for bit, count in enumerate(counts):
+        if count > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def fingerprint_prompt(prompt):
+    return simhash(prompt_features(canonicalize_prompt(prompt)))
+
+
+def similarity(distance):
+    """Similarity in [0, 1] reported for a Hamming distance between fingerprints"""
+    return 1 - distance / FINGERPRINT_BITS
+
+
+class PromptIndex:
+    """Bounded SimHash index of prompts, partitioned by scope (e.g. model and seed)
+
+    Entries live in fixed-size arrays used as a ring buffer; once full, the
+    oldest entry is overwritten. Band tables map (scope, band, band value) to
+    slot numbers; references left behind by overwritten slots are filtered on
+    lookup and dropped when the tables are rebuilt.
+    """
+
+    def __init__(self, max_entries=1_000_000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._fingerprints = array('Q')
+        self._scopes = array('I')
+        self._keys = []
+        self._next_slot = 0
+        self._scope_ids = {}
+        self._tables = {}
+        self._stale_refs = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, scope, prompt, key):
+        """Index prompt under scope, pointing at key (e.g. a result cache key)"""
+        self.add_fingerprint(scope, fingerprint_prompt(prompt), key)
+
+    def add_fingerprint(self, scope, fingerprint, key):
+        with self._lock:
+            scope_id = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            for slot in self._candidates_locked(scope_id, fingerprint):
+                if self._fingerprints[slot] == fingerprint and self._keys[slot] == key:
+                    return
+            if len(self._keys) < self.max_entries:
+                slot = len(self._keys)
+                self._fingerprints.append(fingerprint)
+                self._scopes.append(scope_id)
+                self._keys.append(key)
+            else:
+                slot = self._next_slot
+                self._next_slot = (slot + 1) % self.max_entries
+                self._fingerprints[slot] = fingerprint
+                self._scopes[slot] = scope_id
+                self._keys[slot] = key
+                self._stale_refs += BANDS
+                if self._stale_refs > len(self._keys) * BANDS:
+                    self._rebuild_locked()
+                    return
+            self._insert_refs_locked(slot, scope_id, fingerprint)
+
+    def find(self, scope, prompt, max_distance=BANDS - 1):
+        """Keys of indexed prompts within max_distance bits, as (key, distance), closest first"""
+        fingerprint = fingerprint_prompt(prompt)
+        with self._lock:
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None:
+                return []
+            matches = {}
+            for slot in self._candidates_locked(scope_id, fingerprint):
+                distance = (self._fingerprints[slot] ^ fingerprint).bit_count()
+                if distance <= max_distance:
+                    key = self._keys[slot]
+                    matches[key] = min(distance, matches.get(key, distance))
+        return sorted(matches.items(), key=lambda item: item[1])
+
+    def _candidates_locked(self, scope_id, fingerprint):
+        seen = set()
+        for band in range(BANDS):
+            value = fingerprint >> (band * BAND_BITS) & BAND_MASK
+            for slot in self._tables.get((scope_id, band, value), ()):
+                if slot in seen or self._scopes[slot] != scope_id:
+                    continue
+                # A reference left by an overwritten slot no longer matches its band
+                if self._fingerprints[slot] >> (band * BAND_BITS) & BAND_MASK != value:
+                    continue
+                seen.add(slot)
+                yield slot
+
+    def _insert_refs_locked(self, slot, scope_id, fingerprint):
+        for band in range(BANDS):
+            value = fingerprint >> (band * BAND_BITS) & BAND_MASK
+            refs = self._tables.get((scope_id, band, value))
+            if refs is None:
+                refs = self._tables[(scope_id, band, value)] = array('I')
+            refs.append(slot)
+
+    def _rebuild_locked(self):
+        self._tables = {}
+        for slot, (scope_id, fingerprint) in enumerate(zip(self._scopes, self._fingerprints)):
+            self._insert_refs_locked(slot, scope_id, fingerprint)
+        self._stale_refs = 0
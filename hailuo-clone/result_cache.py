@@ -0,0 +1,269 @@
+"""
+Disk-backed cache of finished generation results
+Entries are content-addressed by a hash of everything that affects the output
+(model, enhanced prompt, seed and model params) and evicted by LRU, TTL and size
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model_id, enhanced_prompt, seed, params):
+    """Stable hash of the inputs that determine a generated video"""
+    material = json.dumps({
+        'model': model_id,
+        'prompt': enhanced_prompt,
+        'seed': seed,
+        'params': params,
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """LRU + TTL cache of JSON payloads stored one file per entry"""
+
+    def __init__(self, cache_dir, ttl_seconds=86400, max_bytes=50 * 1024 * 1024, max_entries=10000):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (size_bytes, stored_at); ordered from least to most recently used
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def get(self, key):
+        """Return (payload, stored_at) for key, or None on a miss or expired entry"""
+        if not self._touch(key):
+            self._count(hit=False)
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+            self._forget(key)
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return record['payload'], record['stored_at']
+
+    def put(self, key, payload):
+        """Store payload under key, evicting old entries to stay within budget"""
+        stored_at = time.time()
+        data = json.dumps({'stored_at': stored_at, 'payload': payload}).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        self._record(key, len(data), stored_at)
+
+    def iter_payloads(self):
+        """Yield (key, payload) for every entry on disk, without counting hits"""
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.cache_dir, name), 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield name[:-len('.json')], record['payload']
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        entries, total_bytes = self._summary()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # Index operations; SharedResultCache keeps the same index in SQLite instead
+
+    def _touch(self, key):
+        """Mark key as used; False if it is missing or expired (expired entries are dropped)"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return False
+            if time.time() - entry[1] > self.ttl_seconds:
+                self._remove_locked(key)
+                return False
+            self._index.move_to_end(key)
+            return True
+
+    def _record(self, key, size, stored_at):
+        with self._lock:
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)[0]
+            self._index[key] = (size, stored_at)
+            self._total_bytes += size
+            self._evict_locked()
+
+    def _forget(self, key):
+        with self._lock:
+            self._remove_locked(key)
+
+    def _summary(self):
+        with self._lock:
+            return len(self._index), self._total_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _scan_files(self):
+        """(stored_at, key, size) for every entry file on disk, removing leftover temp files"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.unlink(path)
+                continue
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # Files are never rewritten in place, so mtime is when the entry was stored.
+            # Recency is only tracked in memory; after a restart the oldest entries go first.
+            entries.append((st.st_mtime, name[:-len('.json')], st.st_size))
+        return entries
+
+    def _load_index(self):
+        """Rebuild the in-memory index from files left by a previous run"""
+        entries = self._scan_files()
+        for stored_at, key, size in sorted(entries):
+            self._index[key] = (size, stored_at)
+            self._total_bytes += size
+        self._evict_locked()
+        if entries:
+            logger.info(f"Loaded {len(self._index)} cached results ({self._total_bytes} bytes)")
+
+    def _evict_locked(self):
+        now = time.time()
+        expired = [key for key, (_, stored_at) in self._index.items() if now - stored_at > self.ttl_seconds]
+        for key in expired:
+            self._remove_locked(key)
+        while self._index and (self._total_bytes > self.max_bytes or len(self._index) > self.max_entries):
+            key = next(iter(self._index))
+            self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry[0]
+        self._unlink(key)
+
+    def _unlink(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+
+class SharedResultCache(ResultCache):
+    """ResultCache whose index lives in a SharedState database
+
+    Entry files are already shared on disk; sharing the index as well means a
+    result stored by one worker process is a hit in all of them, and the size
+    budget and LRU order apply to the cache as a whole.
+    """
+
+    def __init__(self, shared, cache_dir, **kwargs):
+        self.shared = shared
+        super().__init__(cache_dir, **kwargs)
+
+    def _touch(self, key):
+        with self.shared.transaction() as db:
+            row = db.execute("SELECT stored_at FROM result_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            if time.time() - row[0] > self.ttl_seconds:
+                db.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                self._unlink(key)
+                return False
+            db.execute("UPDATE result_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+            return True
+
+    def _record(self, key, size, stored_at):
+        with self.shared.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO result_cache (key, size, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, size, stored_at, stored_at)
+            )
+            self._evict(db)
+
+    def _forget(self, key):
+        with self.shared.transaction() as db:
+            db.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+        self._unlink(key)
+
+    def _summary(self):
+        return tuple(self.shared.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache").fetchone())
+
+    def _load_index(self):
+        """Add entry files not yet in the shared index (e.g. from a single-process run)"""
+        entries = self._scan_files()
+        with self.shared.transaction() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO result_cache (key, size, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                [(key, size, stored_at, stored_at) for stored_at, key, size in entries]
+            )
+            # Rows whose file was removed by hand would otherwise count against the budget forever
+            on_disk = {key for _, key, _ in entries}
+            missing = [(key,) for (key,) in db.execute("SELECT key FROM result_cache") if key not in on_disk]
+            db.executemany("DELETE FROM result_cache WHERE key = ?", missing)
+            self._evict(db)
+        entries_count, total_bytes = self._summary()
+        if entries_count:
+            logger.info(f"Shared result cache index has {entries_count} entries ({total_bytes} bytes)")
+
+    def _evict(self, db):
+        expired = db.execute(
+            "SELECT key FROM result_cache WHERE stored_at < ?", (time.time() - self.ttl_seconds,)
+        ).fetchall()
+        entries, total_bytes = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache").fetchone()
+        victims = [key for (key,) in expired]
+        if total_bytes > self.max_bytes or entries > self.max_entries:
+            for key, size in db.execute("SELECT key, size FROM result_cache ORDER BY used_at"):
+                if total_bytes <= self.max_bytes and entries <= self.max_entries:
+                    break
+                if key not in victims:
+                    victims.append(key)
+                    total_bytes -= size
+                    entries -= 1
+        for key in victims:
+            db.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+            self._unlink(key)
@@ -0,0 +1,204 @@
+"""
+Priority and fair-share scheduling of a model's upstream slots
+Waiting requests are served strictly by priority class (interactive before
+batch before background). Within a class, tenants share the slots in proportion
+to their weights using start-time fair queuing, so one tenant's thousand queued
+requests don't delay another tenant's first one. The scheduler is work-conserving:
+a free slot always goes to whoever is waiting, so a lower class gets the full
+capacity whenever no higher class is queued.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+
+PRIORITIES = ('interactive', 'batch', 'background')
+PRIORITY_RANKS = {name: rank for rank, name in enumerate(PRIORITIES)}
+
+
+def parse_weights(text):
+    """Tenant weights from "tenant=weight,..." (e.g. "key:abc=4,ip:10.0.0.5=0.5")"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        tenant, separator, weight = item.rpartition('=')
+        if not separator or not tenant or float(weight) <= 0:
+            raise ValueError(f"Invalid tenant weight {item!r}; expected tenant=positive number")
+        weights[tenant.strip()] = float(weight)
+    return weights
+
+
+class Ticket:
+    """One request's place in a FairQueue"""
+
+    __slots__ = ('priority', 'tenant', 'key', 'waker', 'granted', 'cancelled')
+
+    def __init__(self, priority, tenant, key, waker):
+        self.priority = priority
+        self.tenant = tenant
+        # (priority rank, start tag, arrival sequence): lower is served first
+        self.key = key
+        # Whatever the wrapper uses to wake the waiter (an Event or a Future)
+        self.waker = waker
+        self.granted = False
+        self.cancelled = False
+
+
+class FairQueue:
+    """Slot bookkeeping and service order for one model; callers provide the locking"""
+
+    def __init__(self, capacity, weight_for=None, max_tenants=10000):
+        self.capacity = capacity
+        # weight_for(tenant) -> share relative to other tenants of the same class (default 1)
+        self.weight_for = weight_for or (lambda tenant: 1)
+        self.max_tenants = max_tenants
+        self.in_flight = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        self._virtual_time = {priority: 0.0 for priority in PRIORITIES}
+        # (priority, tenant) -> finish tag of the tenant's last queued request
+        self._finish_tags = {}
+
+    def push(self, priority, tenant, waker=None):
+        """Queue a request; call pop_ready() afterwards to grant any free slots"""
+        if priority not in PRIORITY_RANKS:
+            raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+        start = max(self._virtual_time[priority], self._finish_tags.get((priority, tenant), 0.0))
+        self._finish_tags[(priority, tenant)] = start + 1.0 / max(float(self.weight_for(tenant)), 1e-6)
+        if len(self._finish_tags) > self.max_tenants:
+            self._prune_tags()
+        ticket = Ticket(priority, tenant, (PRIORITY_RANKS[priority], start, next(self._seq)), waker)
+        heapq.heappush(self._heap, (ticket.key, ticket))
+        self._waiting[priority] += 1
+        return ticket
+
+    def pop_ready(self):
+        """Grant free slots to the best waiting tickets and return them"""
+        granted = []
+        while self.in_flight < self.capacity and self._heap:
+            _, ticket = heapq.heappop(self._heap)
+            if ticket.cancelled:
+                continue
+            self._waiting[ticket.priority] -= 1
+            self._virtual_time[ticket.priority] = ticket.key[1]
+            ticket.granted = True
+            self.in_flight += 1
+            granted.append(ticket)
+        return granted
+
+    def cancel(self, ticket):
+        """Withdraw a waiting ticket; returns False if it had already been granted a slot"""
+        if ticket.granted:
+            return False
+        if not ticket.cancelled:
+            ticket.cancelled = True
+            self._waiting[ticket.priority] -= 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def waiting(self, priority=None):
+        """Requests waiting in total, or those a new request of the given priority would queue behind"""
+        if priority is None:
+            return sum(self._waiting.values())
+        rank = PRIORITY_RANKS[priority]
+        return sum(count for name, count in self._waiting.items() if PRIORITY_RANKS[name] <= rank)
+
+    def ahead(self, ticket):
+        """Number of waiting requests that will be served before ticket"""
+        if ticket.granted or ticket.cancelled:
+            return 0
+        return sum(1 for key, other in self._heap if key < ticket.key and not other.cancelled)
+
+    def stats(self):
+        return {'capacity': self.capacity, 'in_flight': self.in_flight, 'waiting': dict(self._waiting)}
+
+    def _prune_tags(self):
+        # A finish tag at or behind its class's virtual time gives the tenant no credit or debt
+        self._finish_tags = {
+            key: tag for key, tag in self._finish_tags.items() if tag > self._virtual_time[key[0]]
+        }
+
+
+class FairSlots:
+    """FairQueue for threads: acquire() blocks until the request's turn"""
+
+    def __init__(self, capacity, weight_for=None):
+        self._lock = threading.Lock()
+        self.queue = FairQueue(capacity, weight_for)
+
+    def acquire(self, priority, tenant, timeout=None, on_wait=None):
+        """Wait for a slot; returns False on timeout. on_wait(ticket) is called if the request has to queue"""
+        with self._lock:
+            ticket = self.queue.push(priority, tenant, threading.Event())
+            ready = self.queue.pop_ready()
+        for granted in ready:
+            granted.waker.set()
+        if ticket.granted:
+            return True
+        if on_wait is not None:
+            on_wait(ticket)
+        if ticket.waker.wait(timeout):
+            return True
+        with self._lock:
+            # Granted at the last moment: keep the slot
+            return not self.queue.cancel(ticket)
+
+    def release(self):
+        with self._lock:
+            self.queue.release()
+            ready = self.queue.pop_ready()
+        for granted in ready:
+            granted.waker.set()
+
+    def ahead(self, ticket):
+        with self._lock:
+            return self.queue.ahead(ticket)
+
+    def load(self, priority=None):
+        """(in_flight, waiting, capacity); waiting counts only what priority would queue behind"""
+        with self._lock:
+            return self.queue.in_flight, self.queue.waiting(priority), self.queue.capacity
+
+    def stats(self):
+        with self._lock:
+            return self.queue.stats()
+
+
+class AsyncFairSlots:
+    """FairQueue for coroutines on one event loop"""
+
+    def __init__(self, capacity, weight_for=None):
+        self.queue = FairQueue(capacity, weight_for)
+
+    async def acquire(self, priority, tenant, timeout=None):
+        """Wait for a slot; raises TimeoutError if none frees up within timeout"""
+        ticket = self.queue.push(priority, tenant, asyncio.get_running_loop().create_future())
+        self._wake(self.queue.pop_ready())
+        if ticket.granted:
+            return
+        try:
+            await asyncio.wait_for(ticket.waker, timeout)
+        except BaseException:
+            # Timed out or cancelled; if the slot was granted meanwhile, hand it on
+            if not self.queue.cancel(ticket):
+                self.release()
+            raise
+
+    def release(self):
+        self.queue.release()
+        self._wake(self.queue.pop_ready())
+
+    def load(self, priority=None):
+        return self.queue.in_flight, self.queue.waiting(priority), self.queue.capacity
+
+    def stats(self):
+        return self.queue.stats()
+
+    @staticmethod
+    def _wake(tickets):
+        for ticket in tickets:
+            if not ticket.waker.done():
+                ticket.waker.set_result(True)
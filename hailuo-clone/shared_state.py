@@ -0,0 +1,114 @@
+"""
+SQLite store for state shared by worker processes on one host
+Used when the backend runs under a pre-fork server: circuit breakers, the result
+cache index, rate-limit buckets, held model slots and the job table live here
+instead of in each worker's memory. WAL mode lets readers run alongside the single writer. A single
+process can use one too, for a job table that survives restarts.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS circuits (
+    model_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    opened_at REAL,
+    probe_started_at REAL,
+    last_error TEXT,
+    times_opened INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS result_cache_used_at ON result_cache (used_at);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    request TEXT NOT NULL,
+    state TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    version INTEGER NOT NULL,
+    args TEXT,
+    kwargs TEXT,
+    upstream TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    priority_rank INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE TABLE IF NOT EXISTS model_slots (
+    holder TEXT PRIMARY KEY,
+    model_id TEXT NOT NULL,
+    lease_until REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS model_slots_model_id ON model_slots (model_id);
+"""
+
+
+class SharedState:
+    """One SQLite database in WAL mode, with a connection per thread and process"""
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection().executescript(SCHEMA)
+        logger.info(f"Using shared state at {path}")
+
+    def connection(self):
+        """This thread's connection; reopened after a fork since SQLite handles can't cross one"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Durable enough for state that can be rebuilt; avoids an fsync per write
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Close this thread's connection, e.g. in the master process before forking workers"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def transaction(self):
+        """Run a read-modify-write under SQLite's write lock"""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
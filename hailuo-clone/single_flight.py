@@ -0,0 +1,123 @@
+"""
+Single-flight coalescing of identical in-flight calls
+The first caller for a key runs the work; callers that arrive while it is
+still running wait for it and share its result (or its exception)
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    """One in-flight execution and the callers waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func, *args, timeout=None, **kwargs):
+        """Run func once per key at a time; return (result, shared)
+
+        shared is True when the result came from a call started by another caller.
+        A caller that attaches to a running call waits at most timeout seconds
+        for it (raising TimeoutError); the call itself is left running.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    call.waiters -= 1
+                raise TimeoutError(f"Gave up waiting for the in-flight call after {timeout}s")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def waiters(self, key):
+        """Number of callers attached to the running call for key, besides its leader"""
+        with self._lock:
+            call = self._calls.get(key)
+            return call.waiters if call is not None else 0
+
+    def in_flight(self):
+        """Number of distinct keys currently running"""
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """asyncio version of SingleFlight for use on a single event loop
+
+    The leader's work runs as its own task, so a waiter that is cancelled (for
+    example because its client disconnected) does not cancel the shared call
+    while others still wait on it. Once every waiter is gone, the call is cancelled.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._waiters = {}
+        self.coalesced = 0
+
+    async def do(self, key, coroutine_factory):
+        """Await coroutine_factory() once per key at a time; return (result, shared)"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(coroutine_factory())
+            self._tasks[key] = task
+            self._waiters[key] = 0
+
+            def finished(done_task):
+                self._tasks.pop(key, None)
+                self._waiters.pop(key, None)
+                # Mark the error as retrieved even if every waiter has gone away
+                if not done_task.cancelled():
+                    done_task.exception()
+
+            task.add_done_callback(finished)
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if not task.done():
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0:
+                    task.cancel()
+            raise
+
+    def in_flight(self):
+        return len(self._tasks)
@@ -0,0 +1,149 @@
+"""
+Streaming VAE decode and incremental MP4 encoding
+Decodes a video's latents a few latent frames at a time, carrying the VAE's
+causal-convolution cache from one chunk to the next, and hands each decoded
+chunk to the MP4 encoder right away. Only one chunk of decoded frames exists at
+a time, so memory stays flat as the number of frames grows.
+"""
+
+import inspect
+import queue
+import threading
+
+import imageio
+import torch
+
+
+def supports_streaming(pipeline):
+    """Whether the pipeline's VAE can decode in temporal chunks (the CogVideoX VAE)"""
+    vae = getattr(pipeline, 'vae', None)
+    return vae is not None and hasattr(vae, 'num_latent_frames_batch_size') and hasattr(vae, 'decoder')
+
+
+@torch.no_grad()
+def decode_chunks(pipeline, latents):
+    """Decode one video's latents ([frames, channels, height, width]) into uint8 [frames, H, W, 3] chunks
+
+    Chunks follow the VAE's own temporal batching (the same split vae.decode()
+    uses internally), so the frames match a full decode. With vae.enable_tiling()
+    each chunk is decoded tile by tile, every tile carrying its own causal-conv
+    cache, and the tiles are blended as vae.tiled_decode() does.
+    """
+    vae = pipeline.vae
+    scaling_factor = getattr(pipeline, 'vae_scaling_factor_image', None) or vae.config.scaling_factor
+    z = latents.unsqueeze(0).permute(0, 2, 1, 3, 4).to(vae.dtype) / scaling_factor
+    batch = vae.num_latent_frames_batch_size
+    num_frames, height, width = z.shape[2:]
+    remaining = num_frames % batch
+    # Newer diffusers pass the causal-conv cache explicitly; older versions keep it inside the modules
+    explicit_cache = 'conv_cache' in inspect.signature(vae.decoder.forward).parameters
+    # Same condition vae.decode() uses to switch to tiled decoding
+    tiled = getattr(vae, 'use_tiling', False) and (
+        width > vae.tile_latent_min_width or height > vae.tile_latent_min_height)
+    if tiled and not explicit_cache:
+        # A single in-module cache can't follow several tiles through time: decode the
+        # whole video tiled, trading the flat memory of streaming for tiling's
+        yield to_uint8_frames(vae.decode(z).sample)
+        return
+    conv_cache = {} if tiled else None
+    try:
+        for i in range(max(num_frames // batch, 1)):
+            start = batch * i + (0 if i == 0 else remaining)
+            end = batch * (i + 1) + remaining
+            chunk = z[:, :, start:end]
+            if tiled:
+                chunk = _decode_tiled(vae, chunk, conv_cache)
+            else:
+                chunk, conv_cache = _decode(vae, chunk, conv_cache, explicit_cache)
+            yield to_uint8_frames(chunk)
+    finally:
+        if not explicit_cache and hasattr(vae, '_clear_fake_context_parallel_cache'):
+            vae._clear_fake_context_parallel_cache()
+
+
+def _decode(vae, z, conv_cache, explicit_cache):
+    if vae.post_quant_conv is not None:
+        z = vae.post_quant_conv(z)
+    if explicit_cache:
+        return vae.decoder(z, conv_cache=conv_cache)
+    return vae.decoder(z), None
+
+
+def _decode_tiled(vae, z, conv_caches):
+    """One temporal chunk through vae.tiled_decode()'s tiling; conv_caches maps each tile to its cache"""
+    overlap_height = int(vae.tile_latent_min_height * (1 - vae.tile_overlap_factor_height))
+    overlap_width = int(vae.tile_latent_min_width * (1 - vae.tile_overlap_factor_width))
+    blend_height = int(vae.tile_sample_min_height * vae.tile_overlap_factor_height)
+    blend_width = int(vae.tile_sample_min_width * vae.tile_overlap_factor_width)
+    rows = []
+    for i in range(0, z.shape[3], overlap_height):
+        row = []
+        for j in range(0, z.shape[4], overlap_width):
+            tile = z[:, :, :, i:i + vae.tile_latent_min_height, j:j + vae.tile_latent_min_width]
+            tile, conv_caches[i, j] = _decode(vae, tile, conv_caches.get((i, j)), True)
+            row.append(tile)
+        rows.append(row)
+    result_rows = []
+    for i, row in enumerate(rows):
+        result_row = []
+        for j, tile in enumerate(row):
+            if i > 0:
+                tile = vae.blend_v(rows[i - 1][j], tile, blend_height)
+            if j > 0:
+                tile = vae.blend_h(row[j - 1], tile, blend_width)
+            result_row.append(tile[:, :, :, :vae.tile_sample_min_height - blend_height,
+                                   :vae.tile_sample_min_width - blend_width])
+        result_rows.append(torch.cat(result_row, dim=4))
+    return torch.cat(result_rows, dim=3)
+
+
+def to_uint8_frames(decoded):
+    """[1, 3, frames, H, W] VAE output in [-1, 1] -> uint8 numpy [frames, H, W, 3]"""
+    frames = (decoded[0].permute(1, 2, 3, 0).float() * 0.5 + 0.5).clamp(0, 1)
+    return frames.mul(255).round().to(torch.uint8).cpu().numpy()
+
+
+def write_video(chunks, path, fps, queue_size=2):
+    """Encode frame chunks into an MP4 as they arrive; returns the number of frames written
+
+    Encoding runs on its own thread, so the next chunk is decoded while the
+    previous one is encoded; at most queue_size chunks wait in between.
+    """
+    pending = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def encode():
+        writer = None
+        try:
+            # Same settings as diffusers' export_to_video
+            writer = imageio.get_writer(path, fps=fps, quality=5.0, macro_block_size=16)
+            while (chunk := pending.get()) is not None:
+                for frame in chunk:
+                    writer.append_data(frame)
+        except Exception as e:
+            errors.append(e)
+            # Keep taking chunks so the producer never blocks on a full queue
+            while pending.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception as e:
+                    errors.append(e)
+
+    encoder = threading.Thread(target=encode, name='video-encoder', daemon=True)
+    encoder.start()
+    frames = 0
+    try:
+        for chunk in chunks:
+            if errors:
+                break
+            pending.put(chunk)
+            frames += len(chunk)
+    finally:
+        pending.put(None)
+        encoder.join()
+    if errors:
+        raise errors[0]
+    return frames
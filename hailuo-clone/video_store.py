@@ -0,0 +1,170 @@
+"""
+Local content-addressed store for generated videos
+Space outputs are temporary paths or URLs; each finished video is copied here
+once, named by the sha256 of its bytes, and served from /videos/<digest> so
+replays and seeking read local disk instead of Hugging Face
+"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.mov', '.mkv', '.gif')
+
+
+def source_location(result):
+    """Path or URL of the video in a Space result ({'video': ...} dicts included)"""
+    if isinstance(result, dict):
+        result = result.get('video') or result.get('path') or result.get('url')
+    return result if isinstance(result, str) and result else None
+
+
+def guess_mimetype(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+class VideoStore:
+    """Directory of videos named <sha256><ext>, evicted least recently served first"""
+
+    def __init__(self, store_dir, max_bytes=5 * 1024 * 1024 * 1024, download_timeout=120):
+        # Absolute, since Flask's send_file resolves relative paths against the app's root, not the CWD
+        self.store_dir = os.path.abspath(store_dir)
+        self.max_bytes = max_bytes
+        self.download_timeout = download_timeout
+        self._lock = threading.Lock()
+        # digest -> (size_bytes, filename); ordered from least to most recently used
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._load_index()
+
+    def ingest(self, source):
+        """Copy a local path or http(s) URL into the store and return its digest"""
+        ext = os.path.splitext(source.split('?', 1)[0])[1].lower()
+        if ext not in VIDEO_EXTENSIONS:
+            ext = '.mp4'
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in self._read_chunks(source):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            if size == 0:
+                raise ValueError(f'Video at {source} is empty')
+            digest = digest.hexdigest()
+            filename = digest + ext
+            with self._lock:
+                if digest in self._index:
+                    os.unlink(tmp_path)
+                    self._index.move_to_end(digest)
+                    return digest
+                os.replace(tmp_path, os.path.join(self.store_dir, filename))
+                self._index[digest] = (size, filename)
+                self._total_bytes += size
+                self._evict_locked()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        logger.info(f"Stored video {digest[:12]} ({size} bytes) from {source}")
+        return digest
+
+    def path_for(self, digest):
+        """Local path of a stored video, or None if it is unknown or was evicted"""
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        with self._lock:
+            entry = self._index.get(digest)
+            if entry is not None:
+                self._index.move_to_end(digest)
+        if entry is None:
+            entry = self._adopt(digest)
+            if entry is None:
+                return None
+        return os.path.join(self.store_dir, entry[1])
+
+    def contains(self, digest):
+        with self._lock:
+            if digest in self._index:
+                return True
+        return self._adopt(digest) is not None
+
+    def _adopt(self, digest):
+        """Index a video another worker process stored since this one loaded the directory"""
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        for ext in VIDEO_EXTENSIONS:
+            try:
+                size = os.stat(os.path.join(self.store_dir, digest + ext)).st_size
+            except OSError:
+                continue
+            with self._lock:
+                if digest not in self._index:
+                    self._index[digest] = (size, digest + ext)
+                    self._total_bytes += size
+                return self._index[digest]
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {'videos': len(self._index), 'bytes': self._total_bytes}
+
+    def _read_chunks(self, source):
+        if source.startswith(('http://', 'https://')):
+            with requests.get(source, stream=True, timeout=self.download_timeout) as response:
+                response.raise_for_status()
+                yield from response.iter_content(CHUNK_SIZE)
+        else:
+            with open(source, 'rb') as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    def _load_index(self):
+        """Rebuild the in-memory index from files left by a previous run"""
+        entries = []
+        for name in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, name)
+            if name.endswith('.tmp'):
+                os.unlink(path)
+                continue
+            digest, ext = os.path.splitext(name)
+            if not DIGEST_PATTERN.match(digest) or ext not in VIDEO_EXTENSIONS:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, digest, st.st_size, name))
+        for _, digest, size, name in sorted(entries):
+            self._index[digest] = (size, name)
+            self._total_bytes += size
+        self._evict_locked()
+        if entries:
+            logger.info(f"Loaded {len(self._index)} stored videos ({self._total_bytes} bytes)")
+
+    def _evict_locked(self):
+        # Always keep the newest video, even if it alone exceeds the budget
+        while len(self._index) > 1 and self._total_bytes > self.max_bytes:
+            digest, (size, name) = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.unlink(os.path.join(self.store_dir, name))
+            except OSError:
+                pass